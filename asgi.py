@@ -0,0 +1,5 @@
+from vitex_stats_server import create_app
+from vitex_stats_server.async_proxy import create_proxy_app
+
+# serves the gvite passthrough routes only, the other routes are served by wsgi.py
+app = create_proxy_app(create_app())
@@ -6,3 +6,6 @@ source prod_env.sh
 flask manage create-tables
 flask manage download-sbp
 flask manage download-tokens
+flask manage create-index-account-address-prefix
+flask manage create-index-account-block-export
+flask manage recompute-holder-ranks
@@ -1,3 +1,7 @@
 #!/usr/bin/env bash
 service nginx start
+# gvite passthrough routes, see asgi.py
+uvicorn asgi:app --host 127.0.0.1 --port 8001 --workers 2 --no-access-log &
+# metrics of the previous run
+rm -rf /tmp/vitex_metrics
 uwsgi --ini uwsgi.ini
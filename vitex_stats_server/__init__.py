@@ -1,13 +1,17 @@
 from .ledger import bp_ledger
 from .contract import bp_contract
 from .statistic import bp_statistic
-from .cli import bp_cli  # import cli after db to avoid circular dependency
+from .admin import bp_admin
+from .cli import bp_bench, bp_cli  # import cli after db to avoid circular dependency
 import os
 
 from flask import Flask
 from flask_cors import CORS
 
+from .column_types import set_binary_storage
+from .metrics import init_metrics
 from .models import db
+from .slow_query import init_slow_query
 
 CONFIG_ENV_VAR = "FLASK_CONFIG"
 
@@ -24,12 +28,17 @@ def create_app(test_config=None):
 
     CORS(app)
 
+    set_binary_storage(app.config.get('BINARY_STORAGE', False))
     db.init_app(app)
+    init_metrics(app)
+    init_slow_query(app)
 
     app.register_blueprint(bp_ledger)
     app.register_blueprint(bp_contract)
     app.register_blueprint(bp_statistic)
+    app.register_blueprint(bp_admin)
     app.register_blueprint(bp_cli)
+    app.register_blueprint(bp_bench)
 
     # ensure the instance folder exists
     try:
@@ -0,0 +1 @@
+from .services import *
@@ -0,0 +1,25 @@
+from ..models import SlowQuery, SlowQuerySchema, db
+
+schema_slow_query = SlowQuerySchema()
+
+SLOW_QUERY_ORDERS = {
+    'total': SlowQuery.total_seconds.desc(),
+    'max': SlowQuery.max_seconds.desc(),
+    'calls': SlowQuery.calls.desc(),
+    'mean': (SlowQuery.total_seconds / SlowQuery.calls).desc(),
+    'recent': SlowQuery.last_seen.desc(),
+}
+
+
+def db_get_slow_queries(order='total', limit=20):
+    '''
+    top offenders recorded by slow_query.py, order one of SLOW_QUERY_ORDERS
+    '''
+    return db.session.query(SlowQuery).order_by(
+        SLOW_QUERY_ORDERS.get(order, SLOW_QUERY_ORDERS['total'])).limit(limit).all()
+
+
+def db_reset_slow_queries():
+    count = db.session.query(SlowQuery).delete(synchronize_session=False)
+    db.session.commit()
+    return count
@@ -0,0 +1,43 @@
+import hmac
+
+from flask import request, jsonify, Blueprint
+from flask import current_app as app
+
+from .data_accessor import SLOW_QUERY_ORDERS, db_get_slow_queries, schema_slow_query
+
+bp_admin = Blueprint('admin', __name__, url_prefix='/admin')
+
+SLOW_QUERY_LIMIT_MAX = 200
+
+
+@bp_admin.before_request
+def check_admin_token():
+    '''
+    admin routes require the X-Admin-Token header to match ADMIN_TOKEN,
+    they are disabled when ADMIN_TOKEN is not set
+    '''
+    admin_token = app.config.get('ADMIN_TOKEN')
+    if not admin_token:
+        return jsonify({'err': 'not found'}), 404
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), admin_token):
+        return jsonify({'err': 'forbidden'}), 403
+
+
+@bp_admin.route('/slow_queries', methods=('GET', ))
+def get_slow_queries():
+    '''
+    query args: order (total, max, calls, mean or recent), limit
+    '''
+    order = request.args.get('order', 'total')
+    if order not in SLOW_QUERY_ORDERS:
+        return jsonify({'err': f'order must be one of {", ".join(SLOW_QUERY_ORDERS)}'}), 400
+    limit = request.args.get('limit', 20, type=int)
+    limit = max(1, min(limit, SLOW_QUERY_LIMIT_MAX))
+
+    slow_queries = db_get_slow_queries(order, limit)
+
+    return jsonify({
+        'err': 'ok',
+        'threshold': app.config.get('SLOW_QUERY_THRESHOLD'),
+        'slowQueries': schema_slow_query.dump(slow_queries, many=True)
+    })
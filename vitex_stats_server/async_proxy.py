@@ -0,0 +1,147 @@
+'''
+ASGI app serving the routes which only pass a call through to gvite.
+
+A WSGI worker is blocked for the whole gvite call, here the calls of many
+requests wait on the network concurrently within a few uvicorn workers.
+The responses are the same as the ones of the Flask routes, nginx sends these
+paths to uvicorn and the rest to uwsgi, see asgi.py and nginx.conf.
+'''
+import logging
+import re
+from json import dumps
+
+from marshmallow.exceptions import ValidationError
+
+from .async_rpc import DEFAULT_METHOD_CONCURRENCY, DEFAULT_QUEUE_TIMEOUT, DEFAULT_RPC_TIMEOUT, AsyncRPCClient, RPCBusy, RPCTimeout
+from .models import AccountBlockSchema
+from .serializers import serializer_account_block
+
+schema_account_block = AccountBlockSchema()
+
+HEADERS = [
+    (b'content-type', b'application/json'),
+    # same as flask_cors with the default options
+    (b'access-control-allow-origin', b'*'),
+]
+
+
+class ProxyApp:
+
+    def __init__(self, rpc):
+        self.rpc = rpc
+        self.routes = [
+            (re.compile(r'/contract/get_contract_info/([^/]+)'),
+             ('GET', ), self.get_contract_info),
+            (re.compile(r'/contract/get_voted_sbp/([^/]+)'),
+             ('GET', ), self.get_voted_sbp),
+            (re.compile(r'/ledger/get_unreceived_account_blocks_by_account/([^/]+)/([^/]+)/([^/]+)/(\d+)/(\d+)'),
+             ('GET', 'POST'), self.get_unreceived_account_blocks_by_account),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        for pattern, methods, handler in self.routes:
+            match = pattern.fullmatch(scope['path'])
+            if match is None:
+                continue
+            if scope['method'] not in methods:
+                await send_json(send, 405, {'err': 'method not allowed'})
+                return
+            try:
+                result = await handler(*match.groups())
+            except RPCBusy:
+                await send_json(send, 503, {'err': 'too many pending requests to gvite, retry later'})
+                return
+            await send_json(send, 200, result)
+            return
+
+        await send_json(send, 404, {'err': 'not found'})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.rpc.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.rpc.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def get_contract_info(self, address):
+        try:
+            contract = await self.rpc.call('contract_getContractInfo', [address, ])
+        except RPCTimeout:
+            contract = {'err': 'timeout'}
+        if contract:
+            return {'err': 'ok', 'contract': contract}
+        logging.error(f'Fail to get contract info {address}')
+        return {'err': 'not found', 'contract': None}
+
+    async def get_voted_sbp(self, address):
+        try:
+            voted_sbp = await self.rpc.call('contract_getVotedSBP', [address, ])
+        except RPCTimeout:
+            voted_sbp = {'err': 'timeout'}
+        if voted_sbp:
+            return {'err': 'ok', 'sbp': voted_sbp}
+        logging.error(f'Fail to get voted SBP for {address}')
+        return {'err': 'not found', 'sbp': None}
+
+    async def get_unreceived_account_blocks_by_account(self, address, order, sort_field, page_idx, page_size):
+        # gvite has a single order, as the Flask route order and sort_field are ignored
+        page_idx, page_size = int(page_idx), int(page_size)
+        try:
+            result = await self.rpc.call('ledger_getUnreceivedBlocksByAddress', [address, page_idx, page_size])
+        except RPCTimeout:
+            result = None
+
+        account_blocks = []
+        if result:
+            try:
+                account_blocks = schema_account_block.load(result, many=True)
+            except ValidationError as err:
+                logging.error(
+                    f'fail to load account block schema: {err} - {result}')
+
+        count = len(account_blocks)
+        if count == page_size:
+            count = 10000
+
+        return {
+            'err': 'ok',
+            'count': count,
+            'pageIdx': page_idx,
+            'pageSize': page_size,
+            'accountBlocks': serializer_account_block.dump(account_blocks, many=True)
+        }
+
+
+async def send_json(send, status, result):
+    # same output as jsonify() with the default settings
+    body = (dumps(result, sort_keys=True, separators=(',', ':')) + '\n').encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': HEADERS + [(b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def create_proxy_app(flask_app):
+    '''
+    ASGI app with the gvite URL and the concurrency limits configured in flask_app
+    '''
+    config = flask_app.config
+    rpc = AsyncRPCClient(
+        config['URL_RPC'],
+        method_concurrency=config.get('PROXY_METHOD_CONCURRENCY', {}),
+        default_concurrency=config.get('PROXY_DEFAULT_CONCURRENCY', DEFAULT_METHOD_CONCURRENCY),
+        queue_timeout=config.get('PROXY_QUEUE_TIMEOUT', DEFAULT_QUEUE_TIMEOUT),
+        timeout=config.get('PROXY_RPC_TIMEOUT', DEFAULT_RPC_TIMEOUT))
+    return ProxyApp(rpc)
@@ -0,0 +1,99 @@
+'''
+Asynchronous JSON-RPC client of gvite, used by the ASGI proxy, see async_proxy.py.
+
+The calls of each method in flight are limited by a semaphore, a call waiting
+longer than queue_timeout for a slot fails with RPCBusy instead of piling up
+behind a slow node.
+'''
+import asyncio
+import itertools
+import logging
+
+import httpx
+
+DEFAULT_METHOD_CONCURRENCY = 100
+DEFAULT_QUEUE_TIMEOUT = 5  # seconds
+DEFAULT_RPC_TIMEOUT = 10  # seconds
+
+
+class RPCBusy(Exception):
+    pass
+
+
+class RPCTimeout(Exception):
+    pass
+
+
+class AsyncRPCClient:
+
+    def __init__(self, url, method_concurrency=None, default_concurrency=DEFAULT_METHOD_CONCURRENCY,
+                 queue_timeout=DEFAULT_QUEUE_TIMEOUT, timeout=DEFAULT_RPC_TIMEOUT):
+        self.url = url
+        self.method_concurrency = dict(method_concurrency or {})
+        self.default_concurrency = default_concurrency
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.ids = itertools.count(1)
+        # created in the event loop of the server, see start()
+        self.client = None
+        self.semaphores = {}
+
+    async def start(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(timeout=self.timeout, limits=httpx.Limits(
+                max_connections=sum(self.method_concurrency.values()) + self.default_concurrency))
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def get_semaphore(self, method):
+        semaphore = self.semaphores.get(method)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(
+                self.method_concurrency.get(method, self.default_concurrency))
+            self.semaphores[method] = semaphore
+        return semaphore
+
+    async def call(self, method, params):
+        '''
+        return the result of the call, None if it failed
+        raise RPCBusy if no slot of method is free in time, RPCTimeout if gvite does not answer
+        '''
+        await self.start()
+        semaphore = self.get_semaphore(method)
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f'RPC call {method} waited {self.queue_timeout}s for a slot')
+            raise RPCBusy(method)
+
+        request_body = {
+            "jsonrpc": "2.0",
+            "id": next(self.ids),
+            "method": method,
+            "params": params
+        }
+        try:
+            response = await self.client.post(self.url, json=request_body)
+        except httpx.TimeoutException:
+            logging.error(f'RPC call timed out: {method}')
+            raise RPCTimeout(method)
+        except httpx.HTTPError as err:
+            logging.error(f'RPC call failed: {method}, {err}')
+            return None
+        finally:
+            semaphore.release()
+
+        if response.status_code != 200:
+            logging.error(
+                f'RPC call failed: {method}, code: {response.status_code}, msg: {response.text}')
+            return None
+
+        response_body = response.json()
+        if response_body.get('error') is not None:
+            logging.error(
+                f'RPC call failed: {method}, error: {response_body["error"]}')
+            return None
+        return response_body.get('result')
@@ -0,0 +1,24 @@
+'''
+Request parsing of the batch lookup endpoints
+'''
+from flask import current_app as app, jsonify, request
+
+BATCH_LOOKUP_MAX = 100
+
+
+def get_batch_ids(key):
+    '''
+    read the list of ids under key in the JSON body, without duplicates
+    return (ids, None), or (None, error response) if the body is invalid
+    '''
+    body = request.get_json(silent=True)
+    ids = body.get(key) if isinstance(body, dict) else None
+    if not isinstance(ids, list) or not all(isinstance(item, str) for item in ids):
+        return None, (jsonify({'err': f'{key} must be a list of strings', 'result': {}}), 400)
+
+    batch_max = app.config.get('BATCH_LOOKUP_MAX', BATCH_LOOKUP_MAX)
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > batch_max:
+        return None, (jsonify({'err': f'at most {batch_max} {key} per request, got {len(ids)}', 'result': {}}), 400)
+
+    return ids, None
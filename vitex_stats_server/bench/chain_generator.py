@@ -0,0 +1,299 @@
+'''
+Deterministic synthetic chain, emitted as ledger_getChunks results.
+
+The same seed and sizes always give the same chain. Activity follows power laws:
+a few accounts send most of the blocks and a few tokens carry most of the
+transfers. Sends are received a few snapshots later, calls to contracts trigger
+send blocks back to the caller in the sendBlockList of the contract receive
+block, and the SBPs produce the snapshot blocks in shuffled rounds.
+
+Chunks are generated on demand and the state kept is proportional to the
+number of accounts, so the chain can be streamed at any size into the
+ingestion path or a bulk load, see dataset.py.
+'''
+import base64
+import bisect
+import itertools
+import random
+
+from .dataset import BENCH_TIMESTAMP_START, SNAPSHOT_HEIGHT_START, get_bench_address, get_bench_hash, get_bench_snapshot_hash, get_bench_token_id
+
+DEFAULT_SEED = 42
+
+ACCOUNT_COUNT = 1000
+TOKEN_COUNT = 20
+SBP_COUNT = 25
+CONTRACT_RATIO = 0.01
+# average account blocks per snapshot block, receives and triggered sends included
+BLOCKS_PER_SNAPSHOT = 20
+SNAPSHOT_INTERVAL = 1  # seconds
+
+# weight of the account / token of rank r is 1 / r ** exponent
+ACTIVITY_EXPONENT = 1.1
+TOKEN_EXPONENT = 1.5
+# share of the accounts holding the token of rank r is HOLDER_RATIO / r ** TOKEN_EXPONENT
+HOLDER_RATIO = 0.5
+CONTRACT_CALL_RATIO = 0.2
+TRIGGER_RATIO = 0.5
+MAX_RECEIVE_DELAY = 3  # snapshot blocks
+SBP_BLOCKS_PER_TURN = 3
+
+DECIMALS = 18
+VITE_SUPPLY = 10 ** 9 * 10 ** DECIMALS
+TOKEN_SUPPLY = 10 ** 8 * 10 ** DECIMALS
+
+EMPTY_HASH = '0' * 64
+PUBLIC_KEY = base64.b64encode(b'synthetic public key'.ljust(32, b'\0')).decode()
+SIGNATURE = base64.b64encode(b'synthetic signature'.ljust(64, b'\0')).decode()
+
+
+def get_cum_weights(count, exponent):
+    return list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(count)))
+
+
+class ChainGenerator:
+    '''
+    account indexes: users first, then contracts, then SBP block producing addresses
+    '''
+
+    def __init__(self, seed=DEFAULT_SEED, account_count=ACCOUNT_COUNT, token_count=TOKEN_COUNT, sbp_count=SBP_COUNT,
+                 blocks_per_snapshot=BLOCKS_PER_SNAPSHOT):
+        self.rng = random.Random(seed)
+        self.user_count = account_count
+        self.contract_count = max(1, int(account_count * CONTRACT_RATIO))
+        self.sbp_count = sbp_count
+        self.account_count = self.user_count + self.contract_count + sbp_count
+        self.token_count = token_count
+        self.blocks_per_snapshot = blocks_per_snapshot
+
+        self.user_weights = get_cum_weights(self.user_count, ACTIVITY_EXPONENT)
+        self.contract_weights = get_cum_weights(
+            self.contract_count, ACTIVITY_EXPONENT)
+        self.token_weights = get_cum_weights(token_count, TOKEN_EXPONENT)
+
+        # per account: {token index: balance}, (height, hash) of its last block
+        self.balances = [{} for _ in range(self.account_count)]
+        self.heads = [(0, EMPTY_HASH)] * self.account_count
+        self.token_supplies = [0] * token_count
+        self.distribute_tokens()
+
+        self.snapshot_index = 0
+        self.block_count = 0
+        # snapshot index: sends received in that snapshot
+        self.pending = {}
+        self.producers = []
+
+    def is_contract(self, i):
+        return self.user_count <= i < self.user_count + self.contract_count
+
+    def get_sbp_index(self, k):
+        return self.user_count + self.contract_count + k
+
+    def pick_user(self):
+        return bisect.bisect_left(self.user_weights, self.rng.random() * self.user_weights[-1])
+
+    def pick_contract(self):
+        return self.user_count + bisect.bisect_left(self.contract_weights, self.rng.random() * self.contract_weights[-1])
+
+    def pick_token(self):
+        return bisect.bisect_left(self.token_weights, self.rng.random() * self.token_weights[-1])
+
+    def distribute_tokens(self):
+        '''
+        genesis balances: VITE to every user by activity, the other tokens to
+        fewer holders the less popular they are
+        '''
+        total_weight = self.user_weights[-1]
+        previous = 0
+        for i, cum_weight in enumerate(self.user_weights):
+            balance = int(VITE_SUPPLY * (cum_weight - previous) / total_weight)
+            previous = cum_weight
+            self.balances[i][0] = balance
+            self.token_supplies[0] += balance
+
+        for t in range(1, self.token_count):
+            holder_count = max(1, int(self.user_count * HOLDER_RATIO /
+                                      (t + 1) ** TOKEN_EXPONENT))
+            holders = self.rng.sample(range(self.user_count), holder_count)
+            for holder in holders:
+                balance = self.rng.randint(1, TOKEN_SUPPLY // holder_count)
+                self.balances[holder][t] = balance
+                self.token_supplies[t] += balance
+
+    def append_block(self, i, block_type, to_index, t, amount, from_index, send_block_hash=None, data=None):
+        height, previous_hash = self.heads[i]
+        hashstr = get_bench_hash(self.block_count)
+        self.block_count += 1
+        self.heads[i] = (height + 1, hashstr)
+        return {
+            'blockType': block_type,
+            'hash': hashstr,
+            'prevHash': previous_hash,
+            'height': height + 1,
+            'accountAddress': get_bench_address(i),
+            'publicKey': PUBLIC_KEY,
+            'fromAddress': get_bench_address(from_index),
+            'toAddress': get_bench_address(to_index),
+            'sendBlockHash': send_block_hash,
+            'amount': amount,
+            'tokenId': get_bench_token_id(t),
+            'data': data,
+            'fee': 0,
+            'difficulty': None,
+            'nonce': None,
+            'signature': SIGNATURE,
+            'quotaByStake': 21000 if data is None else 40000,
+            'totalQuota': 21000 if data is None else 40000,
+            'vmlogHash': None,
+            'sendBlockList': [],
+        }
+
+    def send(self, sender, receiver, t, amount, data=None):
+        self.balances[sender][t] = self.balances[sender].get(t, 0) - amount
+        send_block = self.append_block(
+            sender, 2, receiver, t, amount, sender, data=data)
+        delay = self.rng.randint(1, MAX_RECEIVE_DELAY)
+        self.pending.setdefault(self.snapshot_index + delay, []).append(
+            (send_block['hash'], sender, receiver, t, amount, data is not None))
+        return send_block
+
+    def make_send(self):
+        sender = self.pick_user()
+        t = self.pick_token()
+        if self.balances[sender].get(t, 0) == 0:
+            t = 0
+        balance = self.balances[sender].get(t, 0)
+        amount = int(balance * self.rng.random() * 0.1)
+        if self.rng.random() < CONTRACT_CALL_RATIO:
+            data = base64.b64encode(
+                self.rng.getrandbits(288).to_bytes(36, 'big')).decode()
+            return self.send(sender, self.pick_contract(), t, amount, data)
+        receiver = self.pick_user()
+        if receiver == sender:
+            receiver = (receiver + 1) % self.user_count
+        return self.send(sender, receiver, t, amount)
+
+    def make_receive(self, send_block_hash, sender, receiver, t, amount, is_call):
+        self.balances[receiver][t] = self.balances[receiver].get(t, 0) + amount
+        receive_block = self.append_block(
+            receiver, 4, receiver, t, amount, sender, send_block_hash)
+        # the contract responds to the call, e.g. a refund
+        if is_call and self.is_contract(receiver) and self.rng.random() < TRIGGER_RATIO:
+            receive_block['sendBlockList'] = [
+                self.send(receiver, sender, t, amount // 2)]
+        return receive_block
+
+    def next_producer(self):
+        if not self.producers:
+            order = list(range(self.sbp_count))
+            self.rng.shuffle(order)
+            self.producers = [k for k in order for _ in range(SBP_BLOCKS_PER_TURN)]
+            self.producers.reverse()
+        return self.get_sbp_index(self.producers.pop())
+
+    def make_chunk(self):
+        index = self.snapshot_index
+        account_blocks = [self.make_receive(*pending)
+                          for pending in self.pending.pop(index, [])]
+        for _ in range(self.rng.randint(0, self.blocks_per_snapshot)):
+            account_blocks.append(self.make_send())
+
+        addresses = set()
+        for account_block in account_blocks:
+            addresses.add(account_block['accountAddress'])
+            for send_block in account_block['sendBlockList']:
+                addresses.add(send_block['accountAddress'])
+        snapshot_data = {}
+        for address in sorted(addresses):
+            i = int(address[-30:], 16)
+            snapshot_data[address] = {
+                'height': self.heads[i][0], 'hash': self.heads[i][1]}
+
+        self.snapshot_index += 1
+        return {
+            'SnapshotBlock': {
+                'producer': get_bench_address(self.next_producer()),
+                'hash': get_bench_snapshot_hash(index),
+                'prevHash': get_bench_snapshot_hash(index - 1) if index > 0 else EMPTY_HASH,
+                'height': SNAPSHOT_HEIGHT_START + index,
+                'publicKey': PUBLIC_KEY,
+                'signature': SIGNATURE,
+                'version': 1,
+                'timestamp': BENCH_TIMESTAMP_START + index * SNAPSHOT_INTERVAL,
+                'snapshotData': snapshot_data,
+            },
+            'AccountBlocks': account_blocks,
+        }
+
+    def iter_chunks(self, block_count):
+        '''
+        chunks until block_count more account blocks are generated, the chain
+        continues from the previous call
+        '''
+        target = self.block_count + block_count
+        while self.block_count < target:
+            yield self.make_chunk()
+
+    def token_rows(self):
+        return [{
+            'token_id': get_bench_token_id(t),
+            'token_name': 'Synthetic Vite' if t == 0 else f'Synthetic Token {t}',
+            'token_symbol': 'VITE' if t == 0 else f'SYN{t}',
+            'total_supply': self.token_supplies[t],
+            'decimals': DECIMALS,
+            'owner': get_bench_address(0),
+            'is_reissuable': t % 2 == 1,
+            'max_supply': self.token_supplies[t] * 2,
+            'is_owner_burn_only': False,
+            'index': t,
+        } for t in range(self.token_count)]
+
+    def sbp_rows(self):
+        return [{
+            'name': f'Synthetic SBP {k:03d}',
+            'block_producing_address': get_bench_address(self.get_sbp_index(k)),
+            'stake_address': get_bench_address(self.get_sbp_index(k)),
+            'stake_amount': 10 ** 6 * 10 ** DECIMALS,
+            'expiration_height': 0,
+            'expiration_time': 0,
+            'revoke_time': 0,
+            'votes': VITE_SUPPLY // (k + 1) ** 2 // 100,
+            'rank': k + 1,
+        } for k in range(self.sbp_count)]
+
+    def account_rows(self):
+        '''
+        accounts with their current block count and VITE balance
+        '''
+        return [{
+            'address': get_bench_address(i),
+            'block_count': self.heads[i][0],
+            'vite_balance': self.balances[i].get(0, 0),
+        } for i in range(self.account_count)]
+
+    def balance_rows(self):
+        return [{
+            'account_address': get_bench_address(i),
+            'token_id': get_bench_token_id(t),
+            'balance': balance,
+        } for i in range(self.account_count) for t, balance in sorted(self.balances[i].items())]
+
+    def account_dict(self, i):
+        '''
+        current state of account i as returned by ledger_getAccountInfoByAddress
+        '''
+        return {
+            'address': get_bench_address(i),
+            'blockCount': self.heads[i][0],
+            'currentQuota': 0,
+            'maxQuota': 0,
+            'stakeAmount': 0,
+            'balanceInfoMap': {get_bench_token_id(t): {
+                'tokenInfo': {
+                    'tokenId': get_bench_token_id(t),
+                    'tokenSymbol': 'VITE' if t == 0 else f'SYN{t}',
+                    'decimals': DECIMALS,
+                },
+                'balance': str(balance),
+            } for t, balance in sorted(self.balances[i].items())},
+        }
@@ -0,0 +1,194 @@
+'''
+Synthetic data sets of the benchmark suite, generated by chain_generator.py.
+
+Every id lives in a namespace that cannot collide with chain data nor with the
+query count harness, and the blocks are dated from 2001 so that the statistics
+rollups they feed can be deleted with them. A data set is either saved through
+the ingestion path, see ingest.py, or bulk loaded by the functions below.
+'''
+from datetime import date
+
+from sqlalchemy.dialects.postgresql import insert
+
+from ..cache import bump_version
+from ..contract.sbp_directory import SBP_DIRECTORY_VERSION_KEY
+from ..contract.token_catalog import TOKEN_CATALOG_VERSION_KEY
+from ..ledger.data_accessor import account_block_rows_from_dict, db_bulk_save_account_blocks
+from ..models import SBP, Account, AccountBlock, Balance, SnapshotBlock, SnapshotData, StatisticAddressSketch, StatisticBucket, StatisticTokenAddress, StatisticTokenBucket, Token, TokenHolderCount, TokenHolderRank, db
+
+BENCH_TOKEN_ID_PREFIX = 'tti_' + 'e' * 12
+BENCH_ADDRESS_PREFIX = 'vite_' + 'e' * 20
+BENCH_HASH_PREFIX = 'e' * 24
+BENCH_SBP_NAME_PREFIX = 'Synthetic SBP '
+
+# snapshot block hashes follow the account block ones
+SNAPSHOT_HASH_OFFSET = 1 << 40
+# heights far below the ones of the query count harness
+SNAPSHOT_HEIGHT_START = -2000000000
+
+BENCH_START_DATE = date(2001, 1, 1)
+BENCH_TIMESTAMP_START = 978307200  # BENCH_START_DATE 00:00 UTC
+# rollup rows from BENCH_TIMESTAMP_START up to this span belong to the data set
+BENCH_TIMESTAMP_SPAN = 366 * 86400
+
+# account blocks per bulk insert
+LOAD_BATCH_SIZE = 5000
+
+
+def get_bench_address(i):
+    return f'{BENCH_ADDRESS_PREFIX}{i:030x}'
+
+
+def get_bench_token_id(i):
+    return f'{BENCH_TOKEN_ID_PREFIX}{i:012x}'
+
+
+def get_bench_hash(i):
+    return f'{BENCH_HASH_PREFIX}{i:040x}'
+
+
+def get_bench_snapshot_hash(i):
+    return get_bench_hash(SNAPSHOT_HASH_OFFSET + i)
+
+
+def id_range(prefix, width):
+    # ids of a namespace share their prefix and length, the primary key index serves the range
+    return prefix + '0' * width, prefix + 'f' * width
+
+
+def load_reference_rows(generator):
+    '''
+    insert the tokens and the SBPs, the accounts without their balances
+    '''
+    db.session.execute(Token.__table__.insert(), generator.token_rows())
+    db.session.execute(SBP.__table__.insert(), generator.sbp_rows())
+    load_accounts(generator.account_rows())
+    db.session.commit()
+    bump_version(TOKEN_CATALOG_VERSION_KEY)
+    bump_version(SBP_DIRECTORY_VERSION_KEY)
+
+
+def load_accounts(rows):
+    table = Account.__table__
+    for offset in range(0, len(rows), LOAD_BATCH_SIZE):
+        stmt = insert(table).values(rows[offset:offset + LOAD_BATCH_SIZE])
+        db.session.execute(stmt.on_conflict_do_update(index_elements=[table.c.address], set_={
+            'block_count': stmt.excluded.block_count,
+            'vite_balance': stmt.excluded.vite_balance,
+        }))
+
+
+def load_account_states(generator):
+    '''
+    save the current block counts and balances of the accounts of generator
+    '''
+    load_accounts(generator.account_rows())
+    rows = generator.balance_rows()
+    table = Balance.__table__
+    for offset in range(0, len(rows), LOAD_BATCH_SIZE):
+        stmt = insert(table).values(rows[offset:offset + LOAD_BATCH_SIZE])
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.account_address, table.c.token_id],
+            set_={'balance': stmt.excluded.balance}))
+    db.session.commit()
+
+
+def flatten_account_blocks(account_blocks, timestamp):
+    '''
+    account block rows of chunk blocks, each one followed by the send blocks it triggered
+    '''
+    rows = []
+    for account_block in account_blocks:
+        rows += account_block_rows_from_dict(account_block, timestamp)
+    return rows
+
+
+def load_chunk_batch(snapshot_rows, snapshot_data_rows, account_block_rows):
+    if snapshot_rows:
+        db.session.execute(SnapshotBlock.__table__.insert(), snapshot_rows)
+    if snapshot_data_rows:
+        db.session.execute(SnapshotData.__table__.insert(), snapshot_data_rows)
+    db.session.commit()
+    if account_block_rows and db_bulk_save_account_blocks(account_block_rows) != len(account_block_rows):
+        raise RuntimeError(
+            f'fail to bulk load {len(account_block_rows)} account blocks')
+
+
+def load_chunks(chunks):
+    '''
+    bulk insert the snapshot blocks, snapshot data and account blocks of chunks,
+    the account blocks feed the statistics rollups like the ingestion path does.
+    return the number of account blocks loaded
+    '''
+    count = 0
+    snapshot_rows, snapshot_data_rows, account_block_rows = [], [], []
+    for chunk in chunks:
+        snapshot_block = chunk['SnapshotBlock']
+        snapshot_rows.append({
+            'producer': snapshot_block['producer'],
+            'hash': snapshot_block['hash'],
+            'prev_hash': snapshot_block['prevHash'],
+            'height': snapshot_block['height'],
+            'public_key': snapshot_block['publicKey'],
+            'signature': snapshot_block['signature'],
+            'version': snapshot_block['version'],
+            'timestamp': snapshot_block['timestamp'],
+        })
+        snapshot_data_rows += [{
+            'snapshot_block_hash': snapshot_block['hash'],
+            'account_address': address,
+            'height': data['height'],
+            'hash': data['hash'],
+        } for address, data in snapshot_block['snapshotData'].items()]
+        account_block_rows += flatten_account_blocks(
+            chunk['AccountBlocks'], snapshot_block['timestamp'])
+
+        if len(account_block_rows) >= LOAD_BATCH_SIZE:
+            load_chunk_batch(snapshot_rows, snapshot_data_rows,
+                             account_block_rows)
+            count += len(account_block_rows)
+            snapshot_rows, snapshot_data_rows, account_block_rows = [], [], []
+    load_chunk_batch(snapshot_rows, snapshot_data_rows, account_block_rows)
+    return count + len(account_block_rows)
+
+
+def cleanup():
+    '''
+    delete every row of the data set, rollups of its dates included
+    '''
+    hash_from, hash_to = id_range(BENCH_HASH_PREFIX, 40)
+    address_from, address_to = id_range(BENCH_ADDRESS_PREFIX, 30)
+    token_from, token_to = id_range(BENCH_TOKEN_ID_PREFIX, 12)
+    timestamp_to = BENCH_TIMESTAMP_START + BENCH_TIMESTAMP_SPAN
+    for query in (
+        db.session.query(SnapshotData).filter(
+            SnapshotData.snapshot_block_hash.between(hash_from, hash_to)),
+        db.session.query(SnapshotBlock).filter(
+            SnapshotBlock.hash.between(hash_from, hash_to)),
+        db.session.query(AccountBlock).filter(
+            AccountBlock.hash.between(hash_from, hash_to)),
+        db.session.query(TokenHolderRank).filter(
+            TokenHolderRank.token_id.between(token_from, token_to)),
+        db.session.query(TokenHolderCount).filter(
+            TokenHolderCount.token_id.between(token_from, token_to)),
+        db.session.query(Balance).filter(
+            Balance.account_address.between(address_from, address_to)),
+        db.session.query(Account).filter(
+            Account.address.between(address_from, address_to)),
+        db.session.query(Token).filter(
+            Token.token_id.between(token_from, token_to)),
+        db.session.query(SBP).filter(
+            SBP.name.startswith(BENCH_SBP_NAME_PREFIX)),
+        db.session.query(StatisticTokenAddress).filter(
+            StatisticTokenAddress.bucket_start.between(BENCH_TIMESTAMP_START, timestamp_to)),
+        db.session.query(StatisticTokenBucket).filter(
+            StatisticTokenBucket.bucket_start.between(BENCH_TIMESTAMP_START, timestamp_to)),
+        db.session.query(StatisticBucket).filter(
+            StatisticBucket.bucket_start.between(BENCH_TIMESTAMP_START, timestamp_to)),
+        db.session.query(StatisticAddressSketch).filter(
+            StatisticAddressSketch.bucket_start.between(BENCH_TIMESTAMP_START, timestamp_to)),
+    ):
+        query.delete(synchronize_session=False)
+    db.session.commit()
+    bump_version(TOKEN_CATALOG_VERSION_KEY)
+    bump_version(SBP_DIRECTORY_VERSION_KEY)
@@ -0,0 +1,151 @@
+'''
+Latency and SQL statements per request of the routes of bp_ledger, bp_contract
+and bp_statistic, requested through the Flask test client against the data set.
+'''
+import math
+import time
+from datetime import timedelta
+
+from ..models import db
+from .dataset import BENCH_ADDRESS_PREFIX, BENCH_SBP_NAME_PREFIX, BENCH_START_DATE, get_bench_address, get_bench_hash, get_bench_token_id
+from .query_count import QueryCounter
+
+BENCHMARKED_BLUEPRINTS = ('ledger', 'contract', 'statistic')
+PAGE_SIZE = 50
+
+
+def get_endpoint_cases():
+    '''
+    [(endpoint, method, URL, JSON body, needs gvite)], one per route
+    '''
+    address = get_bench_address(1)
+    token_id = get_bench_token_id(0)
+    hashstr = get_bench_hash(0)
+    start_date = BENCH_START_DATE.isoformat()
+    end_date = (BENCH_START_DATE + timedelta(days=6)).isoformat()
+    sbp_name = f'{BENCH_SBP_NAME_PREFIX}000'
+    return [
+        ('ledger.get_account_block_by_hash', 'GET',
+         f'/ledger/get_account_block_by_hash/{hashstr}', None, False),
+        ('ledger.get_account_blocks_by_hashes', 'POST', '/ledger/get_account_blocks_by_hashes',
+         {'hashes': [get_bench_hash(i) for i in range(PAGE_SIZE)]}, False),
+        ('ledger.get_complete_account_block_by_hash', 'GET',
+         f'/ledger/get_complete_account_block_by_hash/{hashstr}', None, False),
+        ('ledger.get_account_block_by_token', 'GET',
+         f'/ledger/get_account_block_by_token/{token_id}/0/{PAGE_SIZE}', None, False),
+        ('ledger.get_account_block_by_token_order', 'GET',
+         f'/ledger/get_account_block_by_token/{token_id}/asc/timestamp/0/{PAGE_SIZE}', None, False),
+        ('ledger.get_account_blocks', 'GET',
+         f'/ledger/get_account_blocks/desc/timestamp/0/{PAGE_SIZE}', None, False),
+        # the latest blocks of an account come from gvite, ascending order is served by DB
+        ('ledger.get_account_blocks_by_account', 'GET',
+         f'/ledger/get_account_blocks_by_account/{address}/asc/timestamp/0/{PAGE_SIZE}', None, False),
+        ('ledger.get_unreceived_account_blocks_by_account', 'GET',
+         f'/ledger/get_unreceived_account_blocks_by_account/{address}/desc/timestamp/0/{PAGE_SIZE}', None, True),
+        ('ledger.get_account', 'GET',
+         f'/ledger/get_account/{address}', None, False),
+        ('ledger.get_accounts_by_addresses', 'POST', '/ledger/get_accounts_by_addresses',
+         {'addresses': [get_bench_address(i) for i in range(PAGE_SIZE)]}, False),
+        ('ledger.get_accounts', 'GET',
+         f'/ledger/get_accounts/desc/viteBalance/0/{PAGE_SIZE}', None, False),
+        ('ledger.search_accounts', 'GET',
+         f'/ledger/search_accounts/{BENCH_ADDRESS_PREFIX}/asc/address/0/{PAGE_SIZE}', None, False),
+        ('ledger.get_snapshot_blocks_by_address', 'GET',
+         f'/ledger/get_snapshot_blocks_by_address/{address}/desc/height/0/{PAGE_SIZE}', None, False),
+        ('ledger.get_snapshots', 'GET',
+         f'/ledger/get_snapshot_blocks/desc/height/0/{PAGE_SIZE}', None, False),
+        ('ledger.get_latest_snapshots', 'GET',
+         f'/ledger/get_latest_snapshot_blocks/{PAGE_SIZE}', None, False),
+        ('ledger.get_token_balanced_desc', 'GET',
+         f'/ledger/get_token_balanced_desc/{token_id}/0/{PAGE_SIZE}', None, False),
+        ('ledger.get_token_holder_rank', 'GET',
+         f'/ledger/get_token_holder_rank/{token_id}/{address}', None, False),
+        ('ledger.export_account_blocks', 'GET',
+         f'/ledger/export/account_blocks?tokenId={token_id}&format=ndjson', None, False),
+        ('contract.get_sbp_by_name', 'GET',
+         f'/contract/get_sbp_by_name/{sbp_name}', None, False),
+        ('contract.get_sbp_list', 'GET', '/contract/get_sbp_list', None, False),
+        ('contract.get_token_info_list_order', 'GET',
+         f'/contract/get_token_info_list/asc/token_name/0/{PAGE_SIZE}', None, False),
+        ('contract.search_token_info_list_order', 'GET',
+         f'/contract/search_token_name/Synthetic/asc/token_name/0/{PAGE_SIZE}', None, False),
+        ('contract.get_token_info_list', 'GET',
+         f'/contract/get_token_info_list/0/{PAGE_SIZE}', None, False),
+        ('contract.get_token_info', 'GET',
+         f'/contract/get_token_info/{token_id}', None, False),
+        ('contract.get_token_infos_by_ids', 'POST', '/contract/get_token_infos_by_ids',
+         {'tokenIds': [get_bench_token_id(i) for i in range(10)]}, False),
+        ('contract.get_active_sbp', 'GET', '/contract/get_active_sbp/25', None, False),
+        ('contract.get_contract_info', 'GET',
+         f'/contract/get_contract_info/{address}', None, True),
+        ('contract.get_voted_sbp', 'GET',
+         f'/contract/get_voted_sbp/{address}', None, True),
+        ('statistic.get_account_block_by_hash', 'GET',
+         f'/statistic/get_daily_statistics/{start_date}/{end_date}', None, False),
+        ('statistic.get_hourly_statistics', 'GET',
+         f'/statistic/get_hourly_statistics/{start_date}/{end_date}', None, False),
+        ('statistic.get_token_daily_statistics', 'GET',
+         f'/statistic/token_daily/{token_id}/{start_date}/{end_date}', None, False),
+        ('statistic.get_active_addresses', 'GET',
+         f'/statistic/active_addresses/{start_date}/{end_date}', None, False),
+    ]
+
+
+def get_uncovered_endpoints(flask_app, cases):
+    '''
+    endpoints of the benchmarked blueprints without a case, e.g. a route added since
+    '''
+    covered = {case[0] for case in cases}
+    return sorted({rule.endpoint for rule in flask_app.url_map.iter_rules()
+                   if rule.endpoint.split('.')[0] in BENCHMARKED_BLUEPRINTS and rule.endpoint not in covered})
+
+
+def percentile(samples, q):
+    '''
+    nearest rank percentile, q between 0 and 1
+    '''
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(q * len(ordered)) - 1, 0)]
+
+
+def measure_endpoint(client, method, url, body, requests):
+    '''
+    return {p50, p99, queries_per_request, status}, after a warm up request
+    '''
+    client.open(url, method=method, json=body).get_data()
+    latencies = []
+    statements = 0
+    for _ in range(requests):
+        with QueryCounter(db.engine) as counter:
+            start = time.perf_counter()
+            response = client.open(url, method=method, json=body)
+            # streamed responses run their queries while being read
+            response.get_data()
+            latencies.append(time.perf_counter() - start)
+        if response.status_code >= 500:
+            raise RuntimeError(f'{url} responded {response.status_code}')
+        statements += counter.count
+    return {
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+        'queries_per_request': statements / requests,
+        'status': response.status_code,
+    }
+
+
+def measure_endpoints(flask_app, requests, with_gvite=False):
+    '''
+    return ({endpoint: measures}, endpoints skipped as they need gvite, endpoints without a case)
+    '''
+    client = flask_app.test_client()
+    cases = get_endpoint_cases()
+    results = {}
+    skipped = []
+    for endpoint, method, url, body, needs_gvite in cases:
+        if needs_gvite and not with_gvite:
+            skipped.append(endpoint)
+            continue
+        results[endpoint] = measure_endpoint(
+            client, method, url, body, requests)
+        results[endpoint]['url'] = url
+    return results, skipped, get_uncovered_endpoints(flask_app, cases)
@@ -0,0 +1,38 @@
+'''
+Throughput of the ingestion path: chunks saved like the chunk downloader does,
+accounts saved like a refresh from gvite does.
+'''
+import time
+
+from ..ledger.data_accessor import save_account_block_from_dict, save_account_from_dict, save_snapshot_block_dict
+
+
+def count_account_blocks(account_blocks):
+    return sum(1 + count_account_blocks(account_block.get('sendBlockList') or [])
+               for account_block in account_blocks)
+
+
+def save_chunks(chunks):
+    '''
+    return (account blocks saved, seconds)
+    '''
+    count = 0
+    start = time.perf_counter()
+    for chunk in chunks:
+        snapshot_block = chunk['SnapshotBlock']
+        save_snapshot_block_dict(snapshot_block)
+        for account_block in chunk['AccountBlocks']:
+            save_account_block_from_dict(
+                account_block, snapshot_block['timestamp'])
+        count += count_account_blocks(chunk['AccountBlocks'])
+    return count, time.perf_counter() - start
+
+
+def save_accounts(account_dicts):
+    '''
+    return (accounts saved, seconds)
+    '''
+    start = time.perf_counter()
+    for account_dict in account_dicts:
+        save_account_from_dict(account_dict)
+    return len(account_dicts), time.perf_counter() - start
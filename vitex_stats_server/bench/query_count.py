@@ -0,0 +1,146 @@
+'''
+Query count harness: every list endpoint must issue the same number of SQL
+statements whatever its page size, i.e. no relationship is loaded row by row.
+
+Synthetic rows are seeded under ids that cannot collide with chain data, the
+list endpoints are requested with several page sizes, then the rows are deleted.
+'''
+from sqlalchemy import event
+
+from ..models import Account, AccountBlock, Balance, SnapshotBlock, SnapshotData, Token, db
+
+SEED_SIZE = 60
+PAGE_SIZES = (1, 10, 50)
+
+SEED_TOKEN_ID_PREFIX = 'tti_' + 'f' * 12
+SEED_ADDRESS_PREFIX = 'vite_' + 'f' * 20
+
+
+class QueryCounter:
+    '''
+    count the SQL statements executed on an engine within a with block
+    '''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self.on_execute)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        event.remove(self.engine, 'before_cursor_execute', self.on_execute)
+
+
+def get_seed_address(i):
+    return f'{SEED_ADDRESS_PREFIX}{i:030x}'
+
+
+def get_seed_token_id(i):
+    return f'{SEED_TOKEN_ID_PREFIX}{i:012x}'
+
+
+def get_seed_hash(i):
+    return f'{"f" * 24}{i:040x}'
+
+
+def seed(size=SEED_SIZE):
+    '''
+    insert size tokens, accounts with a balance each, account blocks and snapshot blocks.
+    rows refer to distinct tokens, a token loaded per row would show in the counts
+    '''
+    db.session.execute(Token.__table__.insert(), [{
+        'token_id': get_seed_token_id(i), 'token_name': f'Query Count {i}', 'token_symbol': 'QC',
+        'decimals': 0, 'index': i} for i in range(size)])
+    db.session.execute(Account.__table__.insert(), [{
+        'address': get_seed_address(i), 'block_count': 1, 'vite_balance': 0} for i in range(size)])
+    db.session.execute(Balance.__table__.insert(), [{
+        'account_address': get_seed_address(i), 'token_id': get_seed_token_id(i), 'balance': i} for i in range(size)])
+    db.session.execute(AccountBlock.__table__.insert(), [{
+        'hash': get_seed_hash(i), 'address': get_seed_address(0), 'from_address': get_seed_address(0),
+        'to_address': get_seed_address(i), 'token_id': get_seed_token_id(i), 'block_type': 2,
+        'height': i + 1, 'timestamp': i + 1, 'amount': i} for i in range(size)])
+    db.session.execute(SnapshotBlock.__table__.insert(), [{
+        'hash': get_seed_hash(i), 'producer': get_seed_address(0), 'height': -i - 1, 'timestamp': i + 1} for i in range(size)])
+    db.session.execute(SnapshotData.__table__.insert(), [{
+        'account_address': get_seed_address(0), 'snapshot_block_hash': get_seed_hash(i),
+        'height': i + 1, 'hash': get_seed_hash(i)} for i in range(size)])
+    db.session.commit()
+
+
+def cleanup(size=SEED_SIZE):
+    addresses = [get_seed_address(i) for i in range(size)]
+    token_ids = [get_seed_token_id(i) for i in range(size)]
+    hashes = [get_seed_hash(i) for i in range(size)]
+    db.session.query(SnapshotData).filter(SnapshotData.snapshot_block_hash.in_(
+        hashes)).delete(synchronize_session=False)
+    db.session.query(SnapshotBlock).filter(SnapshotBlock.hash.in_(
+        hashes)).delete(synchronize_session=False)
+    db.session.query(AccountBlock).filter(AccountBlock.hash.in_(
+        hashes)).delete(synchronize_session=False)
+    db.session.query(Balance).filter(Balance.token_id.in_(
+        token_ids)).delete(synchronize_session=False)
+    db.session.query(Account).filter(Account.address.in_(
+        addresses)).delete(synchronize_session=False)
+    db.session.query(Token).filter(Token.token_id.in_(
+        token_ids)).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def get_list_endpoints():
+    '''
+    (name, URL format with {page_size}) of the list endpoints served from DB
+    '''
+    address = get_seed_address(0)
+    token_id = get_seed_token_id(0)
+    return [
+        ('get_account_blocks', '/ledger/get_account_blocks/desc/timestamp/0/{page_size}'),
+        ('get_account_block_by_token',
+         f'/ledger/get_account_block_by_token/{token_id}/asc/timestamp/0/{{page_size}}'),
+        # the latest blocks of an account may come from gvite, ascending order is served by DB
+        ('get_account_blocks_by_account',
+         f'/ledger/get_account_blocks_by_account/{address}/asc/timestamp/0/{{page_size}}'),
+        ('get_accounts', '/ledger/get_accounts/desc/viteBalance/0/{page_size}'),
+        ('search_accounts',
+         f'/ledger/search_accounts/{SEED_ADDRESS_PREFIX}/asc/address/0/{{page_size}}'),
+        ('get_snapshot_blocks_by_address',
+         f'/ledger/get_snapshot_blocks_by_address/{address}/desc/height/0/{{page_size}}'),
+        ('get_snapshot_blocks', '/ledger/get_snapshot_blocks/desc/height/0/{page_size}'),
+        ('get_latest_snapshot_blocks',
+         '/ledger/get_latest_snapshot_blocks/{page_size}'),
+        ('get_token_balanced_desc',
+         f'/ledger/get_token_balanced_desc/{token_id}/0/{{page_size}}'),
+    ]
+
+
+def count_queries(flask_app, page_sizes=PAGE_SIZES):
+    '''
+    return [(endpoint name, [statement count of each page size])]
+    must be called within an app context
+    '''
+    results = []
+    client = flask_app.test_client()
+    seed(max(max(page_sizes), SEED_SIZE))
+    try:
+        for name, url in get_list_endpoints():
+            counts = []
+            for page_size in page_sizes:
+                with QueryCounter(db.engine) as counter:
+                    response = client.get(url.format(page_size=page_size))
+                if response.status_code != 200:
+                    raise RuntimeError(
+                        f'{name} responded {response.status_code}')
+                counts.append(counter.count)
+            results.append((name, counts))
+    finally:
+        db.session.rollback()
+        cleanup(max(max(page_sizes), SEED_SIZE))
+    return results
@@ -0,0 +1,69 @@
+'''
+Microbenchmark of the list queries: ORM hydration vs row mode.
+
+Synthetic rows of the query count harness are seeded, each list query is run
+and serialized in both modes at several page sizes, then the rows are deleted.
+'''
+import time
+
+from ..ledger.data_accessor import db_get_account_blocks_by_account, db_search_accounts
+from ..models import db
+from ..serializers import serializer_account, serializer_account_block
+from .query_count import SEED_ADDRESS_PREFIX, cleanup, get_seed_address, seed
+
+PAGE_SIZES = (10, 100, 1000)
+
+
+def get_cases():
+    '''
+    (name, serializer, function(page_size, rows) returning the page)
+    '''
+    address = get_seed_address(0)
+    return [
+        ('account_blocks_by_account', serializer_account_block,
+         lambda page_size, rows: db_get_account_blocks_by_account(
+             address, 'asc', 'timestamp', 0, page_size, rows)[0]),
+        ('search_accounts', serializer_account,
+         lambda page_size, rows: db_search_accounts(
+             SEED_ADDRESS_PREFIX, 'asc', 'address', 0, page_size, rows)[0]),
+    ]
+
+
+def measure(get_page, serializer, page_size, rows, repeat):
+    best = None
+    for _ in range(repeat):
+        # objects kept by the identity map would skip the hydration
+        db.session.expunge_all()
+        start = time.perf_counter()
+        serializer.dump(list(get_page(page_size, rows)), many=True)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def run_benchmark(page_sizes=PAGE_SIZES, repeat=10):
+    '''
+    return [(query name, page size, ORM seconds, row mode seconds)], the best of repeat
+    runs of query and serialization; raise AssertionError if the outputs differ.
+    must be called within an app context, seeds and deletes synthetic rows
+    '''
+    results = []
+    seed(max(page_sizes))
+    try:
+        for name, serializer, get_page in get_cases():
+            for page_size in page_sizes:
+                orm_output = serializer.dump(
+                    list(get_page(page_size, False)), many=True)
+                if orm_output != serializer.dump(get_page(page_size, True), many=True):
+                    raise AssertionError(
+                        f'row mode output of {name} differs from ORM')
+                orm_seconds = measure(
+                    get_page, serializer, page_size, False, repeat)
+                row_seconds = measure(
+                    get_page, serializer, page_size, True, repeat)
+                results.append((name, page_size, orm_seconds, row_seconds))
+    finally:
+        db.session.rollback()
+        cleanup(max(page_sizes))
+    return results
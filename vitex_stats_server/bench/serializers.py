@@ -0,0 +1,102 @@
+'''
+Benchmark of the compiled serializers against marshmallow, on synthetic objects.
+'''
+from datetime import datetime
+from decimal import Decimal
+import time
+
+from ..models import SBP, Account, AccountBlock, Balance, SBPReward, SnapshotBlock, SnapshotData, Token
+from ..serializers import serializer_account, serializer_account_block, serializer_account_block_complete, serializer_sbp, serializer_snapshot_block, serializer_token
+
+
+def make_token(i):
+    return Token(token_id=f'tti_{i:024x}', token_name=f'Token {i}', token_symbol=f'TK{i}',
+                 total_supply=Decimal(10 ** 27 + i), decimals=18, owner=f'vite_{i:050x}',
+                 is_reissuable=True, max_supply=Decimal(10 ** 30), is_owner_burn_only=False, index=i % 100)
+
+
+def make_account_block(i, token):
+    account_block = AccountBlock(
+        block_type=2, height=i + 1, hash=f'{i:064x}', previous_hash=f'{i + 1:064x}',
+        address=f'vite_{i:050x}', public_key='a' * 44, producer=f'vite_{i:050x}',
+        from_address=f'vite_{i:050x}', to_address=f'vite_{i + 1:050x}',
+        send_block_hash='0' * 64, token_id=token.token_id, amount=Decimal(10 ** 20 + i),
+        fee=Decimal(0), data='ZGF0YQ==', difficulty=None, nonce=None, signature='s' * 88,
+        quota_by_stake=21000, total_quota=21000, vm_log_hash=None, confirmations=100,
+        first_snapshot_hash='f' * 64, timestamp=1600000000 + i,
+        receive_block_height=None, receive_block_hash=None)
+    account_block.token = token
+    return account_block
+
+
+def make_account(i, tokens):
+    account = Account(address=f'vite_{i:050x}', block_count=i, vite_balance=Decimal(10 ** 21 + i),
+                      current_quota=0, max_quota=0, stake_amount=Decimal(0),
+                      last_modified=datetime(2021, 1, 1), last_transaction_date=datetime(2021, 1, 2))
+    account.balances = [Balance(account_address=account.address, token_id=token.token_id,
+                                balance=Decimal(10 ** 18 + j), token=token)
+                        for j, token in enumerate(tokens)]
+    return account
+
+
+def make_snapshot_block(i):
+    snapshot_block = SnapshotBlock(producer=f'vite_{i:050x}', hash=f'{i:064x}', prev_hash=f'{i + 1:064x}',
+                                   height=i, public_key='a' * 44, signature='s' * 88, version=1,
+                                   timestamp=1600000000 + i)
+    snapshot_block.snapshot_data = [SnapshotData(account_address=f'vite_{j:050x}', snapshot_block_hash=snapshot_block.hash,
+                                                 height=j, hash=f'{j:064x}') for j in range(3)]
+    return snapshot_block
+
+
+def make_sbp(i):
+    sbp = SBP(name=f'SBP {i}', block_producing_address=f'vite_{i:050x}', stake_address=f'vite_{i:050x}',
+              stake_amount=Decimal(10 ** 24), expiration_height=i, expiration_time=i, revoke_time=0,
+              votes=Decimal(10 ** 25 + i), rank=i + 1)
+    sbp.reward = SBPReward(sbp_name=sbp.name, block_producing_reward=Decimal(10 ** 20), voting_reward=Decimal(10 ** 20),
+                           total_reward=Decimal(2 * 10 ** 20), produced_blocks=100, target_blocks=100,
+                           all_reward_withdrawed=False)
+    return sbp
+
+
+def make_cases(count):
+    tokens = [make_token(i) for i in range(count)]
+    account_blocks = [make_account_block(i, tokens[i % len(tokens)])
+                      for i in range(count)]
+    for i, account_block in enumerate(account_blocks):
+        account_block.triggered_send_block_list = account_blocks[i:i + 1]
+    return [
+        ('token', serializer_token, tokens),
+        ('account_block', serializer_account_block, account_blocks),
+        ('account_block_complete', serializer_account_block_complete, account_blocks),
+        ('account', serializer_account, [
+         make_account(i, tokens[:5]) for i in range(count)]),
+        ('snapshot_block', serializer_snapshot_block,
+         [make_snapshot_block(i) for i in range(count)]),
+        ('sbp', serializer_sbp, [make_sbp(i) for i in range(count)]),
+    ]
+
+
+def measure(dump, objs, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        dump(objs, many=True)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def run_benchmark(count=100, repeat=20):
+    '''
+    return [(schema name, marshmallow seconds, compiled seconds)], the best of repeat
+    dumps of count objects; raise AssertionError if the outputs differ
+    '''
+    results = []
+    for name, serializer, objs in make_cases(count):
+        if serializer.dump(objs, many=True) != serializer.schema.dump(objs, many=True):
+            raise AssertionError(f'compiled {name} serializer differs from marshmallow')
+        marshmallow_seconds = measure(serializer.schema.dump, objs, repeat)
+        compiled_seconds = measure(serializer.dump, objs, repeat)
+        results.append((name, marshmallow_seconds, compiled_seconds))
+    return results
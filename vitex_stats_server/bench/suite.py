@@ -0,0 +1,143 @@
+'''
+Benchmark suite run by `flask bench run`: ingestion, account refresh and
+endpoint measures on a synthetic chain, saved as JSON and compared with a
+baseline saved by a previous run. The scale multiplies the size of the chain,
+e.g. 1, 10 and 100, so the same measures show how they degrade with data size.
+'''
+from datetime import datetime
+import json
+import time
+
+from ..models import db
+from .chain_generator import ACCOUNT_COUNT, DEFAULT_SEED, ChainGenerator
+from .dataset import cleanup, load_account_states, load_chunks, load_reference_rows
+from .endpoints import measure_endpoints
+from .ingest import save_accounts, save_chunks
+
+RESULTS_VERSION = 2
+
+# sizes of the data set at scale 1
+BLOCK_COUNT = 10000
+# the last blocks go through the ingestion path, the ones before are bulk loaded
+INGEST_BLOCK_COUNT = 2000
+# the most active accounts are refreshed
+REFRESH_ACCOUNT_COUNT = 200
+REQUEST_COUNT = 50
+
+# relative changes tolerated before a measure counts as a regression
+LATENCY_THRESHOLD = 0.25
+THROUGHPUT_THRESHOLD = 0.15
+# latency changes below this many seconds are noise whatever their relative size
+MIN_LATENCY_DELTA = 0.002
+
+
+def get_rate(count, seconds):
+    return count / seconds if seconds > 0 else None
+
+
+def run_suite(flask_app, scale=1, seed=DEFAULT_SEED, ingest_blocks=INGEST_BLOCK_COUNT, requests=REQUEST_COUNT,
+              with_gvite=False):
+    '''
+    return the results as a JSON serializable dict. the data set has scale times
+    ACCOUNT_COUNT accounts and BLOCK_COUNT account blocks, ingestion and refresh
+    are measured on the same number of blocks and accounts whatever the scale.
+    must be called within an app context, seeds and deletes synthetic rows
+    '''
+    generator = ChainGenerator(seed, ACCOUNT_COUNT * scale)
+    block_count = BLOCK_COUNT * scale
+    ingest_blocks = min(ingest_blocks, block_count)
+    refresh_accounts = min(REFRESH_ACCOUNT_COUNT, generator.account_count)
+
+    # rows left by an interrupted run
+    cleanup()
+    try:
+        load_reference_rows(generator)
+        start = time.perf_counter()
+        loaded = load_chunks(generator.iter_chunks(block_count - ingest_blocks))
+        load_seconds = time.perf_counter() - start
+        load_account_states(generator)
+
+        chunks = list(generator.iter_chunks(ingest_blocks))
+        ingested, ingest_seconds = save_chunks(chunks)
+
+        # balances changed by the blocks ingested since the bulk load
+        refreshed, refresh_seconds = save_accounts(
+            [generator.account_dict(i) for i in range(refresh_accounts)])
+
+        endpoints, skipped, uncovered = measure_endpoints(
+            flask_app, requests, with_gvite)
+    finally:
+        db.session.rollback()
+        cleanup()
+
+    return {
+        'version': RESULTS_VERSION,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'parameters': {
+            'scale': scale,
+            'seed': seed,
+            'accounts': generator.account_count,
+            'blocks': loaded + ingested,
+            'ingest_blocks': ingest_blocks,
+            'requests': requests,
+            'with_gvite': with_gvite,
+        },
+        'bulk_load': {
+            'blocks': loaded,
+            'seconds': load_seconds,
+            'blocks_per_second': get_rate(loaded, load_seconds),
+        },
+        'ingestion': {
+            'chunks': len(chunks),
+            'blocks': ingested,
+            'seconds': ingest_seconds,
+            'blocks_per_second': get_rate(ingested, ingest_seconds),
+        },
+        'refresh': {
+            'accounts': refreshed,
+            'seconds': refresh_seconds,
+            'accounts_per_second': get_rate(refreshed, refresh_seconds),
+        },
+        'endpoints': endpoints,
+        'skipped': skipped,
+        'uncovered': uncovered,
+    }
+
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_results(results, baseline, latency_threshold=LATENCY_THRESHOLD, throughput_threshold=THROUGHPUT_THRESHOLD):
+    '''
+    return the regressions of results against baseline as messages, empty if none.
+    more statements per request is always a regression, they do not depend on the machine
+    '''
+    regressions = []
+    if results['parameters'] != baseline['parameters']:
+        regressions.append(
+            f'parameters {results["parameters"]} differ from the ones of the baseline {baseline["parameters"]}')
+    for section, key in (('ingestion', 'blocks_per_second'), ('refresh', 'accounts_per_second')):
+        current, reference = results[section][key], baseline[section][key]
+        if current is not None and reference is not None and current < reference * (1 - throughput_threshold):
+            regressions.append(
+                f'{section}: {current:.1f} {key}, baseline {reference:.1f}')
+
+    for endpoint, reference in sorted(baseline['endpoints'].items()):
+        current = results['endpoints'].get(endpoint)
+        if current is None:
+            continue
+        if current['queries_per_request'] > reference['queries_per_request']:
+            regressions.append(f'{endpoint}: {current["queries_per_request"]:g} statements per request, '
+                               f'baseline {reference["queries_per_request"]:g}')
+        for key in ('p50', 'p99'):
+            if current[key] > reference[key] * (1 + latency_threshold) and current[key] - reference[key] > MIN_LATENCY_DELTA:
+                regressions.append(f'{endpoint}: {key} {current[key] * 1000:.1f} ms, '
+                                   f'baseline {reference[key] * 1000:.1f} ms')
+    return regressions
@@ -0,0 +1,82 @@
+'''
+In-process caches of small tables that rarely change.
+
+Writers bump a version counter stored in config_status after they commit, every
+process checks the counter at most once per check interval and rebuilds its
+copy when the counter moved.
+'''
+import threading
+import time
+
+from flask import current_app as app
+from sqlalchemy import BigInteger, String, cast
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from .models import ConfigStatus, db
+
+VERSION_CHECK_INTERVAL = 5  # seconds
+
+
+def get_version(key):
+    # query the column, not the entity, so that the value is not served from the identity map
+    value = db.session.query(ConfigStatus.value).filter(
+        ConfigStatus.key == key).scalar()
+    if value is None:
+        return 0
+    return int(value)
+
+
+def bump_version(key):
+    stmt = insert(ConfigStatus).values(key=key, value='1')
+    try:
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['key'],
+            set_={'value': cast(cast(ConfigStatus.value, BigInteger) + 1, String)}))
+        db.session.commit()
+    except SQLAlchemyError as err:
+        db.session.rollback()
+        app.logger.error(f'fail to bump version {key}: SQLAlchemyError {err}')
+
+
+class VersionedCache:
+    '''
+    value returned by build(), rebuilt when the version counter moves or,
+    if max_age is set, when the value is older than max_age seconds
+    '''
+
+    def __init__(self, version_key, build, check_interval=VERSION_CHECK_INTERVAL, max_age=None):
+        self.version_key = version_key
+        self.build = build
+        self.check_interval = check_interval
+        self.max_age = max_age
+
+        self.value = None
+        self.version = None
+        self.checked_at = 0
+        self.built_at = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        if self.value is not None and now - self.checked_at < self.check_interval:
+            return self.value
+
+        with self.lock:
+            if self.value is not None and now - self.checked_at < self.check_interval:
+                return self.value
+
+            # read the version before building, a bump during the build triggers another one
+            version = get_version(self.version_key)
+            expired = self.max_age is not None and now - self.built_at > self.max_age
+            if self.value is None or version != self.version or expired:
+                self.value = self.build()
+                self.version = version
+                self.built_at = now
+            self.checked_at = now
+
+        return self.value
+
+    def invalidate(self):
+        self.checked_at = 0
+        self.version = None
@@ -6,6 +6,7 @@ import daemon
 from flask import current_app as app
 from vitex_stats_server.ledger.data_accessor import gvite_get_chunks, gvite_get_snapshot_chain_height, save_account_block_from_dict, save_snapshot_block_dict
 from .models import ConfigStatus, db
+from .partition import ensure_partitions, month_start
 
 ERR_NO_RESULT = -1
 SLICE_SIZE = 5
@@ -29,11 +30,16 @@ def sync_loop(target_date):
     start_height, end_height = get_initial_height()
     timestamp = int(datetime.now().timestamp())
     target_timestamp = int(target_date.timestamp())
+    partitioned_month = None
     while timestamp > target_timestamp:
         chunks = gvite_get_chunks(start_height, end_height)
         for chunk in chunks:
             snapshot_block = chunk.get('SnapshotBlock')
             snapshot_timestamp = snapshot_block.get("timestamp", 0)
+            # chunks go back in time, create the partition of each month reached
+            if snapshot_timestamp > 0 and month_start(snapshot_timestamp) != partitioned_month:
+                ensure_partitions(snapshot_timestamp)
+                partitioned_month = month_start(snapshot_timestamp)
             if snapshot_block is None:
                 logging.error(
                     f'Snapshot block is empty in chunk {start_height} - {end_height} ')
@@ -100,17 +106,21 @@ def download_chunk_interval(start_height, end_height):
     slice_start_height = start_height - SLICE_SIZE
     slice_end_height = slice_start_height + SLICE_SIZE
     timestamp = 0
+    partitioned_month = None
     while slice_start_height <= end_height:
         chunks = gvite_get_chunks(slice_start_height, slice_end_height)
         for chunk in chunks:
             snapshot_block = chunk.get('SnapshotBlock')
+            snapshot_timestamp = snapshot_block.get("timestamp", 0)
+            if snapshot_timestamp > 0 and month_start(snapshot_timestamp) != partitioned_month:
+                ensure_partitions(snapshot_timestamp)
+                partitioned_month = month_start(snapshot_timestamp)
             if snapshot_block is None:
                 logging.error(
                     f'Snapshot block is empty in chunk {slice_start_height} - {slice_end_height} ')
             else:
                 save_snapshot_block_dict(snapshot_block)
 
-            snapshot_timestamp = snapshot_block.get("timestamp", 0)
             if snapshot_timestamp > 0:
                 timestamp = snapshot_timestamp
 
@@ -7,6 +7,8 @@ import click
 from .models import db
 
 bp_cli = Blueprint('manage', __name__)
+# benchmark suite, flask bench
+bp_bench = Blueprint('bench', __name__)
 
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s %(levelname)-8s %(message)s')
@@ -14,11 +16,50 @@ logging.basicConfig(level=logging.INFO,
 
 @bp_cli.cli.command('create-tables')
 def create_tables():
+    from .partition import ensure_partitions
     print('creating tables')
     db.create_all()
+    ensure_partitions()
     print('done')
 
 
+@bp_cli.cli.command('partition-tables')
+@click.option('--months-ahead', default=3, type=int, help='months of partitions created after the current one')
+@click.option('--drop-old', is_flag=True, help='drop the unpartitioned tables once copied')
+def partition_tables(months_ahead, drop_old):
+    '''
+    migrate account_block and snapshot_block to monthly partitions, stop the daemons meanwhile
+    '''
+    from .partition import PARTITIONED_TABLES, partition_table
+    for table_name in PARTITIONED_TABLES:
+        print(f'partitioning {table_name}')
+        copied = partition_table(table_name, months_ahead, drop_old)
+        print(f'Done partitioning {table_name}, {copied} rows copied')
+
+
+@bp_cli.cli.command('create-partitions')
+@click.option('--months-ahead', default=None, type=int, help='months of partitions created after the current one')
+def create_partitions(months_ahead):
+    from .partition import ensure_partitions
+    created = ensure_partitions(months_ahead=months_ahead)
+    print(f'Created {len(created)} partitions {", ".join(created)}')
+
+
+@bp_cli.cli.command('convert-storage')
+@click.argument('mode', type=click.Choice(['binary', 'text']))
+def convert_storage(mode):
+    '''
+    convert the hash, address and signature columns to bytea or back to text, stop the daemons meanwhile
+    '''
+    from flask import current_app
+    from .storage import convert_storage
+    binary = mode == 'binary'
+    count = convert_storage(binary)
+    print(f'Done converting {count} columns to {mode}')
+    if current_app.config.get('BINARY_STORAGE', False) != binary:
+        print(f'Set BINARY_STORAGE = {binary} in the config and restart the server and the daemons')
+
+
 @bp_cli.cli.command('download-snapshotblock')
 @click.argument('height', required=True, type=int)
 def download_snapshotblock(height):
@@ -189,6 +230,20 @@ def update_daily_stats_today():
         f'done updating daily statistics for {target_date}: transaction_count = {stat.transaction_count}')
 
 
+@bp_cli.cli.command('rebuild-rollups')
+@click.argument('start_date_str', required=True)
+@click.argument('end_date_str', required=True)
+@click.option('--workers', default=4, type=int, help='number of days rebuilt in parallel')
+def rebuild_rollups_cli(start_date_str, end_date_str, workers):
+    from .statistic.rollup import rebuild_rollups
+    start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+    end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+    print(
+        f'rebuild statistics rollups from {start_date} to {end_date} with {workers} workers')
+    days = rebuild_rollups(start_date, end_date, workers)
+    print(f'done rebuilding statistics rollups of {days} days')
+
+
 @bp_cli.cli.command('launch-sync-daemon')
 def launch_sync_daemon():
     print('Launching chain sync daemon')
@@ -240,24 +295,82 @@ def launch_sync(target_date_str):
     chunk_download_daemon_main(target_date)
 
 
+def retention_options(command):
+    for option in (
+        click.option('--batch-size', default=None, type=int, help='rows deleted per transaction'),
+        click.option('--rate', default=None, type=int, help='rows deleted per second, 0 for no limit'),
+        click.option('--archive-dir', default=None, help='directory of the archives of the rows deleted'),
+        click.option('--background', is_flag=True, help='run detached, logging to /tmp/vitex_retention.log'),
+    ):
+        command = option(command)
+    return command
+
+
+def run_retention_job(job, background, *args):
+    from .db_manage import retention_daemon_main
+    if background:
+        retention_daemon_main(job, *args)
+    elif job(*args) is False:
+        raise SystemExit(1)
+
+
 @bp_cli.cli.command('clean-db-after-date')
 @click.argument('target_date_str', required=True)
-def clean_db_after_date(target_date_str):
+@retention_options
+def clean_db_after_date(target_date_str, batch_size, rate, archive_dir, background):
     target_date = datetime.strptime(target_date_str, '%Y-%m-%d')
-    print(f'Cleaning transactions and snapshots after {target_date}')
+    print(f'Cleaning transactions and snapshots before {target_date}')
     from .db_manage import delete_account_block_after_date
-    delete_account_block_after_date(target_date)
+    run_retention_job(delete_account_block_after_date, background,
+                      target_date, batch_size, rate, archive_dir)
 
 
 @bp_cli.cli.command('clean-db-days-before')
 @click.argument('days_before', required=True)
-def clean_db_after_date(days_before):
+@retention_options
+def clean_db_days_before(days_before, batch_size, rate, archive_dir, background):
     days_before = int(days_before)
     target_date = datetime.now() - timedelta(days=days_before)
     print(
-        f'Cleaning transactions and snapshots after {target_date} ({days_before} days before today)')
+        f'Cleaning transactions and snapshots before {target_date} ({days_before} days before today)')
     from .db_manage import delete_account_block_after_date
-    delete_account_block_after_date(target_date)
+    run_retention_job(delete_account_block_after_date, background,
+                      target_date, batch_size, rate, archive_dir)
+
+
+@bp_cli.cli.command('clean-db-resume')
+@retention_options
+def clean_db_resume(batch_size, rate, archive_dir, background):
+    '''
+    resume an interrupted clean-db-after-date or clean-db-days-before
+    '''
+    from .db_manage import load_progress, resume_retention
+    progress = load_progress()
+    if progress is None:
+        print('No interrupted cleaning to resume')
+        return
+    print(f'Resuming the cleaning of transactions and snapshots before '
+          f'{datetime.fromtimestamp(progress["target"])}')
+    run_retention_job(resume_retention, background,
+                      batch_size, rate, archive_dir)
+
+
+@bp_cli.cli.command('build-cold-segments')
+@click.option('--before', 'before_date_str', default=None, help='YYYY-MM-DD, months ending before it are built, default today')
+@click.option('--archive-dir', default=None, help='directory of the segments, default COLD_ARCHIVE_DIR')
+def build_cold_segments(before_date_str, archive_dir):
+    '''
+    export the account blocks of past months to the segments of the cold archive, run before clean-db
+    '''
+    from flask import current_app
+    from .ledger.cold_archive import build_cold_segments
+    if archive_dir is None and current_app.config.get('COLD_ARCHIVE_DIR') is None:
+        print('Set COLD_ARCHIVE_DIR or --archive-dir')
+        raise SystemExit(1)
+    before_date = datetime.strptime(
+        before_date_str, '%Y-%m-%d') if before_date_str else datetime.now()
+    built = build_cold_segments(before_date.timestamp(), archive_dir)
+    print(f'Built {len(built)} months: {", ".join(built)}')
 
 
 @bp_cli.cli.command('update-top-holders')
@@ -270,6 +383,44 @@ def update_top_holders(top_n):
     print(f'Done updating top {top_n} holders')
 
 
+@bp_cli.cli.command('recompute-holder-ranks')
+@click.option('--token-id', default=None, help='recompute a single token')
+def recompute_holder_ranks(token_id):
+    '''
+    rank the holders of every token and snapshot the top VITE holders, run it on a schedule
+    '''
+    from .ledger.holder_rank import recompute_all_token_holder_ranks, recompute_token_holder_ranks
+    if token_id is not None:
+        print(f'Recomputing holder ranks of token {token_id}')
+        holder_count = recompute_token_holder_ranks(token_id)
+        print(f'Done ranking {holder_count} holders of token {token_id}')
+        return
+    print('Recomputing holder ranks of all tokens')
+    ranked = recompute_all_token_holder_ranks()
+    print(f'Done ranking the holders of {ranked} tokens')
+
+
+@bp_cli.cli.command('slow-queries')
+@click.option('--order', default='total', type=click.Choice(['total', 'max', 'calls', 'mean', 'recent']))
+@click.option('--limit', default=20, type=int)
+@click.option('--plan', is_flag=True, help='print the sampled plans')
+@click.option('--reset', is_flag=True, help='delete the recorded slow queries')
+def slow_queries(order, limit, plan, reset):
+    from .admin.data_accessor import db_get_slow_queries, db_reset_slow_queries
+    if reset:
+        print(f'Deleted {db_reset_slow_queries()} slow queries')
+        return
+    for slow_query in db_get_slow_queries(order, limit):
+        print(f'{slow_query.fingerprint}  calls {slow_query.calls:>6}  total {slow_query.total_seconds:9.3f}s  '
+              f'mean {slow_query.mean_seconds:7.3f}s  max {slow_query.max_seconds:7.3f}s  last {slow_query.endpoint}')
+        print(f'    {slow_query.normalized_sql[:400]}')
+        if plan and slow_query.sample_plan:
+            print(f'    parameters: {slow_query.sample_parameters}')
+            for line in slow_query.sample_plan.splitlines():
+                print(f'    {line}')
+        print()
+
+
 @bp_cli.cli.command('create-index-snapshot-timestamp')
 def create_index_snapshot_timestamp():
     print(f'create index on snapshot timestamp')
@@ -290,3 +441,189 @@ def create_index_snapshot_timestamp():
         'ix_sbp_block_producing_address', SBP.block_producing_address.asc().nullslast())
     idx_sbp_block_producing_address.create(bind=db.engine)
     print(f'Done creating index on SBP block producing address')
+
+
+@bp_cli.cli.command('create-index-account-address-prefix')
+def create_index_account_address_prefix():
+    print(f'create index on account address for prefix search')
+    from sqlalchemy import Index
+    from .models import Account
+    # addresses are lowercase hex, the C collation lets LIKE 'prefix%' and
+    # ORDER BY address both use the index
+    idx_account_address_prefix = Index(
+        'ix_account_address_prefix', Account.address.collate('C'))
+    idx_account_address_prefix.create(bind=db.engine)
+    print(f'Done creating index on account address for prefix search')
+
+
+@bp_cli.cli.command('create-index-account-block-export')
+def create_index_account_block_export():
+    print(f'create indexes on account block address and token id for export')
+    from sqlalchemy import Index
+    from .models import AccountBlock
+    # exports filter on address or token id and stream ordered by timestamp, hash
+    idx_account_block_address_timestamp = Index(
+        'ix_account_block_address_timestamp', AccountBlock.address, AccountBlock.timestamp, AccountBlock.hash)
+    idx_account_block_address_timestamp.create(bind=db.engine)
+    idx_account_block_token_id_timestamp = Index(
+        'ix_account_block_token_id_timestamp', AccountBlock.token_id, AccountBlock.timestamp, AccountBlock.hash)
+    idx_account_block_token_id_timestamp.create(bind=db.engine)
+    print(f'Done creating indexes on account block address and token id for export')
+
+
+@bp_cli.cli.command('bench-serializers')
+@click.option('--count', default=100, type=int, help='number of objects dumped per run')
+@click.option('--repeat', default=20, type=int, help='number of runs, the best one is kept')
+def bench_serializers(count, repeat):
+    from .bench.serializers import run_benchmark
+    print(f'benchmark serializers, {count} objects, best of {repeat} runs')
+    for name, marshmallow_seconds, compiled_seconds in run_benchmark(count, repeat):
+        print(f'{name:<24} marshmallow {marshmallow_seconds * 1000:8.2f} ms  '
+              f'compiled {compiled_seconds * 1000:8.2f} ms  '
+              f'speedup {marshmallow_seconds / compiled_seconds:5.1f}x')
+
+
+@bp_cli.cli.command('bench-row-mode')
+@click.option('--repeat', default=10, type=int, help='number of runs, the best one is kept')
+def bench_row_mode(repeat):
+    '''
+    seeds and deletes synthetic rows, do not run on a production DB
+    '''
+    from .bench.row_mode import PAGE_SIZES, run_benchmark
+    print(f'benchmark list queries, ORM vs row mode, page sizes {PAGE_SIZES}, best of {repeat} runs')
+    for name, page_size, orm_seconds, row_seconds in run_benchmark(PAGE_SIZES, repeat):
+        print(f'{name:<28} {page_size:>5}  ORM {orm_seconds * 1000:8.2f} ms  '
+              f'rows {row_seconds * 1000:8.2f} ms  '
+              f'speedup {orm_seconds / row_seconds:5.1f}x')
+
+
+@bp_cli.cli.command('check-query-counts')
+def check_query_counts():
+    '''
+    seeds and deletes synthetic rows, do not run on a production DB
+    '''
+    from flask import current_app
+    from .bench.query_count import PAGE_SIZES, count_queries
+    print(f'count SQL statements of list endpoints, page sizes {PAGE_SIZES}')
+    failures = []
+    for name, counts in count_queries(current_app, PAGE_SIZES):
+        constant = len(set(counts)) == 1
+        print(f'{name:<32} {counts} {"ok" if constant else "NOT CONSTANT"}')
+        if not constant:
+            failures.append(name)
+    if failures:
+        print(f'query count depends on page size: {", ".join(failures)}')
+        raise SystemExit(1)
+    print('done, every list endpoint issues a constant number of statements')
+
+
+def print_results(results):
+    bulk_load, ingestion, refresh = results['bulk_load'], results['ingestion'], results['refresh']
+    if bulk_load['blocks']:
+        print(f'bulk load  {bulk_load["blocks"]} blocks  '
+              f'{bulk_load["blocks_per_second"]:8.1f} blocks/s')
+    print(f'ingestion  {ingestion["blocks"]} blocks in {ingestion["chunks"]} chunks  '
+          f'{ingestion["blocks_per_second"]:8.1f} blocks/s')
+    print(f'refresh    {refresh["accounts"]} accounts  '
+          f'{refresh["accounts_per_second"]:8.1f} accounts/s')
+    for endpoint, measures in sorted(results['endpoints'].items()):
+        print(f'{endpoint:<48} p50 {measures["p50"] * 1000:8.2f} ms  '
+              f'p99 {measures["p99"] * 1000:8.2f} ms  '
+              f'queries {measures["queries_per_request"]:5.1f}  status {measures["status"]}')
+    if results['skipped']:
+        print(f'skipped, they need gvite: {", ".join(results["skipped"])}')
+    if results['uncovered']:
+        print(f'no benchmark case: {", ".join(results["uncovered"])}')
+
+
+def check_regressions(results, baseline_path, latency_threshold, throughput_threshold):
+    from .bench.suite import compare_results, load_results
+    regressions = compare_results(results, load_results(
+        baseline_path), latency_threshold, throughput_threshold)
+    if regressions:
+        print(f'{len(regressions)} regressions against {baseline_path}:')
+        for regression in regressions:
+            print(f'    {regression}')
+        raise SystemExit(1)
+    print(f'no regression against {baseline_path}')
+
+
+@bp_bench.cli.command('run')
+@click.option('--scale', default=1, type=int, help='size of the synthetic chain, e.g. 1, 10 or 100')
+@click.option('--seed', default=42, type=int, help='seed of the synthetic chain')
+@click.option('--ingest-blocks', default=2000, type=int, help='number of account blocks saved through the ingestion path')
+@click.option('--requests', default=50, type=int, help='number of requests per endpoint')
+@click.option('--with-gvite', is_flag=True, help='also request the routes passing calls through to gvite')
+@click.option('--output', default='bench_results.json', help='JSON file of the results')
+@click.option('--baseline', default=None, help='JSON results of a previous run to compare with')
+@click.option('--latency-threshold', default=0.25, type=float, help='relative latency increase tolerated')
+@click.option('--throughput-threshold', default=0.15, type=float, help='relative throughput decrease tolerated')
+def bench_run(scale, seed, ingest_blocks, requests, with_gvite, output, baseline, latency_threshold, throughput_threshold):
+    '''
+    seeds and deletes synthetic rows, do not run on a production DB
+    '''
+    from flask import current_app
+    from .bench.suite import run_suite, save_results
+    print(f'benchmark at scale {scale}, seed {seed}, {requests} requests per endpoint')
+    results = run_suite(current_app, scale, seed,
+                        ingest_blocks, requests, with_gvite)
+    print_results(results)
+    save_results(results, output)
+    print(f'results saved in {output}')
+    if baseline is not None:
+        check_regressions(results, baseline,
+                          latency_threshold, throughput_threshold)
+
+
+@bp_bench.cli.command('compare')
+@click.argument('results_path', required=True)
+@click.argument('baseline_path', required=True)
+@click.option('--latency-threshold', default=0.25, type=float, help='relative latency increase tolerated')
+@click.option('--throughput-threshold', default=0.15, type=float, help='relative throughput decrease tolerated')
+def bench_compare(results_path, baseline_path, latency_threshold, throughput_threshold):
+    from .bench.suite import load_results
+    check_regressions(load_results(results_path), baseline_path,
+                      latency_threshold, throughput_threshold)
+
+
+@bp_bench.cli.command('generate')
+@click.option('--scale', default=1, type=int, help='size of the synthetic chain, e.g. 1, 10 or 100')
+@click.option('--seed', default=42, type=int, help='seed of the synthetic chain')
+@click.option('--output', default='-', type=click.File('w'), help='NDJSON file, one ledger_getChunks chunk per line')
+def bench_generate(scale, seed, output):
+    import json
+    from .bench.chain_generator import ACCOUNT_COUNT, ChainGenerator
+    from .bench.suite import BLOCK_COUNT
+    generator = ChainGenerator(seed, ACCOUNT_COUNT * scale)
+    for chunk in generator.iter_chunks(BLOCK_COUNT * scale):
+        output.write(json.dumps(chunk, separators=(',', ':')) + '\n')
+
+
+@bp_bench.cli.command('load')
+@click.option('--scale', default=1, type=int, help='size of the synthetic chain, e.g. 1, 10 or 100')
+@click.option('--seed', default=42, type=int, help='seed of the synthetic chain')
+def bench_load(scale, seed):
+    '''
+    bulk load a synthetic chain and keep it, for manual query tuning. remove it with flask bench cleanup
+    '''
+    import time
+    from .bench.chain_generator import ACCOUNT_COUNT, ChainGenerator
+    from .bench.dataset import cleanup, load_account_states, load_chunks, load_reference_rows
+    from .bench.suite import BLOCK_COUNT
+    generator = ChainGenerator(seed, ACCOUNT_COUNT * scale)
+    print(f'bulk load a synthetic chain at scale {scale}, seed {seed}')
+    start = time.perf_counter()
+    cleanup()
+    load_reference_rows(generator)
+    loaded = load_chunks(generator.iter_chunks(BLOCK_COUNT * scale))
+    load_account_states(generator)
+    print(f'loaded {generator.account_count} accounts, {loaded} account blocks, '
+          f'{generator.snapshot_index} snapshot blocks in {time.perf_counter() - start:.1f}s')
+
+
+@bp_bench.cli.command('cleanup')
+def bench_cleanup():
+    from .bench.dataset import cleanup
+    print('delete the synthetic chain')
+    cleanup()
+    print('done')
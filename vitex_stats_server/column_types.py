@@ -0,0 +1,176 @@
+'''
+Column types of hashes, addresses and signatures, stored as text or as fixed width bytea.
+
+With BINARY_STORAGE = True a 64 char hex hash is stored in 32 bytes, a vite_ address
+in 25 and a base64 signature in the bytes it encodes, indexes on them shrink by half.
+Values are converted when bound and when fetched, the rest of the code only sees strings.
+A value which is not in the canonical form, e.g. an uppercase hash, is stored as its
+UTF-8 bytes after a 0xff prefix, which UTF-8 never contains, so that every string round trips.
+
+The storage mode must match the database, see storage.py and `flask manage convert-storage`.
+'''
+import base64
+import re
+
+from sqlalchemy.types import LargeBinary, String, TypeDecorator
+
+binary_storage = False
+
+
+def set_binary_storage(enabled):
+    '''
+    called once by create_app(), before the first query
+    '''
+    global binary_storage
+    binary_storage = enabled
+
+
+def fallback_prefix(width, raw):
+    # the length of a fallback value never equals the width of a canonical one
+    return b'\xff\xff' if len(raw) + 1 == width else b'\xff'
+
+
+class BinaryString(TypeDecorator):
+    '''
+    string of a fixed width binary value, subclasses convert the canonical form
+    '''
+    impl = String
+    cache_ok = True
+    width = None
+
+    def load_dialect_impl(self, dialect):
+        if binary_storage:
+            return dialect.type_descriptor(LargeBinary())
+        return dialect.type_descriptor(String(self.impl.length))
+
+    def process_bind_param(self, value, dialect):
+        if not binary_storage or value is None:
+            return value
+        if value == '':
+            return b''
+        raw = self.to_bytes(value)
+        if raw is None:
+            raw = value.encode()
+            return fallback_prefix(self.width, raw) + raw
+        return raw
+
+    def process_result_value(self, value, dialect):
+        if not binary_storage or value is None:
+            return value
+        value = bytes(value)
+        if value == b'':
+            return ''
+        if len(value) == self.width:
+            return self.from_bytes(value)
+        return value.lstrip(b'\xff').decode()
+
+    def to_bytes(self, value):
+        '''
+        bytes of the canonical form of value, None for any other string
+        '''
+        raise NotImplementedError
+
+    def from_bytes(self, raw):
+        raise NotImplementedError
+
+    def to_binary_sql(self, column):
+        '''
+        SQL expression of the bytea of the text column, as process_bind_param()
+        '''
+        return (f"CASE WHEN {column} = '' THEN ''::bytea "
+                f'WHEN {self.canonical_sql(column)} THEN {self.decode_sql(column)} '
+                f"WHEN octet_length({column}) + 1 = {self.width} THEN '\\xffff'::bytea || convert_to({column}, 'UTF8') "
+                f"ELSE '\\xff'::bytea || convert_to({column}, 'UTF8') END")
+
+    def to_text_sql(self, column):
+        '''
+        SQL expression of the text of the bytea column, as process_result_value()
+        '''
+        return (f"CASE WHEN octet_length({column}) = 0 THEN '' "
+                f'WHEN octet_length({column}) = {self.width} THEN {self.encode_sql(column)} '
+                f"ELSE convert_from(substr({column}, CASE WHEN get_byte({column}, 1) = 255 THEN 3 ELSE 2 END), 'UTF8') END")
+
+
+class Hash(BinaryString):
+    '''
+    32 bytes hash in lowercase hex
+    '''
+    width = 32
+    pattern = re.compile(r'[0-9a-f]{64}')
+
+    def to_bytes(self, value):
+        return bytes.fromhex(value) if self.pattern.fullmatch(value) else None
+
+    def from_bytes(self, raw):
+        return raw.hex()
+
+    def canonical_sql(self, column):
+        return f"{column} ~ '^[0-9a-f]{{64}}$'"
+
+    def decode_sql(self, column):
+        return f"decode({column}, 'hex')"
+
+    def encode_sql(self, column):
+        return f"encode({column}, 'hex')"
+
+
+class Address(BinaryString):
+    '''
+    vite_ address, 20 bytes of address and 5 of checksum in lowercase hex
+    '''
+    width = 25
+    prefix = 'vite_'
+    pattern = re.compile(r'vite_[0-9a-f]{50}')
+
+    def to_bytes(self, value):
+        return bytes.fromhex(value[len(self.prefix):]) if self.pattern.fullmatch(value) else None
+
+    def from_bytes(self, raw):
+        return self.prefix + raw.hex()
+
+    def canonical_sql(self, column):
+        return f"{column} ~ '^vite_[0-9a-f]{{50}}$'"
+
+    def decode_sql(self, column):
+        return f"decode(substr({column}, {len(self.prefix) + 1}), 'hex')"
+
+    def encode_sql(self, column):
+        return f"'{self.prefix}' || encode({column}, 'hex')"
+
+
+class Base64(BinaryString):
+    '''
+    base64 of width bytes, e.g. a public key or a signature
+    '''
+
+    def __init__(self, width, length=None):
+        super().__init__(length)
+        self.width = width
+        self.pattern = re.compile(self.canonical_pattern(width))
+
+    @staticmethod
+    def canonical_pattern(width):
+        # the bits of the last character beyond the data are 0 in the canonical encoding
+        full, rest = divmod(width, 3)
+        pattern = f'[A-Za-z0-9+/]{{{full * 4}}}'
+        if rest == 1:
+            pattern += '[A-Za-z0-9+/][AQgw]=='
+        elif rest == 2:
+            pattern += '[A-Za-z0-9+/]{2}[AEIMQUYcgkosw048]='
+        return pattern
+
+    def to_bytes(self, value):
+        return base64.b64decode(value) if self.pattern.fullmatch(value) else None
+
+    def from_bytes(self, raw):
+        return base64.b64encode(raw).decode()
+
+    def canonical_sql(self, column):
+        return f"{column} ~ '^{self.pattern.pattern}$'"
+
+    def decode_sql(self, column):
+        return f"decode({column}, 'base64')"
+
+    def encode_sql(self, column):
+        # encode() breaks base64 in lines of 76 characters
+        return f"translate(encode({column}, 'base64'), E'\\n', '')"
@@ -1,9 +1,17 @@
+import time
+
 from flask import current_app as app
 from marshmallow import ValidationError
 import requests
 
 from sqlalchemy.exc import SQLAlchemyError, NoResultFound
-from ..models import SBP, SBPActivity, SBPReward, SBPRewardSchema, SBPSchema, SnapshotBlock, Token, TokenSchema, db
+from sqlalchemy.sql.functions import func
+from ..models import SBP, SBPActivity, SBPReward, SBPRewardSchema, SBPSchema, SnapshotBlock, StatisticTokenBucket, Token, TokenSchema, db
+from ..cache import bump_version
+from ..rpc import gvite_batch_call, rpc_post
+from ..statistic.rollup import GRANULARITY_DAY, get_bucket_start
+from .sbp_directory import SBP_DIRECTORY_VERSION_KEY, sbp_directory
+from .token_catalog import TOKEN_CATALOG_VERSION_KEY, token_catalog
 
 sbp_schema = SBPSchema()
 sbp_reward_schema = SBPRewardSchema()
@@ -18,6 +26,10 @@ TOKEN_SORT_FIELD = {
     'owner': Token.owner,
 }
 
+# tokens sorted by number of transfers during the last ACTIVITY_WINDOW_DAYS days
+TOKEN_ACTIVITY_SORT_FIELD = 'transferCount'
+ACTIVITY_WINDOW_DAYS = 30
+
 EMPTY_TOKEN_REPLACEMENT = {
     'tti_000000000000000000004cfd': 'tti_5649544520544f4b454e6e40',
 }
@@ -32,6 +44,19 @@ def token_get_sort_criteria(order='desc', sort_field='tokenName'):
     return result.asc()
 
 
+def token_activity_subquery():
+    '''
+    number of transfers of every token during the last ACTIVITY_WINDOW_DAYS days,
+    summed from the daily token rollups
+    '''
+    window_start = get_bucket_start(int(time.time()), GRANULARITY_DAY) - \
+        (ACTIVITY_WINDOW_DAYS - 1) * GRANULARITY_DAY
+
+    return db.session.query(StatisticTokenBucket.token_id, func.sum(StatisticTokenBucket.transfer_count).label('transfer_count')).filter(
+        StatisticTokenBucket.granularity == GRANULARITY_DAY).filter(
+        StatisticTokenBucket.bucket_start >= window_start).group_by(StatisticTokenBucket.token_id).subquery()
+
+
 def get_sbp_detail_da(name):
 
     sbp = db.session.query(SBP).get(name)
@@ -46,6 +71,28 @@ def get_sbp_list_da(active_only=True):
     return sbps
 
 
+def get_sbp_json_da(name):
+    '''
+    return the serialized SBP as JSON text, from the SBP directory
+    '''
+    return sbp_directory.get().get_sbp_json(name)
+
+
+def get_sbp_list_json_da():
+    return sbp_directory.get().get_sbp_list_json()
+
+
+def get_active_sbp_json_da(count):
+    '''
+    the SBPs of the count most recently active producing addresses, from the most
+    recently active. the activity is read from the last_modified index, the SBPs
+    from the SBP directory
+    '''
+    block_producing_addresses = [address for (address, ) in db.session.query(
+        SBPActivity.block_producing_address).order_by(SBPActivity.last_modified.desc()).limit(max(count, 0))]
+    return sbp_directory.get().get_active_sbp_json(block_producing_addresses)
+
+
 def get_sbp_list_gvite():
 
     headers = {'content-type': 'application/json'}
@@ -56,8 +103,7 @@ def get_sbp_list_gvite():
         "params": None
     }
 
-    resp_sbp_list = requests.post(
-        app.config['URL_RPC'],  json=request_body, headers=headers)
+    resp_sbp_list = rpc_post(request_body, headers)
 
     response = resp_sbp_list.json().get('result', [])
 
@@ -73,8 +119,7 @@ def get_sbp_gvite(name):
         "params": [name, ]
     }
 
-    resp_sbp_list = requests.post(
-        app.config['URL_RPC'],  json=request_body, headers=headers)
+    resp_sbp_list = rpc_post(request_body, headers)
 
     response = resp_sbp_list.json().get('result', None)
     if response is None:
@@ -165,8 +210,7 @@ def get_sbp_reward_gvite(timestamp):
         "params": [int(timestamp)]
     }
 
-    resp_sbp_reward = requests.post(
-        app.config['URL_RPC'],  json=request_body, headers=headers)
+    resp_sbp_reward = rpc_post(request_body, headers)
 
     response = resp_sbp_reward.json().get('result', None)
 
@@ -199,33 +243,42 @@ def save_sbp_reward(sbp_reward_src):
             app.logger.error(
                 f'fail to commit SBP {sbp_name}: General Error {err}')
 
+    bump_version(SBP_DIRECTORY_VERSION_KEY)
 
-def get_token_info_list_da(order, sort_field, page_idx=0, page_size=10):
-
-    offset = page_idx * page_size
-
-    sort_criteria = token_get_sort_criteria(order, sort_field)
-
-    count = db.session.query(Token).count()
 
-    tokens = db.session.query(Token).order_by(
-        sort_criteria).offset(offset).limit(page_size)
-
-    return tokens, count
+def get_token_info_list_da(order, sort_field, page_idx=0, page_size=10):
+    '''
+    return serialized tokens of the page and the total count, from the token catalog
+    '''
+    return token_catalog.get().list_tokens(order, sort_field, page_idx, page_size)
 
 
 def search_token_name_da(token_name, order, sort_field, page_idx=0, page_size=10):
-    offset = page_idx * page_size
+    '''
+    return serialized tokens of the page whose name or symbol contains token_name
+    and the total count of matches, from the token catalog
+    '''
+    return token_catalog.get().search_tokens(token_name, order, sort_field, page_idx, page_size)
 
-    sort_criteria = token_get_sort_criteria(order, sort_field)
 
-    count = db.session.query(Token).filter(
-        Token.token_name.ilike(f'%{token_name}%') | Token.token_symbol.ilike(f'%{token_name}%')).count()
+def get_token_info_dict(token_id):
+    return token_catalog.get().get_token(token_id)
 
-    tokens = db.session.query(Token).filter(
-        Token.token_name.ilike(f'%{token_name}%') | Token.token_symbol.ilike(f'%{token_name}%')).order_by(sort_criteria).offset(offset).limit(page_size)
 
-    return tokens, count
+def get_token_info_dicts(token_ids, refresh=False):
+    '''
+    return {token id: serialized token} of the tokens in the token catalog,
+    refresh: rebuild the catalog first, after saving new tokens
+    '''
+    if refresh:
+        token_catalog.invalidate()
+    catalog = token_catalog.get()
+    token_infos = {}
+    for token_id in token_ids:
+        token_info = catalog.get_token(token_id)
+        if token_info is not None:
+            token_infos[token_id] = token_info
+    return token_infos
 
 
 def gvite_get_token_info(token_id):
@@ -242,8 +295,7 @@ def gvite_get_token_info(token_id):
     }
 
     try:
-        resp_token_list = requests.post(
-            app.config['URL_RPC'],  json=request_body, headers=headers)
+        resp_token_list = rpc_post(request_body, headers)
 
         response = resp_token_list.json()['result']
         if replacing_token_id:
@@ -254,6 +306,21 @@ def gvite_get_token_info(token_id):
     return response
 
 
+def gvite_get_token_infos_by_ids(token_ids):
+    '''
+    return {token id: token info dict} of the tokens found by gvite, with one batch RPC
+    '''
+    results = gvite_batch_call([('contract_getTokenInfoById', [EMPTY_TOKEN_REPLACEMENT.get(token_id, token_id)])
+                                for token_id in token_ids])
+    token_infos = {}
+    for token_id, result in zip(token_ids, results):
+        if not result:
+            continue
+        result['tokenId'] = token_id
+        token_infos[token_id] = result
+    return token_infos
+
+
 def db_save_token_info_dict(token_dict):
     try:
         token = token_schema.load(token_dict)
@@ -277,11 +344,56 @@ def db_save_token_info_dict(token_dict):
             db.session.rollback()
             app.logger.error(
                 f'fail to commit Token {token.token_name}: SQLAlchemyError {err}')
+            return
 
         except Exception as err:
             db.session.rollback()
             app.logger.error(
                 f'fail to commit Token {token.token_name}: General Error {err}')
+            return
+
+    bump_version(TOKEN_CATALOG_VERSION_KEY)
+
+
+def create_token_empty(token_id):
+    '''
+    save a placeholder token, for a token id gvite does not know or cannot be asked about
+    '''
+    token = Token(token_id=token_id,
+                  token_name=f'unknown',
+                  token_symbol=f'UNKOWN',
+                  total_supply=0,
+                  decimals=18,
+                  owner='',
+                  is_reissuable=False,
+                  max_supply=0,
+                  is_owner_burn_only=False,
+                  index=0)
+
+    q = db.session.query(Token).filter_by(token_id=token.token_id)
+    try:
+        q.one()
+    except NoResultFound:
+        db.session.add(token)
+    else:
+        app.logger.info(f'token {token.token_id} already exists, updating')
+        db.session.merge(token)
+    finally:
+        try:
+            db.session.commit()
+        except SQLAlchemyError as err:
+            db.session.rollback()
+            app.logger.error(
+                f'fail to commit token {token.token_id}: SQLAlchemyError {err}')
+            return
+
+        except Exception as err:
+            db.session.rollback()
+            app.logger.error(
+                f'fail to commit token {token.token_id}: General Error {err}')
+            return
+
+    bump_version(TOKEN_CATALOG_VERSION_KEY)
 
 
 def get_token_info_list_gvite(page_idx=0, page_size=10):
@@ -294,8 +406,7 @@ def get_token_info_list_gvite(page_idx=0, page_size=10):
     }
 
     try:
-        resp_token_list = requests.post(
-            app.config['URL_RPC'],  json=request_body, headers=headers)
+        resp_token_list = rpc_post(request_body, headers)
 
         response = resp_token_list.json()['result']
     except requests.Timeout:
@@ -367,8 +478,7 @@ def gvite_get_account_quota(address):
     }
 
     try:
-        resp_account_quota = requests.post(
-            app.config['URL_RPC'],  json=request_body, headers=headers)
+        resp_account_quota = rpc_post(request_body, headers)
 
         response = resp_account_quota.json().get('result')
     except requests.Timeout:
@@ -391,8 +501,7 @@ def gvite_get_contract_info(address):
     }
 
     try:
-        resp_contract = requests.post(
-            app.config['URL_RPC'],  json=request_body, headers=headers)
+        resp_contract = rpc_post(request_body, headers)
 
         response = resp_contract.json().get('result')
     except requests.Timeout:
@@ -415,8 +524,7 @@ def gvite_get_voted_sbp(address):
     }
 
     try:
-        resp_voted_sbp = requests.post(
-            app.config['URL_RPC'],  json=request_body, headers=headers)
+        resp_voted_sbp = rpc_post(request_body, headers)
         response = resp_voted_sbp.json().get('result')
     except requests.Timeout:
         response = {'err': 'timeout'}
@@ -0,0 +1,66 @@
+'''
+In-memory directory of SBPs, serving the SBP endpoints without DB queries.
+
+The directory keeps every SBP serialized once, in rank order with its reward.
+Responses are JSON text built at rebuild time. It is rebuilt when
+SBP_DIRECTORY_VERSION_KEY is bumped by refresh_sbp_list() or save_sbp_reward().
+The activity of the producers changes with every snapshot block, it is not
+part of the directory and is queried on each request instead.
+'''
+from flask import json
+from sqlalchemy.orm import selectinload
+
+from ..cache import VersionedCache
+from ..models import SBP, db
+from ..serializers import serializer_sbp
+
+SBP_DIRECTORY_VERSION_KEY = 'sbp_directory_version'
+
+
+def to_json(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+class SBPDirectory:
+
+    def __init__(self, sbps):
+        # sbps in rank order
+        self.by_name = {}
+        self.by_address = {}
+        active_fragments = []
+        for sbp in sbps:
+            fragment = to_json(serializer_sbp.dump(sbp))
+            self.by_name[sbp.name] = fragment
+            self.by_address[sbp.block_producing_address] = fragment
+            if sbp.votes is not None and sbp.votes > 0:
+                active_fragments.append(fragment)
+        self.sbp_list_json = '[' + ','.join(active_fragments) + ']'
+
+    def get_sbp_json(self, name):
+        return self.by_name.get(name)
+
+    def get_sbp_list_json(self):
+        '''
+        SBPs with votes, in rank order
+        '''
+        return self.sbp_list_json
+
+    def get_active_sbp_json(self, block_producing_addresses):
+        '''
+        the SBPs of block producing addresses, in the order of the addresses
+        '''
+        fragments = []
+        for address in block_producing_addresses:
+            fragment = self.by_address.get(address)
+            if fragment is not None:
+                fragments.append(fragment)
+        return '[' + ','.join(fragments) + ']'
+
+
+def build_sbp_directory():
+    sbps = db.session.query(SBP).options(selectinload(SBP.reward)).order_by(
+        SBP.rank.asc().nullslast(), SBP.name).all()
+    return SBPDirectory(sbps)
+
+
+sbp_directory = VersionedCache(SBP_DIRECTORY_VERSION_KEY, build_sbp_directory)
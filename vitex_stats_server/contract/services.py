@@ -1,23 +1,20 @@
-from vitex_stats_server.models import SBPSchema, TokenSchema
-from flask import request, jsonify, Blueprint
-from .data_accessor import da_get_active_sbp_v3, get_sbp_detail_da, get_sbp_list_da, get_token_info_list_da, get_token_info_by_Id, gvite_get_contract_info, gvite_get_voted_sbp, search_token_name_da
+from flask import current_app as app, request, jsonify, Blueprint
+from ..batch import get_batch_ids
+from .data_accessor import db_save_token_info_dict, get_token_info_dicts, gvite_get_token_infos_by_ids
+from .data_accessor import get_active_sbp_json_da, get_sbp_json_da, get_sbp_list_json_da, get_token_info_dict, get_token_info_list_da, gvite_get_contract_info, gvite_get_voted_sbp, search_token_name_da
 
 bp_contract = Blueprint('contract', __name__, url_prefix='/contract')
 
-sbp_schema = SBPSchema()
-token_schema = TokenSchema()
-
 
 @bp_contract.route('/get_sbp_by_name/<name>', methods=['GET', ])
 def get_sbp_by_name(name):
     if request.method != 'GET':
         return jsonify({'err': 'mothed not allowed'}), 405
 
-    sbp = get_sbp_detail_da(name)
+    sbp_json = get_sbp_json_da(name)
 
-    if sbp:
-        result = sbp_schema.dump(sbp)
-        return jsonify(result)
+    if sbp_json:
+        return app.response_class(sbp_json, mimetype='application/json')
 
     result = {'err': 'no sbp found'}
     return jsonify(result), 404
@@ -28,11 +25,9 @@ def get_sbp_list():
     if request.method != 'GET':
         return jsonify({'err': 'mothed not allowed'}), 405
 
-    sbps = get_sbp_list_da(active_only=True)
-
-    result = sbp_schema.dump(sbps, many=True)
+    sbps_json = get_sbp_list_json_da()
 
-    return jsonify(result)
+    return app.response_class(sbps_json, mimetype='application/json')
 
 
 def pack_token_info(token_info):
@@ -56,7 +51,7 @@ def get_token_info_list_order(order, sort_field, page_idx, page_size):
         'totalCount': count,
         'pageIdx': page_idx,
         'pageSize': page_size,
-        'tokenInfoList': token_schema.dump(tokens, many=True),
+        'tokenInfoList': tokens,
     }
 
     return jsonify(response)
@@ -71,7 +66,7 @@ def search_token_info_list_order(name, order, sort_field, page_idx, page_size):
         'totalCount': count,
         'pageIdx': page_idx,
         'pageSize': page_size,
-        'tokenInfoList': token_schema.dump(tokens, many=True),
+        'tokenInfoList': tokens,
     }
 
     return jsonify(response)
@@ -84,19 +79,45 @@ def get_token_info_list(page_idx, page_size):
 
 @bp_contract.route('/get_token_info/<token_id>', methods=['GET'])
 def get_token_info(token_id):
-    token = get_token_info_by_Id(token_id)
-    result = token_schema.dump(token)
+    result = get_token_info_dict(token_id)
+    if result is None:
+        result = {}
 
     return jsonify(result)
 
 
+@bp_contract.route('/get_token_infos_by_ids', methods=['POST'])
+def get_token_infos_by_ids():
+    '''
+    body: {"tokenIds": [token id, ...]}
+    return the token infos keyed by token id, null for the tokens not found
+    '''
+    token_ids, error = get_batch_ids('tokenIds')
+    if error:
+        return error
+
+    token_infos = get_token_info_dicts(token_ids)
+
+    missing_token_ids = [
+        token_id for token_id in token_ids if token_id not in token_infos]
+    if missing_token_ids:
+        fetched_token_infos = gvite_get_token_infos_by_ids(missing_token_ids)
+        for token_info in fetched_token_infos.values():
+            db_save_token_info_dict(token_info)
+        if fetched_token_infos:
+            token_infos = get_token_info_dicts(token_ids, refresh=True)
+
+    result = {token_id: token_infos.get(token_id) for token_id in token_ids}
+
+    return jsonify({'err': 'ok', 'result': result})
+
+
 @bp_contract.route('/get_active_sbp/<count>', methods=['GET'])
 def get_active_sbp(count):
     count = int(count)
-    sbps = da_get_active_sbp_v3(count)
-    result = sbp_schema.dump(sbps, many=True)
+    sbps_json = get_active_sbp_json_da(count)
 
-    return jsonify(result)
+    return app.response_class(sbps_json, mimetype='application/json')
 
 
 @bp_contract.route('/get_contract_info/<address>', methods=['GET'])
@@ -0,0 +1,134 @@
+'''
+In-memory catalog of all tokens, serving token list and token search without DB queries.
+
+The catalog keeps the serialized tokens, one pre-sorted view per sort field and
+order, and an n-gram index of token names and symbols for substring search.
+It is rebuilt when TOKEN_CATALOG_VERSION_KEY is bumped by download_tokens() or
+db_save_token_info_dict(), and every ACTIVITY_MAX_AGE seconds for the activity view.
+'''
+from ..cache import VersionedCache
+from ..models import Token, db
+from ..serializers import serializer_token
+
+TOKEN_CATALOG_VERSION_KEY = 'token_catalog_version'
+NGRAM_SIZE = 3
+# the activity view follows the daily rollups
+ACTIVITY_MAX_AGE = 300
+
+
+def get_ngrams(text, max_size=NGRAM_SIZE):
+    '''
+    all substrings of text of length 1 to max_size
+    '''
+    ngrams = set()
+    for size in range(1, max_size + 1):
+        for start in range(len(text) - size + 1):
+            ngrams.add(text[start:start + size])
+    return ngrams
+
+
+def sort_key(value):
+    # None sorts last in ascending order and first in descending order, like in PostgreSQL
+    if value is None:
+        return (1, '')
+    if isinstance(value, str):
+        return (0, value.casefold(), value)
+    return (0, value)
+
+
+class TokenCatalog:
+
+    def __init__(self, tokens, transfer_counts, sort_fields, activity_sort_field):
+        # tokens sorted by id, so that every view breaks ties by token id.
+        # only plain values are kept, the catalog outlives the session of its build
+        tokens = sorted(tokens, key=lambda token: token.token_id)
+        self.tokens = serializer_token.dump(tokens, many=True)
+        self.positions = {token.token_id: position for position,
+                          token in enumerate(tokens)}
+
+        sort_values = {sort_field: [getattr(token, column.key) for token in tokens]
+                       for sort_field, column in sort_fields.items()}
+        sort_values[activity_sort_field] = [transfer_counts.get(
+            token.token_id, 0) for token in tokens]
+
+        self.views = {}
+        self.ranks = {}
+        for sort_field, values in sort_values.items():
+            keys = [sort_key(value) for value in values]
+            for order in ('asc', 'desc'):
+                view = sorted(range(len(tokens)), key=keys.__getitem__,
+                              reverse=(order == 'desc'))
+                rank = [0] * len(tokens)
+                for position_rank, position in enumerate(view):
+                    rank[position] = position_rank
+                self.views[(sort_field, order)] = view
+                self.ranks[(sort_field, order)] = rank
+
+        self.names = []
+        self.ngram_index = {}
+        for position, token in enumerate(tokens):
+            names = ((token.token_name or '').lower(),
+                     (token.token_symbol or '').lower())
+            self.names.append(names)
+            for name in names:
+                for ngram in get_ngrams(name):
+                    self.ngram_index.setdefault(ngram, set()).add(position)
+
+    def get_token(self, token_id):
+        position = self.positions.get(token_id)
+        if position is None:
+            return None
+        return self.tokens[position]
+
+    def get_view_key(self, order, sort_field):
+        if order != 'desc':
+            order = 'asc'
+        if (sort_field, order) not in self.views:
+            sort_field = 'tokenName'
+        return (sort_field, order)
+
+    def list_tokens(self, order, sort_field, page_idx=0, page_size=10):
+        view = self.views[self.get_view_key(order, sort_field)]
+        offset = page_idx * page_size
+        page = view[offset:offset + page_size]
+        return [self.tokens[position] for position in page], len(view)
+
+    def search_positions(self, keyword):
+        '''
+        positions of the tokens whose name or symbol contains keyword, case-insensitive
+        '''
+        keyword = keyword.lower()
+        if len(keyword) == 0:
+            return set(range(len(self.tokens)))
+        if len(keyword) <= NGRAM_SIZE:
+            return self.ngram_index.get(keyword, set())
+
+        ngrams = [keyword[start:start + NGRAM_SIZE]
+                  for start in range(len(keyword) - NGRAM_SIZE + 1)]
+        # n-grams of name and symbol are indexed together, candidates are verified
+        candidates = set.intersection(
+            *(self.ngram_index.get(ngram, set()) for ngram in ngrams))
+        return {position for position in candidates
+                if any(keyword in name for name in self.names[position])}
+
+    def search_tokens(self, keyword, order, sort_field, page_idx=0, page_size=10):
+        rank = self.ranks[self.get_view_key(order, sort_field)]
+        matches = sorted(self.search_positions(keyword), key=rank.__getitem__)
+        offset = page_idx * page_size
+        page = matches[offset:offset + page_size]
+        return [self.tokens[position] for position in page], len(matches)
+
+
+def build_token_catalog():
+    from .data_accessor import TOKEN_ACTIVITY_SORT_FIELD, TOKEN_SORT_FIELD, token_activity_subquery
+
+    tokens = db.session.query(Token).all()
+    activity = token_activity_subquery()
+    transfer_counts = dict(db.session.query(
+        activity.c.token_id, activity.c.transfer_count).all())
+
+    return TokenCatalog(tokens, transfer_counts, TOKEN_SORT_FIELD, TOKEN_ACTIVITY_SORT_FIELD)
+
+
+token_catalog = VersionedCache(
+    TOKEN_CATALOG_VERSION_KEY, build_token_catalog, max_age=ACTIVITY_MAX_AGE)
@@ -1,14 +1,256 @@
+'''
+Retention of account blocks and snapshot blocks, run by `flask manage clean-db-after-date`.
+
+Rows older than the target date are deleted in batches, committed one by one and
+throttled to a rate of rows per second, so the sync daemons keep writing meanwhile.
+The rows of each batch are appended to gzipped NDJSON archives, one per table,
+before the batch is committed. Partitions older than the target month are archived
+then dropped whole, see partition.py.
+
+The target is saved in config_status until the job completes, an interrupted job
+is resumed by `flask manage clean-db-resume`. Rows archived by a batch that did not
+commit are archived again, an archive holds every deleted row at least once.
+'''
+import gzip
+import json
 import logging
-from sqlalchemy import delete
-from .models import db, AccountBlock
+import os
+import time
+from datetime import datetime, timezone
+
+import daemon
+from flask import current_app as app
+from sqlalchemy import delete, literal, select, tuple_
 from sqlalchemy.exc import SQLAlchemyError
 
+from .cache import bump_version
+from .ledger.cold_archive import COLD_ARCHIVE_VERSION_KEY
+from .models import db, AccountBlock, ConfigStatus, SnapshotBlock, SnapshotData
+from .partition import drop_partition, get_partition_table, get_partitions_before
+
+RETENTION_PROGRESS_KEY = 'retention_progress'
+# rows deleted per transaction
+RETENTION_BATCH_SIZE = 1000
+# rows deleted per second, 0 or None for no limit
+RETENTION_RATE = 5000
+RETENTION_ARCHIVE_DIR = '/tmp/vitex_archive'
+# rows read at once when archiving a partition
+ARCHIVE_READ_SIZE = 10000
+
+
+def get_archive_path(archive_dir, table_name, target_timestamp):
+    target_date = datetime.fromtimestamp(target_timestamp, timezone.utc).strftime('%Y%m%d')
+    return os.path.join(archive_dir, f'{table_name}_before_{target_date}.ndjson.gz')
+
+
+class Archive:
+    '''
+    appends rows to the gzipped NDJSON archives of a retention job, each run
+    appends a gzip member to the files, they read as one with zcat
+    '''
+
+    def __init__(self, archive_dir, target_timestamp):
+        self.archive_dir = archive_dir
+        self.target_timestamp = target_timestamp
+        self.files = {}
+        os.makedirs(archive_dir, exist_ok=True)
+
+    def write(self, table_name, rows):
+        f = self.files.get(table_name)
+        if f is None:
+            f = gzip.open(get_archive_path(
+                self.archive_dir, table_name, self.target_timestamp), 'ab')
+            self.files[table_name] = f
+        for row in rows:
+            # amounts are decimals, written as strings to keep their precision
+            f.write(json.dumps(dict(row._mapping), default=str,
+                    separators=(',', ':')).encode() + b'\n')
+
+    def sync(self):
+        '''
+        flush the archives to disk, called before committing the deletion of their rows
+        '''
+        for f in self.files.values():
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+
+class Throttle:
+    def __init__(self, rate):
+        self.rate = rate
+        self.start = time.monotonic()
+        self.count = 0
+
+    def wait(self, count):
+        '''
+        sleep until count more rows fit in the rate
+        '''
+        self.count += count
+        if self.rate:
+            time.sleep(max(0, self.start + self.count /
+                           self.rate - time.monotonic()))
+
+
+def load_progress():
+    progress = db.session.get(ConfigStatus, RETENTION_PROGRESS_KEY)
+    return None if progress is None else json.loads(progress.value)
+
 
-def delete_account_block_after_date(target_date):
-    target_timestamp = target_date.timestamp()
+def save_progress(progress):
+    '''
+    the caller commits, with the batch the progress is of
+    '''
+    db.session.merge(ConfigStatus(
+        key=RETENTION_PROGRESS_KEY, value=json.dumps(progress)))
+
+
+def clear_progress():
+    db.session.query(ConfigStatus).filter(
+        ConfigStatus.key == RETENTION_PROGRESS_KEY).delete()
+    db.session.commit()
+
+
+def delete_snapshot_data(progress, archive, batch_size, throttle):
+    '''
+    snapshot_data is not partitioned, its rows are deleted with their snapshot blocks
+    older than the target, which are walked in (timestamp, hash) order from the cursor
+    saved in progress
+    '''
+    target_timestamp = progress['target']
+    while True:
+        query = db.session.query(SnapshotBlock.timestamp, SnapshotBlock.hash).filter(
+            SnapshotBlock.timestamp < target_timestamp)
+        if progress.get('cursor') is not None:
+            # typed literals, the hash is bound as bytea in binary storage
+            timestamp, hashstr = progress['cursor']
+            query = query.filter(tuple_(SnapshotBlock.timestamp, SnapshotBlock.hash) > tuple_(
+                literal(timestamp, SnapshotBlock.timestamp.type), literal(hashstr, SnapshotBlock.hash.type)))
+        snapshot_blocks = query.order_by(
+            SnapshotBlock.timestamp, SnapshotBlock.hash).limit(batch_size).all()
+        if not snapshot_blocks:
+            return
+        rows = db.session.execute(delete(SnapshotData).where(SnapshotData.snapshot_block_hash.in_(
+            [snapshot_block.hash for snapshot_block in snapshot_blocks])).returning(*SnapshotData.__table__.c)).all()
+        archive.write(SnapshotData.__tablename__, rows)
+        archive.sync()
+        progress['cursor'] = list(snapshot_blocks[-1])
+        save_progress(progress)
+        db.session.commit()
+        throttle.wait(len(rows))
+
+
+def drop_old_partitions(progress, archive):
+    '''
+    archive then drop the partitions older than the target month
+    '''
+    for table_name in (AccountBlock.__tablename__, SnapshotBlock.__tablename__):
+        for name in get_partitions_before(table_name, progress['target']):
+            with db.engine.connect() as conn:
+                # typed columns, hashes are decoded in binary storage
+                result = conn.execution_options(stream_results=True).execute(
+                    select(get_partition_table(table_name, name))).yield_per(ARCHIVE_READ_SIZE)
+                for rows in result.partitions():
+                    archive.write(table_name, rows)
+            archive.sync()
+            drop_partition(table_name, name)
+            logging.info(f'archived and dropped partition {name}')
+
+
+def delete_rows(model, progress, archive, batch_size, throttle):
+    '''
+    delete the rows of model older than the target, oldest first
+    '''
+    table = model.__table__
+    target_timestamp = progress['target']
+    while True:
+        batch = select(table.c.hash).where(table.c.timestamp < target_timestamp).order_by(
+            table.c.timestamp).limit(batch_size).scalar_subquery()
+        # the timestamp bound spares the recent partitions
+        rows = db.session.execute(delete(table).where(table.c.timestamp < target_timestamp).where(
+            table.c.hash.in_(batch)).returning(*table.c)).all()
+        if not rows:
+            return
+        archive.write(table.name, rows)
+        archive.sync()
+        progress['deleted'] = progress.get('deleted', 0) + len(rows)
+        save_progress(progress)
+        db.session.commit()
+        logging.info(
+            f'deleted {len(rows)} rows of {table.name}, {progress["deleted"]} in total')
+        throttle.wait(len(rows))
+
+
+def run_retention(progress, batch_size=None, rate=None, archive_dir=None):
+    '''
+    delete and archive the rows older than progress['target'] from where progress stopped
+    '''
+    if batch_size is None:
+        batch_size = app.config.get(
+            'RETENTION_BATCH_SIZE', RETENTION_BATCH_SIZE)
+    if rate is None:
+        rate = app.config.get('RETENTION_RATE', RETENTION_RATE)
+    if archive_dir is None:
+        archive_dir = app.config.get(
+            'RETENTION_ARCHIVE_DIR', RETENTION_ARCHIVE_DIR)
+
+    archive = Archive(archive_dir, progress['target'])
+    throttle = Throttle(rate)
     try:
-        db.session.execute(delete(AccountBlock).where(
-            AccountBlock.timestamp < target_timestamp).execution_options(synchronize_session=False))
+        delete_snapshot_data(progress, archive, batch_size, throttle)
+        drop_old_partitions(progress, archive)
+        delete_rows(AccountBlock, progress, archive, batch_size, throttle)
+        delete_rows(SnapshotBlock, progress, archive, batch_size, throttle)
+        clear_progress()
+        # the cold archive serves the blocks older than the ones left
+        bump_version(COLD_ARCHIVE_VERSION_KEY)
     except SQLAlchemyError as err:
         db.session.rollback()
-        logging.error(f'Fail to delete account blocks, SQLAlchemyError {err}')
+        logging.error(
+            f'Fail to delete account blocks, resume with clean-db-resume, SQLAlchemyError {err}')
+        return False
+    finally:
+        archive.close()
+    logging.info(f'deleted the rows before {datetime.fromtimestamp(progress["target"], timezone.utc)}, '
+                 f'archived in {archive_dir}')
+    return True
+
+
+def delete_account_block_after_date(target_date, batch_size=None, rate=None, archive_dir=None):
+    '''
+    delete the account blocks and snapshot blocks older than target_date, a job
+    interrupted before is replaced
+    '''
+    progress = {'target': int(target_date.timestamp())}
+    save_progress(progress)
+    db.session.commit()
+    return run_retention(progress, batch_size, rate, archive_dir)
+
+
+def resume_retention(batch_size=None, rate=None, archive_dir=None):
+    '''
+    resume the interrupted job, return None if there is none
+    '''
+    progress = load_progress()
+    if progress is None:
+        return None
+    return run_retention(progress, batch_size, rate, archive_dir)
+
+
+def retention_daemon_main(job, *args):
+    '''
+    run job, delete_account_block_after_date() or resume_retention(), detached
+    '''
+    # DaemonContext closes every fd, connections opened before, e.g. by the
+    # progress check of clean-db-resume, are dropped and reopened in the daemon
+    db.session.remove()
+    db.engine.dispose()
+    with daemon.DaemonContext():
+        logging.basicConfig(level=logging.INFO,
+                            format='%(asctime)s %(levelname)-8s %(message)s',
+                            filename='/tmp/vitex_retention.log')
+        job(*args)
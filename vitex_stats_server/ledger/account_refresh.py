@@ -0,0 +1,72 @@
+'''
+Background refresh of outdated accounts, for stale-while-revalidate reads.
+
+Every worker process may see the same outdated account, the refresh is claimed
+with a compare-and-set on last_modified so that only one of them downloads it.
+The claim makes the account look fresh for ACCOUNT_REFRESH_CLAIM_SECONDS, after
+which a failed refresh can be claimed again.
+'''
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app as app
+
+from .data_accessor import db_claim_account_refresh, refresh_account
+
+ACCOUNT_FRESH_SECONDS = 300
+ACCOUNT_MAX_STALE_SECONDS = 3600
+ACCOUNT_REFRESH_CLAIM_SECONDS = 30
+ACCOUNT_REFRESH_WORKERS = 2
+
+
+def get_account_age(account):
+    return (datetime.now() - account.last_modified).total_seconds()
+
+
+def account_is_stale(account):
+    '''
+    the account can be served but should be refreshed
+    '''
+    return get_account_age(account) > app.config.get('ACCOUNT_FRESH_SECONDS', ACCOUNT_FRESH_SECONDS)
+
+
+def account_need_update(account):
+    '''
+    the account must be refreshed before being served
+    '''
+    if account is None or account.last_modified is None:
+        return True
+    return get_account_age(account) > app.config.get('ACCOUNT_MAX_STALE_SECONDS', ACCOUNT_MAX_STALE_SECONDS)
+
+
+class AccountRefresher:
+
+    def __init__(self, max_workers=ACCOUNT_REFRESH_WORKERS):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='account-refresh')
+
+    def schedule(self, account):
+        '''
+        refresh a stale account in the background, unless another worker already does
+        return True if the refresh is scheduled by this call
+        '''
+        fresh_seconds = app.config.get(
+            'ACCOUNT_FRESH_SECONDS', ACCOUNT_FRESH_SECONDS)
+        claimed_last_modified = datetime.now() - timedelta(
+            seconds=max(fresh_seconds - ACCOUNT_REFRESH_CLAIM_SECONDS, 0))
+        if not db_claim_account_refresh(account.address, account.last_modified, claimed_last_modified):
+            return False
+        self.executor.submit(
+            self.run, app._get_current_object(), account.address)
+        return True
+
+    def run(self, flask_app, address):
+        with flask_app.app_context():
+            try:
+                refresh_account(address)
+            except Exception as err:
+                flask_app.logger.error(
+                    f'fail to refresh account {address}: General Error {err}')
+
+
+account_refresher = AccountRefresher()
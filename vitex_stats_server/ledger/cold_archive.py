@@ -0,0 +1,452 @@
+'''
+Cold archive of the account blocks of past months, in immutable segment files.
+
+`flask manage build-cold-segments` exports the account blocks of each month from
+DB, before retention deletes them, into a directory of COLD_ARCHIVE_DIR named
+like account_block_y2021m03. A month is cut into segments of at most
+SEGMENT_MAX_ROWS blocks, each made of:
+- rows.dat: NDJSON rows compressed with zlib by blocks of BLOCK_ROWS rows
+- hash.idx: (hash, block offset, block length, slot) entries sorted by hash
+- address.idx: (address key, timestamp, block offset, block length, slot) entries
+  sorted by address key then timestamp
+- hash.bloom: bloom filter of the hashes
+- address.bloom: bloom filter of the addresses
+- meta.json
+The index and bloom files are memory mapped and binary searched in place, a lookup
+reads a few pages and decompresses a single block. The bloom filters skip the
+segments which do not hold the hash or the address looked up, a miss searches
+BLOOM_ERROR_RATE of the segments on average. Segments of format 1, without
+hash.bloom, are searched for every hash: rebuild them to get one.
+
+db_get_account_block_by_hash() consults the archive after a DB miss,
+db_get_account_blocks_by_account() pages through the archived blocks older than
+the oldest block in DB.
+'''
+import hashlib
+import itertools
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import shutil
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from decimal import Decimal
+
+from flask import current_app as app
+from sqlalchemy import Numeric, func, select
+
+from ..cache import VersionedCache, bump_version
+from ..models import AccountBlock, db
+from ..partition import add_months, month_start
+
+COLD_ARCHIVE_VERSION_KEY = 'cold_archive_version'
+# the oldest timestamp in DB moves with retention
+COLD_ARCHIVE_MAX_AGE = 60
+
+SEGMENT_MAX_ROWS = 100000
+BLOCK_ROWS = 128
+BLOOM_ERROR_RATE = 0.01
+# decompressed blocks kept per process
+BLOCK_CACHE_SIZE = 256
+SEGMENT_FORMAT_VERSION = 2
+
+HASH_ENTRY = struct.Struct('>32sQII')
+ADDRESS_ENTRY = struct.Struct('>QqQII')
+MONTH_PATTERN = re.compile(r'^account_block_y(\d{4})m(\d{2})$')
+
+
+def address_key(address):
+    return struct.unpack('>Q', hashlib.blake2b(address.encode(), digest_size=8).digest())[0]
+
+
+def hash_key(hashstr):
+    '''
+    32 bytes of a hex hash, None if hashstr is not one
+    '''
+    try:
+        key = bytes.fromhex(hashstr)
+    except (TypeError, ValueError):
+        return None
+    return key if len(key) == 32 else None
+
+
+def get_month_name(month):
+    return f'{AccountBlock.__tablename__}_y{month.year}m{month.month:02d}'
+
+
+class BloomFilter:
+    '''
+    bits set by hash_count positions per key, str or bytes, derived from one blake2b digest
+    '''
+
+    def __init__(self, bits, bit_count, hash_count):
+        self.bits = bits
+        self.bit_count = bit_count
+        self.hash_count = hash_count
+
+    @classmethod
+    def create(cls, key_count, error_rate=BLOOM_ERROR_RATE):
+        bit_count = max(8, math.ceil(-key_count *
+                        math.log(error_rate) / math.log(2) ** 2))
+        hash_count = max(1, round(bit_count / max(key_count, 1) * math.log(2)))
+        return cls(bytearray((bit_count + 7) // 8), bit_count, hash_count)
+
+    def positions(self, key):
+        if isinstance(key, str):
+            key = key.encode()
+        h1, h2 = struct.unpack('>QQ', hashlib.blake2b(
+            key, digest_size=16).digest())
+        return ((h1 + i * h2) % self.bit_count for i in range(self.hash_count))
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+
+# amounts are DECIMAL(128, 0), integers in JSON
+DECIMAL_COLUMNS = tuple(column.name for column in AccountBlock.__table__.c
+                        if isinstance(column.type, Numeric) and column.type.asdecimal)
+
+
+def encode_row(row):
+    return {key: int(value) if isinstance(value, Decimal) else value for key, value in row.items()}
+
+
+def decode_row(row):
+    for key in DECIMAL_COLUMNS:
+        if row[key] is not None:
+            row[key] = Decimal(row[key])
+    return row
+
+
+def write_segment(path, rows):
+    '''
+    write the files of a segment of rows, dicts of account_block columns ordered by timestamp
+    '''
+    os.makedirs(path)
+    # a block triggered by a receive block is archived with it
+    triggered_hashes = {}
+    for row in rows:
+        if row['triggered_by_account_block_hash']:
+            triggered_hashes.setdefault(
+                row['triggered_by_account_block_hash'], []).append(row['hash'])
+
+    hash_entries = []
+    address_entries = []
+    hash_bloom = BloomFilter.create(len(rows))
+    bloom = BloomFilter.create(len({row['address'] for row in rows}))
+    with open(os.path.join(path, 'rows.dat'), 'wb') as f:
+        for start in range(0, len(rows), BLOCK_ROWS):
+            block_rows = rows[start:start + BLOCK_ROWS]
+            data = zlib.compress(b''.join(json.dumps(
+                dict(encode_row(row), triggered_hashes=triggered_hashes.get(row['hash'], [])),
+                separators=(',', ':')).encode() + b'\n' for row in block_rows))
+            offset = f.tell()
+            f.write(data)
+            for slot, row in enumerate(block_rows):
+                key = hash_key(row['hash'])
+                if key is not None:
+                    hash_entries.append((key, offset, len(data), slot))
+                    hash_bloom.add(key)
+                if row['address']:
+                    address_entries.append((address_key(
+                        row['address']), row['timestamp'], row['height'] or 0, offset, len(data), slot))
+                    bloom.add(row['address'])
+
+    hash_entries.sort()
+    with open(os.path.join(path, 'hash.idx'), 'wb') as f:
+        for entry in hash_entries:
+            f.write(HASH_ENTRY.pack(*entry))
+    # blocks of an account in chain order
+    address_entries.sort()
+    with open(os.path.join(path, 'address.idx'), 'wb') as f:
+        for key, timestamp, _, offset, length, slot in address_entries:
+            f.write(ADDRESS_ENTRY.pack(key, timestamp, offset, length, slot))
+    with open(os.path.join(path, 'hash.bloom'), 'wb') as f:
+        f.write(hash_bloom.bits)
+    with open(os.path.join(path, 'address.bloom'), 'wb') as f:
+        f.write(bloom.bits)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({
+            'version': SEGMENT_FORMAT_VERSION,
+            'rows': len(rows),
+            'first_timestamp': rows[0]['timestamp'],
+            'last_timestamp': rows[-1]['timestamp'],
+            'bloom_bit_count': bloom.bit_count,
+            'bloom_hash_count': bloom.hash_count,
+            'hash_bloom_bit_count': hash_bloom.bit_count,
+            'hash_bloom_hash_count': hash_bloom.hash_count,
+        }, f)
+
+
+def build_month(archive_dir, month, next_month, max_rows=SEGMENT_MAX_ROWS):
+    '''
+    export the account blocks of month into its directory of segments, return the number of rows.
+    the directory is written aside and renamed when complete, an interrupted build leaves nothing
+    '''
+    name = get_month_name(month)
+    building_path = os.path.join(archive_dir, f'.{name}.building')
+    shutil.rmtree(building_path, ignore_errors=True)
+    os.makedirs(building_path)
+
+    table = AccountBlock.__table__
+    stmt = select(table).where(table.c.timestamp >= int(month.timestamp())).where(
+        table.c.timestamp < int(next_month.timestamp())).order_by(table.c.timestamp, table.c.hash)
+    count = 0
+    segment_rows = []
+    segment_paths = (os.path.join(building_path, f'{index:04d}') for index in itertools.count())
+    with db.engine.connect() as conn:
+        result = conn.execution_options(
+            stream_results=True).execute(stmt).yield_per(BLOCK_ROWS * 8)
+        for row in result.mappings():
+            # segments are cut between timestamps, a receive block and the blocks it triggered stay together
+            if len(segment_rows) >= max_rows and row['timestamp'] != segment_rows[-1]['timestamp']:
+                write_segment(next(segment_paths), segment_rows)
+                segment_rows = []
+            segment_rows.append(dict(row))
+            count += 1
+    if segment_rows:
+        write_segment(next(segment_paths), segment_rows)
+    os.rename(building_path, os.path.join(archive_dir, name))
+    return count
+
+
+class Segment:
+
+    def __init__(self, path, block_cache):
+        self.path = path
+        self.block_cache = block_cache
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.first_timestamp = self.meta['first_timestamp']
+        self.last_timestamp = self.meta['last_timestamp']
+        self.data = self.map('rows.dat')
+        self.hash_index = self.map('hash.idx')
+        self.address_index = self.map('address.idx')
+        self.bloom = BloomFilter(self.map('address.bloom'),
+                                 self.meta['bloom_bit_count'], self.meta['bloom_hash_count'])
+        self.hash_bloom = None
+        if 'hash_bloom_bit_count' in self.meta:
+            self.hash_bloom = BloomFilter(self.map('hash.bloom'), self.meta['hash_bloom_bit_count'],
+                                         self.meta['hash_bloom_hash_count'])
+
+    def map(self, file_name):
+        with open(os.path.join(self.path, file_name), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read_rows(self, offset, length):
+        key = (self.path, offset)
+        rows = self.block_cache.get(key)
+        if rows is None:
+            rows = zlib.decompress(self.data[offset:offset + length]).splitlines()
+            self.block_cache.put(key, rows)
+        return rows
+
+    def read_row(self, offset, length, slot):
+        return decode_row(json.loads(self.read_rows(offset, length)[slot]))
+
+    def get(self, key):
+        '''
+        row of the hash key, None if not archived here
+        '''
+        if self.hash_bloom is not None and key not in self.hash_bloom:
+            return None
+        entry_count = len(self.hash_index) // HASH_ENTRY.size
+        lo, hi = 0, entry_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if HASH_ENTRY.unpack_from(self.hash_index, mid * HASH_ENTRY.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == entry_count:
+            return None
+        entry_key, offset, length, slot = HASH_ENTRY.unpack_from(
+            self.hash_index, lo * HASH_ENTRY.size)
+        return self.read_row(offset, length, slot) if entry_key == key else None
+
+    def address_bound(self, key, timestamp):
+        '''
+        index of the first address entry at or after (key, timestamp)
+        '''
+        lo, hi = 0, len(self.address_index) // ADDRESS_ENTRY.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ADDRESS_ENTRY.unpack_from(self.address_index, mid * ADDRESS_ENTRY.size)[:2] < (key, timestamp):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def address_range(self, address, before):
+        '''
+        (start, end) of the address entries of the blocks of address older than before
+        '''
+        if address not in self.bloom:
+            return 0, 0
+        key = address_key(address)
+        return self.address_bound(key, -2 ** 63), self.address_bound(key, before)
+
+    def read_address_rows(self, address, start, end):
+        rows = []
+        for index in range(start, end):
+            _, _, offset, length, slot = ADDRESS_ENTRY.unpack_from(
+                self.address_index, index * ADDRESS_ENTRY.size)
+            row = self.read_row(offset, length, slot)
+            # address keys are 64 bit digests
+            if row['address'] == address:
+                rows.append(row)
+        return rows
+
+
+class BlockCache:
+    '''
+    least recently used decompressed blocks, shared by the segments
+    '''
+
+    def __init__(self, size=BLOCK_CACHE_SIZE):
+        self.size = size
+        self.blocks = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            rows = self.blocks.get(key)
+            if rows is not None:
+                self.blocks.move_to_end(key)
+            return rows
+
+    def put(self, key, rows):
+        with self.lock:
+            self.blocks[key] = rows
+            if len(self.blocks) > self.size:
+                self.blocks.popitem(last=False)
+
+
+class ColdArchive:
+    '''
+    segments of archive_dir ordered by time, and the oldest timestamp in DB:
+    blocks from it on are served by DB
+    '''
+
+    def __init__(self, archive_dir, horizon):
+        self.horizon = horizon
+        self.segments = []
+        block_cache = BlockCache()
+        for name in sorted(os.listdir(archive_dir)) if archive_dir and os.path.isdir(archive_dir) else []:
+            if MONTH_PATTERN.match(name):
+                month_path = os.path.join(archive_dir, name)
+                self.segments += [Segment(os.path.join(month_path, segment_name), block_cache)
+                                  for segment_name in sorted(os.listdir(month_path))]
+
+    def get_account_block(self, hashstr):
+        '''
+        row dict of an archived account block with the hashes of the blocks it triggered
+        in triggered_hashes, None if not archived
+        '''
+        key = hash_key(hashstr)
+        if key is None:
+            return None
+        for segment in reversed(self.segments):
+            row = segment.get(key)
+            if row is not None:
+                return row
+        return None
+
+    def get_address_ranges(self, address):
+        '''
+        [(segment, start, end)] of the archived blocks of address older than the horizon, oldest first
+        '''
+        ranges = []
+        for segment in self.segments:
+            if self.horizon is not None and segment.first_timestamp >= self.horizon:
+                break
+            start, end = segment.address_range(
+                address, self.horizon if self.horizon is not None else 2 ** 63 - 1)
+            if end > start:
+                ranges.append((segment, start, end))
+        return ranges
+
+    def count_account_blocks(self, address):
+        return sum(end - start for _, start, end in self.get_address_ranges(address))
+
+    def get_account_blocks(self, address, descending, offset, limit):
+        '''
+        row dicts of a page of the archived blocks of address in chain order
+        '''
+        ranges = self.get_address_ranges(address)
+        if descending:
+            ranges.reverse()
+        rows = []
+        for segment, start, end in ranges:
+            if limit <= 0:
+                break
+            if offset >= end - start:
+                offset -= end - start
+                continue
+            if descending:
+                page_end = end - offset
+                page_start = max(start, page_end - limit)
+                page = segment.read_address_rows(address, page_start, page_end)
+                page.reverse()
+            else:
+                page_start = start + offset
+                page = segment.read_address_rows(
+                    address, page_start, min(end, page_start + limit))
+            rows += page
+            limit -= len(page)
+            offset = 0
+        return rows
+
+
+def build_cold_archive():
+    # 0 stands for an unknown timestamp
+    horizon = db.session.query(func.min(AccountBlock.timestamp)).filter(
+        AccountBlock.timestamp > 0).scalar()
+    return ColdArchive(app.config.get('COLD_ARCHIVE_DIR'), horizon)
+
+
+cold_archive = VersionedCache(
+    COLD_ARCHIVE_VERSION_KEY, build_cold_archive, max_age=COLD_ARCHIVE_MAX_AGE)
+
+
+def cold_archive_enabled():
+    return app.config.get('COLD_ARCHIVE_DIR') is not None
+
+
+def build_cold_segments(before_timestamp, archive_dir=None):
+    '''
+    build the segments of the months of account blocks in DB ending before before_timestamp,
+    months already built are skipped. return the names of the months built
+    '''
+    if archive_dir is None:
+        archive_dir = app.config.get('COLD_ARCHIVE_DIR')
+    os.makedirs(archive_dir, exist_ok=True)
+    first_timestamp = db.session.query(func.min(AccountBlock.timestamp)).filter(
+        AccountBlock.timestamp > 0).scalar()
+    if first_timestamp is None:
+        return []
+
+    built = []
+    month = month_start(first_timestamp)
+    while add_months(month, 1).timestamp() <= before_timestamp:
+        name = get_month_name(month)
+        if not os.path.isdir(os.path.join(archive_dir, name)):
+            count = build_month(archive_dir, month, add_months(month, 1))
+            logging.info(f'archived {count} account blocks in {name}')
+            built.append(name)
+        month = add_months(month, 1)
+    if built:
+        bump_version(COLD_ARCHIVE_VERSION_KEY)
+    return built
+
@@ -1,11 +1,22 @@
+from datetime import datetime
+import time
+
 from flask import current_app as app
 import psycopg2
-import requests
 from sqlalchemy.exc import SQLAlchemyError, NoResultFound, PendingRollbackError, IntegrityError
 from marshmallow.exceptions import ValidationError
+from sqlalchemy.sql.functions import func
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.sql.expression import bindparam, select, update
+from sqlalchemy.dialects.postgresql import insert
 
-from vitex_stats_server.contract.data_accessor import db_save_token_info_dict, gvite_get_token_info
-from ..models import Account, AccountBlock, AccountBlockSchema, AccountSchema, AccountSchemaSimple, Balance, BalanceSchema, CompleteAccountBlockSchema, SnapshotBlock, SnapshotBlockSchema, SnapshotData, db
+from vitex_stats_server.contract.data_accessor import create_token_empty, db_save_token_info_dict, gvite_get_account_quota, gvite_get_token_info, gvite_get_token_infos_by_ids
+from vitex_stats_server.records import AccountBlockRecord, AccountRecord, BalanceRecord, TokenRecord
+from vitex_stats_server.rpc import gvite_batch_call, rpc_post
+from vitex_stats_server.statistic.rollup import record_account_blocks
+from .cold_archive import cold_archive, cold_archive_enabled
+from .holder_rank import db_get_holder_count, lock, update_token_holder_ranks
+from ..models import Token, TokenHolderRank, Account, AccountBlock, AccountBlockSchema, AccountSchema, AccountSchemaSimple, Balance, BalanceSchema, CompleteAccountBlockSchema, SnapshotBlock, SnapshotBlockSchema, SnapshotData, db
 
 
 schema_account_block = AccountBlockSchema()
@@ -15,6 +26,17 @@ schema_account_simple = AccountSchemaSimple()
 schema_snapshot_block = SnapshotBlockSchema()
 schema_balance = BalanceSchema()
 
+# loading strategies of the relationships dumped by the serializers, so that a page
+# costs the same number of queries whatever its size
+LOAD_ACCOUNT_BLOCK = (joinedload(AccountBlock.token), )
+LOAD_ACCOUNT = (selectinload(Account.balances).joinedload(Balance.token), )
+LOAD_BALANCE = (joinedload(Balance.token), )
+LOAD_SNAPSHOT_BLOCK = (selectinload(SnapshotBlock.snapshot_data), )
+
+
+# serializes the writers of account_block, which keep hash unique
+ACCOUNT_BLOCK_SAVE_LOCK_KEY = 'account_block_save'
+ACCOUNT_BLOCK_COLUMNS = [column.key for column in AccountBlock.__table__.columns]
 
 SORT_FIELD_ACCOUNT_BLOCK = {
     'timestamp': AccountBlock.timestamp,
@@ -54,6 +76,88 @@ def get_sort_criteria_account(order='desc', sort_field='address'):
     return result.asc()
 
 
+def record_columns(model, record_class):
+    '''
+    columns of model selected for the non-nested fields of record_class, in order
+    '''
+    return [model.__mapper__.columns[key] for key in record_class.columns]
+
+
+# row mode: read-only list queries select only the serialized columns with Core,
+# and build records instead of ORM objects, see records.py
+ACCOUNT_BLOCK_RECORD_COLUMNS = record_columns(AccountBlock, AccountBlockRecord)
+ACCOUNT_RECORD_COLUMNS = record_columns(Account, AccountRecord)
+BALANCE_RECORD_COLUMNS = record_columns(Balance, BalanceRecord)
+TOKEN_RECORD_COLUMNS = record_columns(Token, TokenRecord)
+RANKED_BALANCE_RECORD_COLUMNS = record_columns(TokenHolderRank, BalanceRecord)
+
+
+def make_token_record(row, start):
+    '''
+    token of the columns of row from start, None when the outer join found no token
+    '''
+    if row[start] is None:
+        return None
+    return TokenRecord(*row[start:])
+
+
+def select_account_block_records(criteria, sort_criteria, offset, limit, projection=None):
+    '''
+    list of AccountBlockRecord with their token, or the records of projection, see projection.py
+    '''
+    if projection is not None and not projection.with_token:
+        stmt = select(*projection.columns).where(
+            *criteria).order_by(sort_criteria).offset(offset).limit(limit)
+        return [projection.record_class(*row) for row in db.session.execute(stmt)]
+
+    record_class, columns = (AccountBlockRecord, ACCOUNT_BLOCK_RECORD_COLUMNS) if projection is None else (
+        projection.record_class, projection.columns)
+    stmt = select(*columns, *TOKEN_RECORD_COLUMNS).select_from(
+        AccountBlock.__table__.outerjoin(Token.__table__, AccountBlock.token_id == Token.token_id)).where(
+        *criteria).order_by(sort_criteria).offset(offset).limit(limit)
+
+    start = len(columns)
+    return [record_class(*row[:start], make_token_record(row, start))
+            for row in db.session.execute(stmt)]
+
+
+def select_account_records(criteria, sort_criteria, offset, limit):
+    '''
+    list of AccountRecord with their balances, in two queries whatever the page size
+    '''
+    stmt = select(*ACCOUNT_RECORD_COLUMNS).where(
+        *criteria).order_by(sort_criteria).offset(offset).limit(limit)
+    accounts = [AccountRecord(*row, [])
+                for row in db.session.execute(stmt)]
+    if len(accounts) == 0:
+        return accounts
+
+    by_address = {account.address: account for account in accounts}
+    stmt = select(*BALANCE_RECORD_COLUMNS, *TOKEN_RECORD_COLUMNS).select_from(
+        Balance.__table__.outerjoin(Token.__table__, Balance.token_id == Token.token_id)).where(
+        Balance.account_address.in_(by_address))
+
+    start = len(BALANCE_RECORD_COLUMNS)
+    for row in db.session.execute(stmt):
+        balance = BalanceRecord(*row[:start], make_token_record(row, start))
+        by_address[balance.account_address].balances.append(balance)
+    return accounts
+
+
+def select_ranked_balance_records(token_id, offset, limit):
+    '''
+    list of BalanceRecord of the holders ranked offset + 1 to offset + limit
+    '''
+    stmt = select(*RANKED_BALANCE_RECORD_COLUMNS, *TOKEN_RECORD_COLUMNS).select_from(
+        TokenHolderRank.__table__.outerjoin(Token.__table__, TokenHolderRank.token_id == Token.token_id)).where(
+        TokenHolderRank.token_id == token_id, TokenHolderRank.rank > offset,
+        TokenHolderRank.rank <= offset + limit).order_by(TokenHolderRank.rank)
+
+    start = len(RANKED_BALANCE_RECORD_COLUMNS)
+    return [BalanceRecord(*row[:start], make_token_record(row, start))
+            for row in db.session.execute(stmt)]
+
+
 def da_get_account_blocks():
     return AccountBlock.query.all()
 
@@ -67,8 +171,7 @@ def gvite_get_snapshot_block(height):
         "params": [height, ]
     }
 
-    response = requests.post(
-        app.config['URL_RPC'],  json=request_body, headers=headers)
+    response = rpc_post(request_body, headers)
 
     result = response.json().get('result', {})
 
@@ -156,28 +259,24 @@ def db_get_snapshot_blocks_by_address(address, order, sort_field, page_idx, page
 
     offset = page_idx * page_size
 
-    count = db.session.query(SnapshotData).filter(
-        SnapshotData.account_address == address).count()
+    count = db.session.query(func.count(SnapshotData.snapshot_block_hash)).filter(
+        SnapshotData.account_address == address).scalar()
 
-    snapshot_datas = db.session.query(SnapshotData).filter(
+    # the snapshot blocks of the page are joined instead of loaded one by one
+    snapshot_blocks = db.session.query(SnapshotBlock).options(*LOAD_SNAPSHOT_BLOCK).join(
+        SnapshotData, SnapshotData.snapshot_block_hash == SnapshotBlock.hash).filter(
         SnapshotData.account_address == address).order_by(SnapshotData.height.desc()).offset(offset).limit(page_size)
 
-    result = []
-
-    for snapshot_data in snapshot_datas:
-        snapshot_block = snapshot_data.snapshot_block
-        result.append(snapshot_block)
-
-    return result, count
+    return snapshot_blocks.all(), count
 
 
 def db_get_snapshot_blocks(order, sort_field, page_idx, page_size):
 
     offset = page_idx * page_size
 
-    count = db.session.query(SnapshotBlock).count()
+    count = db.session.query(func.count(SnapshotBlock.hash)).scalar()
 
-    snapshot_blocks = db.session.query(SnapshotBlock).order_by(
+    snapshot_blocks = db.session.query(SnapshotBlock).options(*LOAD_SNAPSHOT_BLOCK).order_by(
         SnapshotBlock.height.desc()).offset(offset).limit(page_size)
 
     return snapshot_blocks, count
@@ -185,7 +284,7 @@ def db_get_snapshot_blocks(order, sort_field, page_idx, page_size):
 
 def db_get_latest_snapshot_blocks(page_size):
 
-    snapshot_blocks = db.session.query(SnapshotBlock).order_by(
+    snapshot_blocks = db.session.query(SnapshotBlock).options(*LOAD_SNAPSHOT_BLOCK).order_by(
         SnapshotBlock.height.desc()).limit(page_size)
 
     return snapshot_blocks
@@ -200,8 +299,7 @@ def gvite_get_chunks(start_height: int, end_height: int):
         "params": [start_height, end_height]
     }
 
-    response_chunks = requests.post(
-        app.config['URL_RPC'],  json=request_body, headers=headers)
+    response_chunks = rpc_post(request_body, headers)
 
     if not response_chunks.ok:
         app.logger.error(
@@ -222,8 +320,7 @@ def gvite_get_snapshot_chain_height():
         "params": []
     }
 
-    response = requests.post(
-        app.config['URL_RPC'],  json=request_body, headers=headers)
+    response = rpc_post(request_body, headers)
 
     if not response.ok:
         app.logger.error(
@@ -249,8 +346,7 @@ def gvite_get_account_block_by_hash(hashstr, deserialize=True):
         "params": [hashstr, ]
     }
 
-    response_account_block = requests.post(
-        app.config['URL_RPC'],  json=request_body, headers=headers)
+    response_account_block = rpc_post(request_body, headers)
 
     if not response_account_block.ok:
         app.logger.error(
@@ -272,8 +368,68 @@ def gvite_get_account_block_by_hash(hashstr, deserialize=True):
     return result
 
 
+def archived_account_blocks(archived_rows):
+    '''
+    transient AccountBlocks of rows of the cold archive, with their token
+    '''
+    token_ids = {row['token_id'] for row in archived_rows}
+    tokens = {token.token_id: token for token in db.session.query(Token).filter(
+        Token.token_id.in_(token_ids))} if token_ids else {}
+    account_blocks = []
+    for row in archived_rows:
+        account_block = AccountBlock(**{key: row[column.name]
+                                        for key, column in AccountBlock.__mapper__.columns.items()})
+        account_block.token = tokens.get(row['token_id'])
+        account_blocks.append(account_block)
+    return account_blocks
+
+
+def db_get_archived_account_block(hashstr):
+    '''
+    account block of the cold archive with its triggered send blocks, None if not archived
+    '''
+    archive = cold_archive.get()
+    row = archive.get_account_block(hashstr)
+    if row is None:
+        return None
+    triggered_rows = [archive.get_account_block(triggered_hash)
+                      for triggered_hash in row['triggered_hashes']]
+    account_block, *triggered_send_block_list = archived_account_blocks(
+        [row] + [triggered_row for triggered_row in triggered_rows if triggered_row is not None])
+    account_block.triggered_send_block_list = triggered_send_block_list
+    return account_block
+
+
 def db_get_account_block_by_hash(hashstr):
-    return db.session.get(AccountBlock, hashstr)
+    account_block = db.session.get(AccountBlock, hashstr)
+    if account_block is None and cold_archive_enabled():
+        return db_get_archived_account_block(hashstr)
+    return account_block
+
+
+def db_get_account_blocks_by_hashes(hashes):
+    '''
+    return {hash: account block} of the hashes found in DB or in the cold archive, with one query
+    '''
+    account_blocks = db.session.query(AccountBlock).options(*LOAD_ACCOUNT_BLOCK).filter(
+        AccountBlock.hash.in_(hashes)).all()
+    result = {account_block.hash: account_block for account_block in account_blocks}
+    if cold_archive_enabled() and len(result) < len(hashes):
+        archive = cold_archive.get()
+        archived_rows = [archive.get_account_block(hashstr)
+                         for hashstr in hashes if hashstr not in result]
+        for account_block in archived_account_blocks([row for row in archived_rows if row is not None]):
+            result[account_block.hash] = account_block
+    return result
+
+
+def gvite_get_account_blocks_by_hashes(hashes):
+    '''
+    return {hash: account block dict} of the hashes found by gvite, with one batch RPC
+    '''
+    results = gvite_batch_call(
+        [('ledger_getAccountBlockByHash', [hashstr]) for hashstr in hashes])
+    return {hashstr: result for hashstr, result in zip(hashes, results) if result}
 
 
 def account_block_complete(account_block):
@@ -285,6 +441,7 @@ def db_save_account_block(account_block):
     try:
         existing_account_block = q.one()
     except NoResultFound:
+        record_account_blocks([account_block])
         db.session.add(account_block)
     else:
         app.logger.info(
@@ -306,6 +463,75 @@ def db_save_account_block(account_block):
             return None
 
 
+def db_get_existing_token_ids(token_ids):
+    return {token_id for (token_id, ) in db.session.query(
+        Token.token_id).filter(Token.token_id.in_(token_ids))}
+
+
+def db_bulk_save_account_blocks(rows):
+    '''
+    rows: dicts of account_block columns, only the columns present are written,
+    hash and timestamp are required
+    insert or update the account blocks with one statement per set of columns,
+    and add the inserted ones to the statistics rollups in the same transaction.
+    the table only enforces (hash, timestamp), hash alone is kept unique here: saves
+    are serialized by an advisory lock and a block already saved is updated, never inserted
+    return the number of inserted account blocks
+    '''
+    # the last row of a hash wins
+    rows = list({row['hash']: row for row in rows}.values())
+
+    token_ids = {row['token_id'] for row in rows if row.get('token_id')}
+    new_token_ids = token_ids - db_get_existing_token_ids(token_ids)
+    if new_token_ids:
+        app.logger.info(f'find new Tokens {", ".join(sorted(new_token_ids))}, downloading')
+        for token_info in gvite_get_token_infos_by_ids(sorted(new_token_ids)).values():
+            db_save_token_info_dict(token_info)
+        # a token gvite fails to return must not fail the foreign key of the whole batch
+        for token_id in new_token_ids - db_get_existing_token_ids(new_token_ids):
+            app.logger.warning(
+                f'cannot download Token {token_id}, saving a placeholder')
+            create_token_empty(token_id)
+
+    table = AccountBlock.__table__
+    inserted_rows = []
+    try:
+        lock(ACCOUNT_BLOCK_SAVE_LOCK_KEY)
+        # the timestamp of a block may differ between sources, e.g. 0 replaced by the
+        # time of sync: existing blocks are found by hash alone and keep their timestamp
+        existing_timestamps = dict(db.session.execute(select(table.c.hash, table.c.timestamp).where(
+            table.c.hash.in_([row['hash'] for row in rows]))).all())
+
+        row_groups = {}
+        for row in rows:
+            if row['hash'] in existing_timestamps:
+                row = dict(row, timestamp=existing_timestamps[row['hash']])
+            row_groups.setdefault(tuple(sorted(row)), []).append(row)
+
+        for columns, group in row_groups.items():
+            new_rows = [row for row in group if row['hash'] not in existing_timestamps]
+            if new_rows:
+                db.session.execute(insert(table).values(new_rows))
+                inserted_rows += new_rows
+            existing_rows = [{f'b_{column}': value for column, value in row.items()}
+                             for row in group if row['hash'] in existing_timestamps]
+            updated_columns = [column for column in columns if column not in ('hash', 'timestamp')]
+            if existing_rows and updated_columns:
+                # the timestamp selects the partition
+                db.session.execute(update(table).where(table.c.hash == bindparam('b_hash')).where(
+                    table.c.timestamp == bindparam('b_timestamp')).values(
+                    {column: bindparam(f'b_{column}') for column in updated_columns}), existing_rows)
+        record_account_blocks([AccountBlock(**row) for row in inserted_rows])
+        db.session.commit()
+    except SQLAlchemyError as err:
+        db.session.rollback()
+        app.logger.error(
+            f'fail to bulk save {len(rows)} account blocks: SQLAlchemyError {err}')
+        return 0
+
+    return len(inserted_rows)
+
+
 def none_to_zero(src):
     if src:
         return src
@@ -321,47 +547,15 @@ def sanitize_hash(src):
     return src
 
 
-def save_account_block_from_dict(src, default_timestamp=0, triggered_by=None):
+def account_block_from_dict(src, default_timestamp=0, triggered_by=None):
     '''
-    src is a dict parsed from JSON reply of getChunks or getAccountBlockByHash.
-    It can be either of the following 2 kinds:
-    1. complete account block
-    2. simple account block from getChunks, for example:
-        {
-            "blockType": 2,
-            "hash": "603e64f972960cd886a1dc77308b9a7d127cb462567b1ecd2ef68b4330a6d0c0",
-            "prevHash": "592a1e46ad746fd7d0b12b6e51ad62ffaea42574e494f8ffeab611f11021efc0",
-            "height": 4,
-            "accountAddress": "vite_483eed4ba0b5cd984d480ca048d5ee8ef5fa6b0ae23774c09b",
-            "publicKey": "oDxoxc75R4NnzWb4Vj3P9kmSercIquNzZlPlDnhRN2M=",
-            "toAddress": "vite_0000000000000000000000000000000000000003f6af7459b9",
-            "amount": 1000000000000000000000,
-            "tokenId": "tti_5649544520544f4b454e6e40",
-            "fromBlockHash": "0000000000000000000000000000000000000000000000000000000000000000",
-            "data": "jefc/QAAAAAAAAAAAAAA14lDHx2CBQbIP9U5oK6YY9aWE4IB",
-            "quota": 82000,
-            "quotaUsed": 82000,
-            "fee": 0,
-            "logHash": null,
-            "difficulty": null,
-            "nonce": null,
-            "sendBlockList": [],
-            "signature": "hWfLf7vXqIevTPdu6acc0PVVyNYxGtN9OU73F7Vn8+ZJ5vN6Lo76q1yalt5+OdqDRA4IzlQ8ruTNgvuwT0ooCw=="
-        }
+    unsaved AccountBlock of a dict parsed from getChunks or getAccountBlockByHash,
+    see save_account_block_from_dict()
     '''
-    hashstr = src['hash']
-    quota_by_stake = src.get('quotaByStake', 0)
-    total_quota = src.get('totalQuota', 0)
-    timestamp = src.get('timestamp', default_timestamp)
-    token_id = src['tokenId']
-    if timestamp == 0:
-        app.logger.warn(
-            f'save_account_block_from_dict() invalid timestamp: {timestamp}, block: {src}')
-
-    account_block = AccountBlock(
+    return AccountBlock(
         block_type=src['blockType'],
         height=src['height'],
-        hash=hashstr,
+        hash=src['hash'],
         previous_hash=src['prevHash'],
         address=src['accountAddress'],
         public_key=src['publicKey'],
@@ -369,7 +563,7 @@ def save_account_block_from_dict(src, default_timestamp=0, triggered_by=None):
         from_address=sanitize_hash(src.get('fromAddress')),
         to_address=src['toAddress'],
         send_block_hash=sanitize_hash(src.get('sendBlockHash')),
-        token_id=token_id,
+        token_id=src['tokenId'],
         amount=none_to_zero(src.get('amount')),
 
         fee=src['fee'],
@@ -377,8 +571,8 @@ def save_account_block_from_dict(src, default_timestamp=0, triggered_by=None):
         difficulty=none_to_zero(src['difficulty']),
         nonce=sanitize_hash(src['nonce']),
         signature=src['signature'],
-        quota_by_stake=quota_by_stake,
-        total_quota=total_quota,
+        quota_by_stake=src.get('quotaByStake', 0),
+        total_quota=src.get('totalQuota', 0),
         vm_log_hash=sanitize_hash(src.get('vmlogHash')),
 
         triggered_by_account_block_hash=triggered_by,
@@ -386,111 +580,210 @@ def save_account_block_from_dict(src, default_timestamp=0, triggered_by=None):
         confirmations=none_to_zero(src.get('confirmations')),
         first_snapshot_hash=sanitize_hash(
             src.get('firstSnapshotHash')),
-        timestamp=timestamp,
+        # part of the primary key, never null
+        timestamp=src.get('timestamp') or default_timestamp,
         receive_block_height=none_to_zero(
             src.get('receiveBlockHeight')),
         receive_block_hash=sanitize_hash(src.get('receiveBlockHash'))
     )
 
-    q = db.session.query(AccountBlock).filter_by(hash=hashstr)
-    try:
-        existing_account_block = q.one()
-    except NoResultFound:
-        db.session.add(account_block)
-    else:
-        app.logger.info(f'account block {hashstr} already exists, updating')
-        db.session.merge(account_block)
-    finally:
-        try:
-            db.session.commit()
-        except SQLAlchemyError as err:
-            db.session.rollback()
-            # foreign key violation, probably a new token appears,
-            # AccountBlock has a Token relation and an AccountBlock relation
-            # ref: https://www.postgresql.org/docs/current/errcodes-appendix.html#ERRCODES-TABLE
-            if int(err.orig.pgcode) == 23503:
-                app.logger.info(f'find new Token {token_id}, downloading')
-                token_json = gvite_get_token_info(token_id)
-                db_save_token_info_dict(token_json)
-                try:
-                    db.session.query(AccountBlock).filter_by(
-                        hash=hashstr).one()
-                except NoResultFound:
-                    db.session.add(account_block)
-                else:
-                    app.logger.info(
-                        f'account block {hashstr} already exists, updating')
-                    db.session.merge(account_block)
-                finally:
-                    try:
-                        db.session.commit()
-                    except SQLAlchemyError as err:
-                        app.logger.error(
-                            f'fail to commit account block {hashstr}: SQLAlchemyError {err}')
-                        db.session.rollback()
-            else:
-                app.logger.error(
-                    f'fail to commit account block {hashstr}: SQLAlchemyError {err}')
 
-        except Exception as err:
-            app.logger.error(
-                f'fail to commit account block {src["hash"]}: General Error {err}')
-            db.session.rollback()
+def account_block_to_row(account_block):
+    '''
+    the columns set on an account block, the unset ones are not overwritten when saving
+    '''
+    return {key: account_block.__dict__[key] for key in ACCOUNT_BLOCK_COLUMNS
+            if key in account_block.__dict__}
 
-    sendBlockList = src.get('sendBlockList', [])
-    if sendBlockList is None:
-        sendBlockList = []
 
-    # save triggered send blocks before save the account block
-    for send_block in sendBlockList:
-        save_account_block_from_dict(send_block, default_timestamp, hashstr)
+def account_block_rows_from_dict(src, default_timestamp=0, triggered_by=None):
+    '''
+    account block rows of src, see save_account_block_from_dict(), followed by the
+    rows of the send blocks it triggered
+    '''
+    rows = [account_block_to_row(account_block_from_dict(
+        src, default_timestamp, triggered_by))]
+    for send_block in src.get('sendBlockList') or []:
+        rows += account_block_rows_from_dict(send_block,
+                                             default_timestamp, src['hash'])
+    return rows
 
 
-def db_get_account_block_by_token_id(token_id, order='desc', sort_field='timestamp', page_idx=0, page_size=10):
+def save_account_block_from_dict(src, default_timestamp=0, triggered_by=None):
+    '''
+    src is a dict parsed from JSON reply of getChunks or getAccountBlockByHash.
+    It can be either of the following 2 kinds:
+    1. complete account block
+    2. simple account block from getChunks, for example:
+        {
+            "blockType": 2,
+            "hash": "603e64f972960cd886a1dc77308b9a7d127cb462567b1ecd2ef68b4330a6d0c0",
+            "prevHash": "592a1e46ad746fd7d0b12b6e51ad62ffaea42574e494f8ffeab611f11021efc0",
+            "height": 4,
+            "accountAddress": "vite_483eed4ba0b5cd984d480ca048d5ee8ef5fa6b0ae23774c09b",
+            "publicKey": "oDxoxc75R4NnzWb4Vj3P9kmSercIquNzZlPlDnhRN2M=",
+            "toAddress": "vite_0000000000000000000000000000000000000003f6af7459b9",
+            "amount": 1000000000000000000000,
+            "tokenId": "tti_5649544520544f4b454e6e40",
+            "fromBlockHash": "0000000000000000000000000000000000000000000000000000000000000000",
+            "data": "jefc/QAAAAAAAAAAAAAA14lDHx2CBQbIP9U5oK6YY9aWE4IB",
+            "quota": 82000,
+            "quotaUsed": 82000,
+            "fee": 0,
+            "logHash": null,
+            "difficulty": null,
+            "nonce": null,
+            "sendBlockList": [],
+            "signature": "hWfLf7vXqIevTPdu6acc0PVVyNYxGtN9OU73F7Vn8+ZJ5vN6Lo76q1yalt5+OdqDRA4IzlQ8ruTNgvuwT0ooCw=="
+        }
+    '''
+    rows = account_block_rows_from_dict(src, default_timestamp, triggered_by)
+    for row in rows:
+        if row['timestamp'] == 0:
+            app.logger.warn(
+                f'save_account_block_from_dict() invalid timestamp: {row["timestamp"]}, block: {row["hash"]}')
+    # an account block saved again keeps its timestamp, see db_bulk_save_account_blocks()
+    db_bulk_save_account_blocks(rows)
+
+
+def db_get_account_block_by_token_id(token_id, order='desc', sort_field='timestamp', page_idx=0, page_size=10, rows=False, projection=None):
 
     offset = page_idx * page_size
 
     sort_criteria = get_sort_criteria_account_block(order, sort_field)
 
+    if rows:
+        account_blocks = select_account_block_records(
+            (AccountBlock.token_id == token_id, ), sort_criteria, offset, page_size, projection)
+        count = len(account_blocks)
+        if count >= page_size:
+            count = 10000
+        return account_blocks, count
+
     # count_sql = f'select count(hash) from public.account_block where account_block.token_id=\'{token_id}\' '
     # count = db.session.execute(count_sql).scalar()
 
-    account_blocks = db.session.query(AccountBlock).filter(
+    account_blocks = db.session.query(AccountBlock).options(*LOAD_ACCOUNT_BLOCK).filter(
         AccountBlock.token_id == token_id).order_by(sort_criteria).offset(offset).limit(page_size)
 
-    count = account_blocks.count()
+    count = account_blocks.with_entities(AccountBlock.hash).count()
     if count >= page_size:
         count = 10000  # assume count is 10k until we can accelerate count operation
 
     return account_blocks, count
 
 
-def db_get_account_blocks(order='desc', sort_field='timestamp', page_idx=0, page_size=10):
+def db_get_account_blocks(order='desc', sort_field='timestamp', page_idx=0, page_size=10, rows=False, projection=None):
 
     offset = page_idx * page_size
 
     sort_criteria = get_sort_criteria_account_block(order, sort_field)
 
-    account_blocks = db.session.query(AccountBlock).order_by(
+    if rows:
+        account_blocks = select_account_block_records(
+            (), sort_criteria, offset, page_size, projection)
+        count = len(account_blocks)
+        if count >= page_size:
+            count = 10000
+        return account_blocks, count
+
+    account_blocks = db.session.query(AccountBlock).options(*LOAD_ACCOUNT_BLOCK).order_by(
         sort_criteria).offset(offset).limit(page_size)
 
-    count = account_blocks.count()
+    count = account_blocks.with_entities(AccountBlock.hash).count()
     if count >= page_size:
         count = 10000  # assume count is 10k until we can accelerate count operation
 
     return account_blocks, count
 
 
-def db_get_account_blocks_by_account(address, order='desc', sort_field='timestamp', page_idx=0, page_size=10):
+def archived_account_block_records(archived_rows, projection=None):
+    '''
+    AccountBlockRecords of rows of the cold archive with their token, or the records of projection
+    '''
+    if projection is not None and not projection.with_token:
+        return [projection.record_class(*(row[column.name] for column in projection.columns))
+                for row in archived_rows]
+
+    record_class, columns = (AccountBlockRecord, ACCOUNT_BLOCK_RECORD_COLUMNS) if projection is None else (
+        projection.record_class, projection.columns)
+    token_ids = {row['token_id'] for row in archived_rows}
+    tokens = {row[0]: TokenRecord(*row) for row in db.session.execute(
+        select(*TOKEN_RECORD_COLUMNS).where(Token.token_id.in_(token_ids)))} if token_ids else {}
+    return [record_class(*(row[column.name] for column in columns), tokens.get(row['token_id']))
+            for row in archived_rows]
+
+
+def db_get_account_blocks_by_account_with_archive(address, order, sort_field, offset, page_size, rows, projection):
+    '''
+    page of the blocks of address in DB followed, in chain order, by the older ones of
+    the cold archive. None if the archive has no block of address
+    '''
+    archive = cold_archive.get()
+    archived_count = archive.count_account_blocks(address)
+    if archived_count == 0:
+        return None
+
+    sort_criteria = get_sort_criteria_account_block(order, sort_field)
+
+    def make_blocks(archived_rows):
+        if rows:
+            return archived_account_block_records(archived_rows, projection)
+        return archived_account_blocks(archived_rows)
+
+    def get_db_blocks(db_offset, limit):
+        if limit <= 0:
+            return []
+        if rows:
+            return select_account_block_records(
+                (AccountBlock.address == address, ), sort_criteria, db_offset, limit, projection)
+        return db.session.query(AccountBlock).options(*LOAD_ACCOUNT_BLOCK).filter(
+            AccountBlock.address == address).order_by(sort_criteria).offset(db_offset).limit(limit).all()
+
+    if order == 'desc':
+        account_blocks = get_db_blocks(offset, page_size)
+        if len(account_blocks) < page_size:
+            db_count = db.session.query(func.count(AccountBlock.hash)).filter(
+                AccountBlock.address == address).scalar()
+            account_blocks += make_blocks(archive.get_account_blocks(
+                address, True, max(0, offset - db_count), page_size - len(account_blocks)))
+    else:
+        account_blocks = make_blocks(archive.get_account_blocks(
+            address, False, offset, page_size))
+        account_blocks += get_db_blocks(max(0, offset - archived_count),
+                                        page_size - len(account_blocks))
+
+    count = len(account_blocks)
+    if count >= page_size:
+        count = 10000
+    return account_blocks, count
+
+
+def db_get_account_blocks_by_account(address, order='desc', sort_field='timestamp', page_idx=0, page_size=10, rows=False, projection=None):
 
     offset = page_idx * page_size
 
+    # the cold archive holds blocks older than the ones in DB, it pages in chain order only
+    if cold_archive_enabled() and sort_field in ('timestamp', 'height'):
+        result = db_get_account_blocks_by_account_with_archive(
+            address, order, sort_field, offset, page_size, rows, projection)
+        if result is not None:
+            return result
+
     sort_criteria = get_sort_criteria_account_block(order, sort_field)
 
-    account_blocks = db.session.query(AccountBlock).filter(
+    if rows:
+        account_blocks = select_account_block_records(
+            (AccountBlock.address == address, ), sort_criteria, offset, page_size, projection)
+        count = len(account_blocks)
+        if count >= page_size:
+            count = 10000
+        return account_blocks, count
+
+    account_blocks = db.session.query(AccountBlock).options(*LOAD_ACCOUNT_BLOCK).filter(
         AccountBlock.address == address).order_by(sort_criteria).offset(offset).limit(page_size)
 
-    count = account_blocks.count()
+    count = account_blocks.with_entities(AccountBlock.hash).count()
 
     if count >= page_size:
         count = 10000
@@ -498,6 +791,78 @@ def db_get_account_blocks_by_account(address, order='desc', sort_field='timestam
     return account_blocks, count
 
 
+EXPORT_BATCH_SIZE = 1000
+
+
+def db_stream_account_blocks(address=None, token_id=None, ts_from=None, ts_to=None):
+    '''
+    yield the account blocks of an address and/or a token with ts_from <= timestamp < ts_to,
+    in batches of EXPORT_BATCH_SIZE rows, ordered by timestamp and hash.
+    rows are read from a server-side cursor outside the session, so memory stays constant
+    '''
+    table = AccountBlock.__table__
+    stmt = select(table).order_by(table.c.timestamp, table.c.hash)
+    if address is not None:
+        stmt = stmt.where(table.c.address == address)
+    if token_id is not None:
+        stmt = stmt.where(table.c.token_id == token_id)
+    if ts_from is not None:
+        stmt = stmt.where(table.c.timestamp >= ts_from)
+    if ts_to is not None:
+        stmt = stmt.where(table.c.timestamp < ts_to)
+
+    return stream_rows(db.engine, stmt)
+
+
+def stream_rows(engine, stmt):
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(
+            stmt).yield_per(EXPORT_BATCH_SIZE)
+        for rows in result.partitions():
+            yield rows
+
+
+# the sync daemon saves a snapshot block every second
+SYNC_MAX_LAG = 60  # seconds
+
+
+def db_sync_is_live():
+    '''
+    whether the sync daemon is keeping up with the chain, judged by the latest snapshot block in DB
+    '''
+    latest_timestamp = db.session.query(
+        func.max(SnapshotBlock.timestamp)).scalar()
+    if latest_timestamp is None:
+        return False
+    max_lag = app.config.get('SYNC_MAX_LAG', SYNC_MAX_LAG)
+    return time.time() - latest_timestamp <= max_lag
+
+
+def db_account_history_complete(address, page_idx=0, page_size=10):
+    '''
+    whether DB holds every block of a page of the account history, newest first.
+    the block count of the account is its ingestion watermark, the sync daemon
+    refreshes it after saving the blocks of the account, so it is trusted while
+    the sync daemon is live
+    '''
+    account = db.session.get(Account, address)
+    if account is None or account.block_count is None:
+        return False
+    if not db_sync_is_live():
+        return False
+
+    # heights of the page
+    height_end = account.block_count - page_idx * page_size
+    height_start = max(height_end - page_size + 1, 1)
+    if height_end < height_start:
+        return True
+
+    block_count = db.session.query(func.count(AccountBlock.hash)).filter(
+        AccountBlock.address == address,
+        AccountBlock.height.between(height_start, height_end)).scalar()
+    return block_count == height_end - height_start + 1
+
+
 def gvite_get_account_blocks_by_account(address, order='desc', sort_field='timestamp', page_idx=0, page_size=10):
     headers = {'content-type': 'application/json'}
     request_body = {
@@ -506,8 +871,7 @@ def gvite_get_account_blocks_by_account(address, order='desc', sort_field='times
         "method": "ledger_getAccountBlocksByAddress",
         "params": [address, page_idx, page_size]
     }
-    response_account_blocks = requests.post(
-        app.config['URL_RPC'],  json=request_body, headers=headers)
+    response_account_blocks = rpc_post(request_body, headers)
     if not response_account_blocks.ok:
         app.logger.error(
             f'RPC call failed: ledger_getAccountBlockByHash, code: {response_account_blocks.status_code}, msg: {response_account_blocks.text}')
@@ -539,8 +903,7 @@ def gvite_get_unreceived_account_blocks_by_account(address, order='desc', sort_f
         "method": "ledger_getUnreceivedBlocksByAddress",
         "params": [address, page_idx, page_size]
     }
-    response_account_blocks = requests.post(
-        app.config['URL_RPC'],  json=request_body, headers=headers)
+    response_account_blocks = rpc_post(request_body, headers)
     if not response_account_blocks.ok:
         app.logger.error(
             f'RPC call failed: ledger_getUnreceivedBlocksByAddress, code: {response_account_blocks.status_code}, msg: {response_account_blocks.text}')
@@ -577,8 +940,7 @@ def gvite_get_account(address):
         "params": [address, ]
     }
 
-    response_account = requests.post(
-        app.config['URL_RPC'],  json=request_body, headers=headers)
+    response_account = rpc_post(request_body, headers)
 
     if not response_account.ok:
         app.logger.error(
@@ -593,7 +955,91 @@ def db_get_account(address):
     '''
     address: account address
     '''
-    return db.session.get(Account, address)
+    return db.session.get(Account, address, options=LOAD_ACCOUNT)
+
+
+def db_claim_account_refresh(address, seen_last_modified, claimed_last_modified):
+    '''
+    compare-and-set last_modified of an account from the value seen to the claimed one,
+    return True if this call changed it, so that only one worker refreshes the account
+    '''
+    table = Account.__table__
+    try:
+        result = db.session.execute(update(table).where(
+            table.c.address == address, table.c.last_modified == seen_last_modified).values(
+            last_modified=claimed_last_modified))
+        db.session.commit()
+    except SQLAlchemyError as err:
+        db.session.rollback()
+        app.logger.error(
+            f'fail to claim refresh of account {address}: SQLAlchemyError {err}')
+        return False
+    return result.rowcount == 1
+
+
+def refresh_account(address):
+    '''
+    download the account and its quota from gvite and save them
+    return the saved account, None if gvite does not find it
+    '''
+    account = gvite_get_account(address)
+    if not account:
+        app.logger.error(f'account {address} not found')
+        return None
+    quota = gvite_get_account_quota(address)
+    if quota:
+        account.update(quota)
+    else:
+        app.logger.error(f'account quota {address} not found')
+
+    save_account_from_dict(account)
+
+    # last_modified is only updated with changed columns, mark the account as refreshed
+    table = Account.__table__
+    try:
+        db.session.execute(update(table).where(
+            table.c.address == address).values(last_modified=datetime.now()))
+        db.session.commit()
+    except SQLAlchemyError as err:
+        db.session.rollback()
+        app.logger.error(
+            f'fail to commit refresh time of account {address}: SQLAlchemyError {err}')
+
+    return db_get_account(address)
+
+
+def db_get_accounts_by_addresses(addresses):
+    '''
+    return {address: account} of the addresses found in DB, with one query
+    for the accounts and one for their balances
+    '''
+    accounts = db.session.query(Account).options(*LOAD_ACCOUNT).filter(
+        Account.address.in_(addresses)).all()
+    return {account.address: account for account in accounts}
+
+
+def gvite_get_accounts_by_addresses(addresses):
+    '''
+    return {address: account dict with quota} of the addresses found by gvite,
+    account info and quota of all addresses are requested in one batch RPC
+    '''
+    calls = []
+    for address in addresses:
+        calls.append(('ledger_getAccountInfoByAddress', [address]))
+        calls.append(('contract_getQuotaByAccount', [address]))
+    results = gvite_batch_call(calls)
+
+    accounts = {}
+    for idx, address in enumerate(addresses):
+        account, quota = results[2 * idx], results[2 * idx + 1]
+        if not account:
+            continue
+        if quota:
+            account.update(quota)
+        else:
+            app.logger.error(f'account quota {address} not found')
+        accounts[address] = account
+    return accounts
 
 
 def save_account_from_dict(src):
@@ -715,41 +1161,91 @@ def save_account_from_dict(src):
                 db.session.rollback()
                 return
 
+    update_token_holder_ranks(address, balance_dict.keys())
+
     return account
 
 
-def db_get_accounts(order='desc', sort_field='viteBalance', page_idx=0, page_size=10):
+def db_get_accounts(order='desc', sort_field='viteBalance', page_idx=0, page_size=10, rows=False):
     offset = page_idx * page_size
 
     sort_criteria = get_sort_criteria_account(order, sort_field)
 
+    if rows:
+        criteria = (Account.last_transaction_date.isnot(None), ) if sort_field == 'lastTransactionDate' else ()
+        accounts = select_account_records(
+            criteria, sort_criteria, offset, page_size)
+        count = len(accounts)
+        if count >= page_size:
+            count = 10000
+        return accounts, count
+
     if sort_field == 'lastTransactionDate':
-        accounts = db.session.query(Account).filter(Account.last_transaction_date.isnot(None)).order_by(sort_criteria).offset(
+        accounts = db.session.query(Account).options(*LOAD_ACCOUNT).filter(Account.last_transaction_date.isnot(None)).order_by(sort_criteria).offset(
             offset).limit(page_size)
     else:
-        accounts = db.session.query(Account).order_by(
+        accounts = db.session.query(Account).options(*LOAD_ACCOUNT).order_by(
             sort_criteria).offset(offset).limit(page_size)
 
-    count = accounts.count()
+    count = accounts.with_entities(Account.address).count()
     if count >= page_size:
         count = 10000  # assume count is 10k until we can accelerate count operation
 
     return accounts, count
 
 
-def db_search_accounts(keyword='', order='asc', sort_field='address', page_idx=0, page_size=10):
+ADDRESS_PREFIX = 'vite_'
+ADDRESS_HEX_DIGITS = set('0123456789abcdef')
+# count of matching accounts is not computed beyond this cap
+SEARCH_ACCOUNTS_COUNT_CAP = 10000
+
+
+def normalize_address_prefix(keyword):
+    '''
+    return the lowercase address prefix searched by keyword, with "vite_" prepended to
+    bare hex digits, or None when no address can start with keyword
+    '''
+    keyword = keyword.strip().lower()
+    if not keyword.startswith(ADDRESS_PREFIX):
+        keyword = ADDRESS_PREFIX + keyword
+    if not set(keyword[len(ADDRESS_PREFIX):]) <= ADDRESS_HEX_DIGITS:
+        return None
+    return keyword
+
+
+def db_search_accounts(keyword='', order='asc', sort_field='address', page_idx=0, page_size=10, rows=False):
     # skip common prefix "vite_" or empty keyword
     if (len(keyword) == 0) or (keyword in 'vite_'):
-        return db_get_accounts(order, sort_field, page_idx, page_size)
+        return db_get_accounts(order, sort_field, page_idx, page_size, rows)
+
+    address_prefix = normalize_address_prefix(keyword)
+    if address_prefix is None:
+        return [], 0
 
     offset = page_idx * page_size
 
-    sort_criteria = get_sort_criteria_account(order, sort_field)
+    # prefix matching on the C collation is served by ix_account_address_prefix,
+    # see cli create-index-account-address-prefix. "_" in "vite_" is escaped as it is a LIKE wildcard
+    address_c = Account.address.collate('C')
+    matching = address_c.like(address_prefix.replace(
+        '_', '\\_') + '%', escape='\\')
 
-    accounts = db.session.query(Account).filter(Account.address.ilike(f'{keyword}%')).order_by(
-        sort_criteria).offset(offset).limit(page_size)
+    if sort_field == 'address':
+        sort_criteria = address_c.desc() if order == 'desc' else address_c.asc()
+    else:
+        sort_criteria = get_sort_criteria_account(order, sort_field)
 
-    count = accounts.count()
+    if rows:
+        accounts = select_account_records(
+            (matching, ), sort_criteria, offset, page_size)
+    else:
+        accounts = db.session.query(Account).options(*LOAD_ACCOUNT).filter(matching).order_by(
+            sort_criteria).offset(offset).limit(page_size)
+
+    capped_matches = db.session.query(Account.address).filter(
+        matching).limit(SEARCH_ACCOUNTS_COUNT_CAP).subquery()
+    count = db.session.query(func.count()).select_from(
+        capped_matches).scalar()
 
     return accounts, count
 
@@ -757,9 +1253,14 @@ def db_search_accounts(keyword='', order='asc', sort_field='address', page_idx=0
 def da_get_token_balances_desc(token_id, page_idx=0, page_size=10):
     offset = page_idx * page_size
 
-    balances = db.session.query(Balance).filter(
+    # ranked tokens are paged by rank, see holder_rank.py
+    holder_count = db_get_holder_count(token_id)
+    if holder_count is not None:
+        return select_ranked_balance_records(token_id, offset, page_size), holder_count
+
+    balances = db.session.query(Balance).options(*LOAD_BALANCE).filter(
         Balance.token_id == token_id).order_by(Balance.balance.desc()).offset(offset).limit(page_size)
-    count = db.session.query(Balance).filter(
-        Balance.token_id == token_id).count()
+    count = db.session.query(func.count(Balance.account_address)).filter(
+        Balance.token_id == token_id).scalar()
 
     return balances, count
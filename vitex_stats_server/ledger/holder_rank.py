@@ -0,0 +1,222 @@
+'''
+Rich lists of tokens maintained in the token_holder_rank table.
+
+A token is ranked once recompute_token_holder_ranks() has numbered its holders,
+from then on every balance saved moves its holder within the ranking, see
+update_token_holder_ranks(). Rich list pages and rank lookups read the ranks
+through an index instead of sorting and counting the balance table. Writers of
+a token are serialized by an advisory lock, the full recompute run on a
+schedule repairs any drift.
+'''
+from datetime import datetime
+
+from flask import current_app as app
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.expression import select
+from sqlalchemy.sql.functions import func
+
+from ..models import Account, Balance, Token, TokenHolderCount, TokenHolderRank, TopHolder, db
+
+HOLDER_RANK_LOCK_PREFIX = 'token_holder_rank:'
+TOP_HOLDER_LOCK_KEY = 'top_holder'
+TOP_HOLDERS_SNAPSHOT_SIZE = 1000
+
+
+def lock(key):
+    '''
+    advisory lock released at the end of the transaction
+    '''
+    db.session.execute(select(func.pg_advisory_xact_lock(func.hashtext(key))))
+
+
+def is_holder(balance):
+    return balance is not None and balance > 0
+
+
+def shift_ranks(token_id, rank_from, rank_to, delta):
+    '''
+    add delta to the ranks rank_from <= rank < rank_to, no upper bound if rank_to is None
+    '''
+    criteria = [TokenHolderRank.token_id == token_id,
+                TokenHolderRank.rank >= rank_from]
+    if rank_to is not None:
+        criteria.append(TokenHolderRank.rank < rank_to)
+    db.session.query(TokenHolderRank).filter(*criteria).update(
+        {TokenHolderRank.rank: TokenHolderRank.rank + delta}, synchronize_session=False)
+
+
+def get_next_rank(token_id, address, balance):
+    '''
+    rank of the first holder other than address ranked after (balance, address),
+    None if there is none. both lookups are served by ix_token_holder_rank_token_id_balance
+    '''
+    rank = db.session.query(TokenHolderRank.rank).filter(
+        TokenHolderRank.token_id == token_id, TokenHolderRank.balance == balance,
+        TokenHolderRank.account_address > address).order_by(
+        TokenHolderRank.account_address).limit(1).scalar()
+    if rank is not None:
+        return rank
+    return db.session.query(TokenHolderRank.rank).filter(
+        TokenHolderRank.token_id == token_id, TokenHolderRank.balance < balance,
+        TokenHolderRank.account_address != address).order_by(
+        TokenHolderRank.balance.desc(), TokenHolderRank.account_address).limit(1).scalar()
+
+
+def move_holder(holder_count, address, balance, current):
+    '''
+    move address to its rank for balance, current is its TokenHolderRank or None.
+    only the holders between the old and the new rank are shifted
+    '''
+    token_id = holder_count.token_id
+    if current is not None and current.balance == balance:
+        return
+    if current is None and not is_holder(balance):
+        return
+
+    if not is_holder(balance):
+        shift_ranks(token_id, current.rank + 1, None, -1)
+        db.session.delete(current)
+        holder_count.holder_count -= 1
+        return
+
+    next_rank = get_next_rank(token_id, address, balance)
+    if current is None:
+        if next_rank is None:
+            rank = holder_count.holder_count + 1
+        else:
+            rank = next_rank
+            shift_ranks(token_id, next_rank, None, 1)
+        db.session.add(TokenHolderRank(
+            token_id=token_id, account_address=address, balance=balance, rank=rank))
+        holder_count.holder_count += 1
+        return
+
+    if next_rank is None:
+        next_rank = holder_count.holder_count + 1
+    if next_rank > current.rank:
+        shift_ranks(token_id, current.rank + 1, next_rank, -1)
+        current.rank = next_rank - 1
+    else:
+        shift_ranks(token_id, next_rank, current.rank, 1)
+        current.rank = next_rank
+    current.balance = balance
+
+
+def update_token_holder_ranks(address, token_ids):
+    '''
+    move address within the rich lists of token_ids after its balances were saved.
+    tokens not ranked yet are left to recompute_token_holder_ranks()
+    '''
+    token_ids = db.session.query(TokenHolderCount.token_id).filter(
+        TokenHolderCount.token_id.in_(set(token_ids))).order_by(TokenHolderCount.token_id).all()
+    token_ids = [token_id for token_id, in token_ids]
+    if len(token_ids) == 0:
+        db.session.rollback()
+        return
+
+    try:
+        # locks taken in token order, so that two accounts cannot deadlock
+        for token_id in token_ids:
+            lock(HOLDER_RANK_LOCK_PREFIX + token_id)
+
+        holder_counts = {holder_count.token_id: holder_count for holder_count in db.session.query(
+            TokenHolderCount).filter(TokenHolderCount.token_id.in_(token_ids)).populate_existing()}
+        balances = dict(db.session.query(Balance.token_id, Balance.balance).filter(
+            Balance.account_address == address, Balance.token_id.in_(token_ids)))
+        ranks = {rank.token_id: rank for rank in db.session.query(TokenHolderRank).filter(
+            TokenHolderRank.account_address == address,
+            TokenHolderRank.token_id.in_(token_ids)).populate_existing()}
+
+        for token_id in token_ids:
+            move_holder(holder_counts[token_id], address,
+                        balances.get(token_id), ranks.get(token_id))
+        db.session.commit()
+    except SQLAlchemyError as err:
+        app.logger.error(
+            f'fail to update holder ranks of {address}: SQLAlchemyError {err}')
+        db.session.rollback()
+
+
+def recompute_token_holder_ranks(token_id):
+    '''
+    number again all the holders of a token, return the holder count
+    '''
+    try:
+        lock(HOLDER_RANK_LOCK_PREFIX + token_id)
+        db.session.query(TokenHolderRank).filter(
+            TokenHolderRank.token_id == token_id).delete(synchronize_session=False)
+        ranking = select(
+            Balance.token_id, Balance.account_address, Balance.balance,
+            func.row_number().over(order_by=(Balance.balance.desc(), Balance.account_address))).where(
+            Balance.token_id == token_id, Balance.balance > 0)
+        holder_count = db.session.execute(insert(TokenHolderRank).from_select(
+            ['token_id', 'account_address', 'balance', 'rank'], ranking)).rowcount
+        stmt = insert(TokenHolderCount).values(
+            token_id=token_id, holder_count=holder_count, recomputed_at=datetime.now())
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[TokenHolderCount.token_id],
+            set_={'holder_count': stmt.excluded.holder_count, 'recomputed_at': stmt.excluded.recomputed_at}))
+        db.session.commit()
+    except SQLAlchemyError as err:
+        app.logger.error(
+            f'fail to recompute holder ranks of token {token_id}: SQLAlchemyError {err}')
+        db.session.rollback()
+        return None
+    return holder_count
+
+
+def snapshot_top_holders(size=TOP_HOLDERS_SNAPSHOT_SIZE):
+    '''
+    replace the top holders snapshot by the size accounts with the largest VITE balances
+    '''
+    try:
+        lock(TOP_HOLDER_LOCK_KEY)
+        db.session.query(TopHolder).delete(synchronize_session=False)
+        ranking = select(
+            func.row_number().over(order_by=(Account.vite_balance.desc(), Account.address)),
+            Account.address, Account.vite_balance, func.now()).where(
+            Account.vite_balance > 0).order_by(Account.vite_balance.desc(), Account.address).limit(size)
+        count = db.session.execute(insert(TopHolder).from_select(
+            ['rank', 'address', 'vite_balance', 'snapshot_time'], ranking)).rowcount
+        db.session.commit()
+    except SQLAlchemyError as err:
+        app.logger.error(
+            f'fail to snapshot top holders: SQLAlchemyError {err}')
+        db.session.rollback()
+        return None
+    return count
+
+
+def recompute_all_token_holder_ranks(top_holders_size=TOP_HOLDERS_SNAPSHOT_SIZE):
+    '''
+    recompute the rich lists of all tokens and the top holders snapshot,
+    return the number of tokens ranked
+    '''
+    token_ids = [token_id for token_id, in db.session.query(
+        Token.token_id).order_by(Token.token_id)]
+    ranked = 0
+    for token_id in token_ids:
+        holder_count = recompute_token_holder_ranks(token_id)
+        if holder_count is not None:
+            ranked += 1
+            app.logger.info(
+                f'ranked {holder_count} holders of token {token_id}')
+    snapshot_top_holders(top_holders_size)
+    return ranked
+
+
+def db_get_holder_count(token_id):
+    '''
+    holder count of a token, None if it is not ranked yet
+    '''
+    return db.session.query(TokenHolderCount.holder_count).filter(
+        TokenHolderCount.token_id == token_id).scalar()
+
+
+def db_get_holder_rank(token_id, address):
+    return db.session.get(TokenHolderRank, (token_id, address))
+
+
+def db_get_top_holders(top_n):
+    return db.session.query(TopHolder).order_by(TopHolder.rank).limit(top_n).all()
@@ -1,8 +1,17 @@
-from datetime import datetime, timedelta
-from vitex_stats_server.contract.data_accessor import gvite_get_account_quota
-from flask import request, jsonify, Blueprint
+import csv
+import io
+import json
+from vitex_stats_server.contract.data_accessor import get_token_info_dict
+from flask import request, jsonify, Blueprint, Response, stream_with_context
 from flask import current_app as app
-from .data_accessor import da_get_token_balances_desc, db_get_account, db_get_account_blocks_by_account, db_get_accounts, db_get_latest_snapshot_blocks, db_get_snapshot_blocks, db_get_snapshot_blocks_by_address, db_save_account_block, db_search_accounts, gvite_get_account, gvite_get_account_block_by_hash, db_get_account_block_by_hash, account_block_complete, gvite_get_account_blocks_by_account, gvite_get_unreceived_account_blocks_by_account, save_account_block_from_dict, save_account_from_dict,  schema_account_block, schema_account_block_complete, schema_account, db_get_account_block_by_token_id, db_get_account_blocks, schema_snapshot_block, schema_balance
+from .data_accessor import da_get_token_balances_desc, db_get_account, db_get_account_blocks_by_account, db_get_accounts, db_get_latest_snapshot_blocks, db_get_snapshot_blocks, db_get_snapshot_blocks_by_address, db_search_accounts, gvite_get_account_block_by_hash, db_get_account_block_by_hash, account_block_complete, gvite_get_account_blocks_by_account, gvite_get_unreceived_account_blocks_by_account, save_account_block_from_dict, save_account_from_dict, db_get_account_block_by_token_id, db_get_account_blocks, db_stream_account_blocks, refresh_account
+from .data_accessor import db_account_history_complete, db_get_account_blocks_by_hashes, db_get_accounts_by_addresses, gvite_get_account_blocks_by_hashes, gvite_get_accounts_by_addresses
+from .holder_rank import db_get_holder_count, db_get_holder_rank
+from .account_refresh import account_is_stale, account_need_update, account_refresher
+from .write_behind import account_block_writer
+from ..batch import get_batch_ids
+from ..projection import get_account_block_projection
+from ..serializers import serializer_account, serializer_account_block, serializer_account_block_complete, serializer_account_block_row, serializer_balance, serializer_snapshot_block, serializer_token_holder_rank
 
 bp_ledger = Blueprint('ledger', __name__, url_prefix='/ledger')
 
@@ -23,7 +32,7 @@ def get_account_block_by_hash(hash_str):
 
     if account_block and account_block_complete(account_block):
         app.logger.info(f'DB hit account block {hash_str}')
-        return jsonify({'err': 'ok', 'result': schema_account_block.dump(account_block)})
+        return jsonify({'err': 'ok', 'result': serializer_account_block.dump(account_block)})
 
     account_block = gvite_get_account_block_by_hash(
         hash_str, deserialize=False)
@@ -39,7 +48,44 @@ def get_account_block_by_hash(hash_str):
 
     account_block = db_get_account_block_by_hash(hash_str)
 
-    return jsonify({'err': 'ok', 'result': schema_account_block.dump(account_block)})
+    return jsonify({'err': 'ok', 'result': serializer_account_block.dump(account_block)})
+
+
+@bp_ledger.route('/get_account_blocks_by_hashes', methods=('POST', ))
+def get_account_blocks_by_hashes():
+    '''
+    body: {"hashes": [hash, ...]}
+    return the account blocks keyed by hash, null for the hashes not found
+    '''
+    hashes, error = get_batch_ids('hashes')
+    if error:
+        return error
+
+    # fixed length hashes, the others are not found
+    valid_hashes = [hash_str for hash_str in hashes if len(hash_str) == 64]
+    account_blocks = db_get_account_blocks_by_hashes(valid_hashes)
+
+    missing_hashes = [hash_str for hash_str in valid_hashes
+                      if not account_block_complete(account_blocks.get(hash_str))]
+    if missing_hashes:
+        fetched_account_blocks = gvite_get_account_blocks_by_hashes(
+            missing_hashes)
+        for account_block in fetched_account_blocks.values():
+            save_account_block_from_dict(account_block)
+        app.logger.info(
+            f'completed {len(fetched_account_blocks)} of {len(missing_hashes)} missing account blocks to DB')
+        if fetched_account_blocks:
+            account_blocks = db_get_account_blocks_by_hashes(valid_hashes)
+
+    result = {}
+    for hash_str in hashes:
+        account_block = account_blocks.get(hash_str)
+        if account_block_complete(account_block):
+            result[hash_str] = serializer_account_block.dump(account_block)
+        else:
+            result[hash_str] = None
+
+    return jsonify({'err': 'ok', 'result': result})
 
 
 @bp_ledger.route('/get_complete_account_block_by_hash/<hash_str>', methods=('GET', 'POST'))
@@ -58,7 +104,7 @@ def get_complete_account_block_by_hash(hash_str):
 
     if account_block and account_block_complete(account_block):
         app.logger.info(f'DB hit account block {hash_str}')
-        return jsonify({'err': 'ok', 'result': schema_account_block_complete.dump(account_block)})
+        return jsonify({'err': 'ok', 'result': serializer_account_block_complete.dump(account_block)})
 
     account_block = gvite_get_account_block_by_hash(
         hash_str, deserialize=False)
@@ -74,20 +120,24 @@ def get_complete_account_block_by_hash(hash_str):
 
     account_block = db_get_account_block_by_hash(hash_str)
 
-    return jsonify({'err': 'ok', 'result': schema_account_block_complete.dump(account_block)})
+    return jsonify({'err': 'ok', 'result': serializer_account_block_complete.dump(account_block)})
 
 
 @bp_ledger.route('/get_account_block_by_token/<token_id>/<int:page_idx>/<int:page_size>', methods=('GET', 'POST'))
 def get_account_block_by_token(token_id, page_idx, page_size):
+    projection, error = get_account_block_projection()
+    if error:
+        return error
+
     account_blocks, count = db_get_account_block_by_token_id(
-        token_id, 'desc', 'timestamp', page_idx, page_size)
+        token_id, 'desc', 'timestamp', page_idx, page_size, rows=True, projection=projection)
 
     result = {
         'err': 'ok',
         'count': count,
         'pageIdx': page_idx,
         'pageSize': page_size,
-        'accountBlocks': schema_account_block.dump(account_blocks, many=True)
+        'accountBlocks': projection.serializer.dump(account_blocks, many=True)
     }
 
     return jsonify(result)
@@ -95,14 +145,18 @@ def get_account_block_by_token(token_id, page_idx, page_size):
 
 @bp_ledger.route('/get_account_block_by_token/<token_id>/<order>/<sort_field>/<int:page_idx>/<int:page_size>', methods=('GET', 'POST'))
 def get_account_block_by_token_order(token_id, order, sort_field, page_idx, page_size):
+    projection, error = get_account_block_projection()
+    if error:
+        return error
+
     account_blocks, count = db_get_account_block_by_token_id(
-        token_id, order, sort_field, page_idx, page_size)
+        token_id, order, sort_field, page_idx, page_size, rows=True, projection=projection)
     result = {
         'err': 'ok',
         'count': count,
         'pageIdx': page_idx,
         'pageSize': page_size,
-        'accountBlocks': schema_account_block.dump(account_blocks, many=True)
+        'accountBlocks': projection.serializer.dump(account_blocks, many=True)
     }
 
     return jsonify(result)
@@ -113,27 +167,49 @@ def get_account_blocks(order, sort_field, page_idx, page_size):
     if request.method == 'POST':
         pass
 
+    projection, error = get_account_block_projection()
+    if error:
+        return error
+
     account_blocks, count = db_get_account_blocks(
-        order, sort_field, page_idx, page_size)
+        order, sort_field, page_idx, page_size, rows=True, projection=projection)
 
     result = {
         'err': 'ok',
         'count': count,
         'pageIdx': page_idx,
         'pageSize': page_size,
-        'accountBlocks': schema_account_block.dump(account_blocks, many=True)
+        'accountBlocks': projection.serializer.dump(account_blocks, many=True)
     }
 
     return jsonify(result)
 
 
+def attach_token_infos(serialized_account_blocks, account_blocks):
+    '''
+    fill the token of serialized account blocks not loaded from DB, from the token id
+    of the account blocks they were dumped from: tokenId may not be among the fields
+    '''
+    for serialized_account_block, account_block in zip(serialized_account_blocks, account_blocks):
+        if serialized_account_block.get('token') is not None or not account_block.token_id:
+            continue
+        token_info = get_token_info_dict(account_block.token_id)
+        if token_info is not None:
+            serialized_account_block['token'] = {key: value for key, value in token_info.items()
+                                                 if key != 'tokenId'}
+
+
 @bp_ledger.route('/get_account_blocks_by_account/<address>/<order>/<sort_field>/<int:page_idx>/<int:page_size>', methods=('GET', 'POST'))
 def get_account_blocks_by_account(address, order, sort_field, page_idx, page_size):
     if request.method == 'POST':
         pass
 
-    # assume gvite backend is more up to date than db
-    if order == 'desc' and sort_field == 'timestamp':
+    projection, error = get_account_block_projection()
+    if error:
+        return error
+
+    # the latest blocks come from gvite unless DB has caught up with the account
+    if order == 'desc' and sort_field == 'timestamp' and not db_account_history_complete(address, page_idx, page_size):
         account_blocks, count = gvite_get_account_blocks_by_account(
             address, order, sort_field, page_idx, page_size)
 
@@ -141,24 +217,28 @@ def get_account_blocks_by_account(address, order, sort_field, page_idx, page_siz
             app.logger.info(
                 f'cannot fetch from gvite the account blocks of account {address}')
             account_blocks, count = db_get_account_blocks_by_account(
-                address, order, sort_field, page_idx, page_size)
+                address, order, sort_field, page_idx, page_size, rows=True, projection=projection)
+            result_account_blocks = projection.serializer.dump(
+                account_blocks, many=True)
         else:
-            saved_account_blocks = []
-            for account_block in account_blocks:
-                saved_account_block = db_save_account_block(account_block)
-                saved_account_blocks.append(saved_account_block)
-
-            account_blocks = saved_account_blocks
+            # the blocks are saved in the background, their tokens come from the token catalog
+            account_block_writer.submit(account_blocks)
+            result_account_blocks = projection.serializer.dump(
+                account_blocks, many=True)
+            if projection.with_token:
+                attach_token_infos(result_account_blocks, account_blocks)
     else:
         account_blocks, count = db_get_account_blocks_by_account(
-            address, order, sort_field, page_idx, page_size)
+            address, order, sort_field, page_idx, page_size, rows=True, projection=projection)
+        result_account_blocks = projection.serializer.dump(
+            account_blocks, many=True)
 
     result = {
         'err': 'ok',
         'count': count,
         'pageIdx': page_idx,
         'pageSize': page_size,
-        'accountBlocks': schema_account_block.dump(account_blocks, many=True)
+        'accountBlocks': result_account_blocks
     }
 
     return jsonify(result)
@@ -177,41 +257,69 @@ def get_unreceived_account_blocks_by_account(address, order, sort_field, page_id
         'count': count,
         'pageIdx': page_idx,
         'pageSize': page_size,
-        'accountBlocks': schema_account_block.dump(account_blocks, many=True)
+        'accountBlocks': serializer_account_block.dump(account_blocks, many=True)
     }
 
     return jsonify(result)
 
 
-def account_need_update(account):
-    if account is None:
-        return True
-    return datetime.now() - account.last_modified > timedelta(minutes=5)
-
-
 @bp_ledger.route('/get_account/<address>',  methods=('GET', 'POST'))
 def get_account(address):
     account = db_get_account(address)
     if account_need_update(account):
-        account = gvite_get_account(address)
+        account = refresh_account(address)
         if account is None:
-            app.logger.error(f'account {address} not found')
             return jsonify({
                 'err': f'cannot find account {address}',
                 'result': {}})
-        quota = gvite_get_account_quota(address)
-        if quota:
-            account.update(quota)
-        else:
-            app.logger.error(f'account quota {address} not found')
-
-        save_account_from_dict(account)
-        account = db_get_account(address)
 
-    return jsonify({
+    result = {
         'err': 'ok',
-        'result': schema_account.dump(account)
-    })
+        'result': serializer_account.dump(account)
+    }
+
+    # serve the stale copy, refresh it for the next requests
+    if account_is_stale(account):
+        account_refresher.schedule(account)
+
+    return jsonify(result)
+
+
+@bp_ledger.route('/get_accounts_by_addresses', methods=('POST', ))
+def get_accounts_by_addresses():
+    '''
+    body: {"addresses": [address, ...]}
+    return the accounts keyed by address, null for the addresses not found
+    '''
+    addresses, error = get_batch_ids('addresses')
+    if error:
+        return error
+
+    accounts = db_get_accounts_by_addresses(addresses)
+    stale_accounts = [account for account in accounts.values()
+                      if not account_need_update(account) and account_is_stale(account)]
+
+    outdated_addresses = [address for address in addresses
+                          if account_need_update(accounts.get(address))]
+    if outdated_addresses:
+        fetched_accounts = gvite_get_accounts_by_addresses(outdated_addresses)
+        for account in fetched_accounts.values():
+            save_account_from_dict(account)
+        for address in outdated_addresses:
+            if address not in fetched_accounts:
+                app.logger.error(f'account {address} not found')
+                accounts.pop(address, None)
+        if fetched_accounts:
+            accounts.update(db_get_accounts_by_addresses(
+                list(fetched_accounts)))
+
+    result = {address: serializer_account.dump(accounts[address]) if address in accounts else None
+              for address in addresses}
+
+    for account in stale_accounts:
+        account_refresher.schedule(account)
+
+    return jsonify({'err': 'ok', 'result': result})
 
 
 @bp_ledger.route('/get_accounts/<order>/<sort_field>/<int:page_idx>/<int:page_size>',  methods=('GET', 'POST'))
@@ -219,14 +327,15 @@ def get_accounts(order, sort_field, page_idx, page_size):
     if request.method == 'POST':
         pass
 
-    accounts, count = db_get_accounts(order, sort_field, page_idx, page_size)
+    accounts, count = db_get_accounts(
+        order, sort_field, page_idx, page_size, rows=True)
 
     result = {
         'err': 'ok',
         'count': count,
         'pageIdx': page_idx,
         'pageSize': page_size,
-        'accounts': schema_account.dump(accounts, many=True)
+        'accounts': serializer_account.dump(accounts, many=True)
     }
 
     return jsonify(result)
@@ -239,14 +348,14 @@ def search_accounts(address, order, sort_field, page_idx, page_size):
         pass
 
     accounts, count = db_search_accounts(
-        address, order, sort_field, page_idx, page_size)
+        address, order, sort_field, page_idx, page_size, rows=True)
 
     result = {
         'err': 'ok',
         'count': count,
         'pageIdx': page_idx,
         'pageSize': page_size,
-        'accounts': schema_account.dump(accounts, many=True)
+        'accounts': serializer_account.dump(accounts, many=True)
     }
 
     return jsonify(result)
@@ -265,7 +374,7 @@ def get_snapshot_blocks_by_address(address, order, sort_field, page_idx, page_si
         'count': count,
         'pageIdx': page_idx,
         'pageSize': page_size,
-        'snapshotBlocks': schema_snapshot_block.dump(snapshot_blocks, many=True)
+        'snapshotBlocks': serializer_snapshot_block.dump(snapshot_blocks, many=True)
     }
 
     return jsonify(result)
@@ -284,7 +393,7 @@ def get_snapshots(order, sort_field, page_idx, page_size):
         'count': count,
         'pageIdx': page_idx,
         'pageSize': page_size,
-        'snapshotBlocks': schema_snapshot_block.dump(snapshot_blocks, many=True)
+        'snapshotBlocks': serializer_snapshot_block.dump(snapshot_blocks, many=True)
     }
 
     return jsonify(result)
@@ -302,7 +411,7 @@ def get_latest_snapshots(page_size):
         'count': page_size,
         'pageIdx': 0,
         'pageSize': page_size,
-        'snapshotBlocks': schema_snapshot_block.dump(snapshot_blocks, many=True)
+        'snapshotBlocks': serializer_snapshot_block.dump(snapshot_blocks, many=True)
     }
 
     return jsonify(result)
@@ -320,7 +429,83 @@ def get_token_balanced_desc(token_id, page_idx, page_size):
         'count': count,
         'pageIdx': page_idx,
         'pageSize': page_size,
-        'balances': schema_balance.dump(balances, many=True)
+        'balances': serializer_balance.dump(balances, many=True)
+    }
+
+    return jsonify(result)
+
+
+@bp_ledger.route('/get_token_holder_rank/<token_id>/<address>', methods=('GET', 'POST'))
+def get_token_holder_rank(token_id, address):
+    if request.method == 'POST':
+        pass
+
+    holder_count = db_get_holder_count(token_id)
+    if holder_count is None:
+        return jsonify({
+            'err': f'token {token_id} is not ranked yet',
+            'result': {}})
+
+    holder_rank = db_get_holder_rank(token_id, address)
+    result = {
+        'err': 'ok',
+        'holderCount': holder_count,
+        # null when the address does not hold the token
+        'result': None if holder_rank is None else serializer_token_holder_rank.dump(holder_rank)
     }
 
     return jsonify(result)
+
+
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def iter_ndjson(batches, serializer):
+    for rows in batches:
+        yield ''.join(json.dumps(item, separators=(',', ':')) + '\n'
+                      for item in serializer.dump(rows, many=True))
+
+
+def iter_csv(batches, serializer):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(serializer.data_keys)
+    for rows in batches:
+        writer.writerows([item[key] for key in serializer.data_keys]
+                         for item in serializer.dump(rows, many=True))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # header only if there is no row
+    if buffer.tell() > 0:
+        yield buffer.getvalue()
+
+
+@bp_ledger.route('/export/account_blocks', methods=('GET', ))
+def export_account_blocks():
+    '''
+    stream the account blocks of an address and/or a token as NDJSON or CSV,
+    query parameters: address, tokenId, from, to (timestamps, to is exclusive), format
+    '''
+    address = request.args.get('address')
+    token_id = request.args.get('tokenId')
+    ts_from = request.args.get('from', type=int)
+    ts_to = request.args.get('to', type=int)
+    export_format = request.args.get('format', 'ndjson')
+
+    if address is None and token_id is None:
+        return jsonify({'err': 'address or tokenId is required'}), 400
+    if export_format not in EXPORT_MIMETYPES:
+        return jsonify({'err': f'format must be one of {", ".join(EXPORT_MIMETYPES)}'}), 400
+
+    batches = db_stream_account_blocks(address, token_id, ts_from, ts_to)
+    if export_format == 'csv':
+        chunks = iter_csv(batches, serializer_account_block_row)
+    else:
+        chunks = iter_ndjson(batches, serializer_account_block_row)
+
+    return Response(stream_with_context(chunks), mimetype=EXPORT_MIMETYPES[export_format], headers={
+        'Content-Disposition': f'attachment; filename=account_blocks.{export_format}'})
@@ -0,0 +1,74 @@
+'''
+Write-behind persistence of account blocks fetched from gvite while serving requests.
+
+Requests queue the blocks and return, a background thread of the worker process
+drains the queue and saves the blocks in bulk. Blocks still queued when the
+process exits are lost, the sync daemon and chunk download persist them anyway.
+'''
+import queue
+import threading
+
+from flask import current_app as app
+
+from .data_accessor import account_block_to_row, db_bulk_save_account_blocks
+
+WRITE_BEHIND_QUEUE_SIZE = 10000
+WRITE_BEHIND_BATCH_SIZE = 500
+
+
+class AccountBlockWriter:
+
+    def __init__(self, queue_size=WRITE_BEHIND_QUEUE_SIZE, batch_size=WRITE_BEHIND_BATCH_SIZE):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, account_blocks):
+        '''
+        queue account blocks for saving, must be called within an app context
+        '''
+        self.start(app._get_current_object())
+        for account_block in account_blocks:
+            try:
+                self.queue.put_nowait(account_block_to_row(account_block))
+            except queue.Full:
+                app.logger.warning(
+                    f'write-behind queue full, drop account block {account_block.hash}')
+                return
+
+    def start(self, flask_app):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(
+                target=self.run, args=(flask_app, ), name='account-block-writer', daemon=True)
+            self.thread.start()
+
+    def get_batch(self):
+        rows = [self.queue.get()]
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def run(self, flask_app):
+        while True:
+            rows = self.get_batch()
+            with flask_app.app_context():
+                try:
+                    inserted = db_bulk_save_account_blocks(rows)
+                    flask_app.logger.info(
+                        f'write-behind saved {len(rows)} account blocks, {inserted} new')
+                except Exception as err:
+                    flask_app.logger.error(
+                        f'write-behind fail to save {len(rows)} account blocks: General Error {err}')
+            for _ in rows:
+                self.queue.task_done()
+
+
+account_block_writer = AccountBlockWriter()
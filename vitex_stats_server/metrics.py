@@ -0,0 +1,300 @@
+'''
+Request instrumentation, exposed at /metrics in Prometheus text format and in
+the Server-Timing header of every response.
+
+A request accumulates in flask.g the SQL statements run (engine events), the
+gvite calls (rpc.rpc_post) and the serialization time (CompiledSchema.dump),
+they are added to the registry of the worker when the request ends. Work done
+outside of a request, by daemons and background threads, is not recorded.
+
+Every uwsgi process has its own registry: with METRICS_DIR set, each one saves
+its registry there at most every METRICS_FLUSH_INTERVAL seconds and /metrics
+sums the registries of all processes.
+'''
+import json
+import os
+import threading
+import time
+
+from flask import Blueprint, g, has_request_context, request
+from flask import current_app as app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+METRICS_FLUSH_INTERVAL = 5  # seconds
+
+# family: (type, help)
+METRIC_FAMILIES = {
+    'vitex_request_duration_seconds': ('histogram', 'Latency of the requests by endpoint'),
+    'vitex_requests_total': ('counter', 'Requests by endpoint and status code'),
+    'vitex_sql_statements_total': ('counter', 'SQL statements executed by endpoint'),
+    'vitex_sql_duration_seconds_total': ('counter', 'Time spent in SQL statements by endpoint'),
+    'vitex_rpc_calls_total': ('counter', 'gvite calls by endpoint and RPC method'),
+    'vitex_rpc_duration_seconds_total': ('counter', 'Time spent in gvite calls by endpoint and RPC method'),
+    'vitex_serialization_duration_seconds_total': ('counter', 'Time spent serializing responses by endpoint'),
+}
+# order of the series of a histogram
+HISTOGRAM_SUFFIXES = {'_bucket': 0, '_sum': 1, '_count': 2}
+
+bp_metrics = Blueprint('metrics', __name__)
+
+
+class RequestMetrics:
+    __slots__ = ('start', 'sql_count', 'sql_seconds',
+                 'rpc', 'serialization_seconds')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        # RPC method: [calls, seconds]
+        self.rpc = {}
+        self.serialization_seconds = 0.0
+
+
+def get_request_metrics():
+    '''
+    metrics of the current request, None outside of a request
+    '''
+    if has_request_context():
+        return g.get('request_metrics')
+    return None
+
+
+def record_rpc(method, seconds):
+    request_metrics = get_request_metrics()
+    if request_metrics is None:
+        return
+    calls = request_metrics.rpc.get(method)
+    if calls is None:
+        request_metrics.rpc[method] = [1, seconds]
+    else:
+        calls[0] += 1
+        calls[1] += seconds
+
+
+def start_serialization():
+    '''
+    mark passed to record_serialization(), the SQL statements run meanwhile, e.g. by
+    a query iterated while serializing, are not counted as serialization
+    '''
+    request_metrics = get_request_metrics()
+    if request_metrics is None:
+        return None
+    return request_metrics, time.perf_counter() - request_metrics.sql_seconds
+
+
+def record_serialization(mark):
+    if mark is None:
+        return
+    request_metrics, start = mark
+    request_metrics.serialization_seconds += time.perf_counter() - \
+        request_metrics.sql_seconds - start
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_start = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    request_metrics = get_request_metrics()
+    if request_metrics is None or context is None:
+        return
+    request_metrics.sql_count += 1
+    request_metrics.sql_seconds += time.perf_counter() - context.metrics_start
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label_value(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + '}'
+
+
+class MetricsRegistry:
+    '''
+    values of the series of a process, keyed by (family, suffix, labels),
+    labels a tuple of (name, value) pairs
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.last_flush = 0
+        self.bucket_labels = [(bucket, (('le', format_value(bucket)), ))
+                              for bucket in LATENCY_BUCKETS]
+
+    def inc(self, family, labels, value=1, suffix=''):
+        key = (family, suffix, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, family, labels, value):
+        with self.lock:
+            # every bucket is exported, with 0 for the ones never reached
+            for bucket, bucket_label in self.bucket_labels:
+                key = (family, '_bucket', labels + bucket_label)
+                self.values[key] = self.values.get(
+                    key, 0) + (1 if value <= bucket else 0)
+            for suffix, increment in (('_sum', value), ('_count', 1)):
+                key = (family, suffix, labels)
+                self.values[key] = self.values.get(key, 0) + increment
+
+    def record_request(self, endpoint, status, request_metrics, elapsed):
+        labels = (('endpoint', endpoint), )
+        self.observe('vitex_request_duration_seconds', labels, elapsed)
+        self.inc('vitex_requests_total', labels + (('status', str(status)), ))
+        if request_metrics.sql_count:
+            self.inc('vitex_sql_statements_total',
+                     labels, request_metrics.sql_count)
+            self.inc('vitex_sql_duration_seconds_total',
+                     labels, request_metrics.sql_seconds)
+        for method, (calls, seconds) in request_metrics.rpc.items():
+            rpc_labels = labels + (('method', method), )
+            self.inc('vitex_rpc_calls_total', rpc_labels, calls)
+            self.inc('vitex_rpc_duration_seconds_total', rpc_labels, seconds)
+        if request_metrics.serialization_seconds:
+            self.inc('vitex_serialization_duration_seconds_total',
+                     labels, request_metrics.serialization_seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return [[family, suffix, [list(label) for label in labels], value]
+                    for (family, suffix, labels), value in self.values.items()]
+
+    def flush(self, directory):
+        '''
+        save the registry of this process in directory
+        '''
+        self.last_flush = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f'{path}.tmp', path)
+
+
+registry = MetricsRegistry()
+
+
+def collect(directory):
+    '''
+    sum of the registries of all processes, keyed like MetricsRegistry.values
+    '''
+    snapshots = [registry.snapshot()]
+    if directory is not None and os.path.isdir(directory):
+        own_file = f'{os.getpid()}.json'
+        for name in os.listdir(directory):
+            if not name.endswith('.json') or name == own_file:
+                continue
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError) as err:
+                app.logger.warning(f'fail to read metrics file {name}: {err}')
+
+    values = {}
+    for snapshot in snapshots:
+        for family, suffix, labels, value in snapshot:
+            key = (family, suffix, tuple(tuple(label) for label in labels))
+            values[key] = values.get(key, 0) + value
+    return values
+
+
+def series_sort_key(item):
+    (suffix, labels), _ = item
+    base_labels = tuple(label for label in labels if label[0] != 'le')
+    bucket = [float(value) for name, value in labels if name == 'le']
+    return base_labels, HISTOGRAM_SUFFIXES.get(suffix, 0), bucket
+
+
+def render(values):
+    '''
+    Prometheus text exposition format
+    '''
+    families = {}
+    for (family, suffix, labels), value in values.items():
+        families.setdefault(family, {})[(suffix, labels)] = value
+
+    lines = []
+    for family in sorted(families):
+        metric_type, description = METRIC_FAMILIES[family]
+        lines.append(f'# HELP {family} {description}')
+        lines.append(f'# TYPE {family} {metric_type}')
+        for (suffix, labels), value in sorted(families[family].items(), key=series_sort_key):
+            lines.append(
+                f'{family}{suffix}{format_labels(labels)} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def get_server_timing(request_metrics, elapsed):
+    timings = [f'app;dur={elapsed * 1000:.1f}']
+    if request_metrics.sql_count:
+        timings.append(
+            f'db;dur={request_metrics.sql_seconds * 1000:.1f};desc="{request_metrics.sql_count} statements"')
+    if request_metrics.rpc:
+        calls = sum(calls for calls, _ in request_metrics.rpc.values())
+        seconds = sum(seconds for _, seconds in request_metrics.rpc.values())
+        timings.append(f'rpc;dur={seconds * 1000:.1f};desc="{calls} calls"')
+    if request_metrics.serialization_seconds:
+        timings.append(
+            f'serialize;dur={request_metrics.serialization_seconds * 1000:.1f}')
+    return ', '.join(timings)
+
+
+def start_request():
+    g.request_metrics = RequestMetrics()
+
+
+def end_request(response):
+    request_metrics = g.pop('request_metrics', None)
+    if request_metrics is None:
+        return response
+    elapsed = time.perf_counter() - request_metrics.start
+    response.headers['Server-Timing'] = get_server_timing(
+        request_metrics, elapsed)
+
+    registry.record_request(request.endpoint or 'unmatched',
+                            response.status_code, request_metrics, elapsed)
+
+    directory = app.config.get('METRICS_DIR')
+    if directory is not None and time.monotonic() - registry.last_flush >= app.config.get('METRICS_FLUSH_INTERVAL', METRICS_FLUSH_INTERVAL):
+        try:
+            registry.flush(directory)
+        except OSError as err:
+            app.logger.warning(f'fail to save metrics in {directory}: {err}')
+    return response
+
+
+@bp_metrics.route('/metrics', methods=('GET', ))
+def get_metrics():
+    return app.response_class(render(collect(app.config.get('METRICS_DIR'))),
+                              mimetype='text/plain; version=0.0.4')
+
+
+def init_metrics(flask_app):
+    '''
+    instrument the requests of flask_app unless METRICS_ENABLED is False
+    '''
+    if not flask_app.config.get('METRICS_ENABLED', True):
+        return
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    flask_app.before_request(start_request)
+    flask_app.after_request(end_request)
+    flask_app.register_blueprint(bp_metrics)
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from flask_sqlalchemy import SQLAlchemy
 from flask_sqlalchemy.model import Model
 from marshmallow import Schema, fields, EXCLUDE, post_load
@@ -5,6 +7,8 @@ from sqlalchemy.orm import relationship
 from sqlalchemy.sql.functions import func
 from sqlalchemy.sql.schema import ForeignKey
 
+from .column_types import Address, Base64, Hash
+
 # definition at https://vite.wiki/api/rpc/common_models_v2.html#tokeninfo
 
 db = SQLAlchemy()
@@ -49,17 +53,22 @@ class TokenSchema(Schema):
 
 
 class AccountBlock(db.Model):
+    # range partitioned by month of timestamp, see partition.py. a primary key of a
+    # partitioned table must contain the partition key, hash alone stays the identity:
+    # its uniqueness is kept by the writers, see db_bulk_save_account_blocks()
+    __table_args__ = {'postgresql_partition_by': 'RANGE (timestamp)'}
 
     block_type = db.Column('block_type', db.Integer, index=True)
     height = db.Column('height', db.Integer, index=True)
-    hash = db.Column('hash', db.String(length=64), primary_key=True)
-    previous_hash = db.Column('previous_hash', db.String(length=64))
-    address = db.Column('address', db.String)
-    public_key = db.Column('public_key', db.String)
-    producer = db.Column('producer', db.String)
-    from_address = db.Column('from_address', db.String, index=True)
-    to_address = db.Column('to_address', db.String, index=True)
-    send_block_hash = db.Column('send_block_hash', db.String)
+    # hashes, addresses and signatures are stored as bytea with BINARY_STORAGE, see column_types.py
+    hash = db.Column('hash', Hash(length=64), primary_key=True)
+    previous_hash = db.Column('previous_hash', Hash(length=64))
+    address = db.Column('address', Address())
+    public_key = db.Column('public_key', Base64(32))
+    producer = db.Column('producer', Address())
+    from_address = db.Column('from_address', Address(), index=True)
+    to_address = db.Column('to_address', Address(), index=True)
+    send_block_hash = db.Column('send_block_hash', Hash())
     token_id = db.Column('token_id', ForeignKey('token.token_id'), index=True)
     token = relationship('Token')
     amount = db.Column('amount', db.DECIMAL(128, 0))
@@ -68,20 +77,25 @@ class AccountBlock(db.Model):
     data = db.Column('data', db.String)
     difficulty = db.Column('difficulty', db.BigInteger)
     nonce = db.Column('nonce', db.String)
-    signature = db.Column('signature', db.String)
+    signature = db.Column('signature', Base64(64))
     quota_by_stake = db.Column('quota_by_stake', db.Integer)
     total_quota = db.Column('total_quota', db.Integer)
-    vm_log_hash = db.Column('vm_log_hash', db.String)
+    vm_log_hash = db.Column('vm_log_hash', Hash())
 
-    triggered_send_block_list = relationship('AccountBlock')
+    # no foreign key, hash is not unique on its own across partitions
+    triggered_send_block_list = relationship(
+        'AccountBlock', primaryjoin='AccountBlock.hash == foreign(AccountBlock.triggered_by_account_block_hash)')
     triggered_by_account_block_hash = db.Column(
-        'triggered_by_account_block_hash', ForeignKey("account_block.hash"),  nullable=True, index=True)
+        'triggered_by_account_block_hash', Hash(length=64), nullable=True, index=True)
 
     confirmations = db.Column('confirmations', db.Integer)
-    first_snapshot_hash = db.Column('first_snapshot_hash', db.String)
-    timestamp = db.Column('timestamp', db.Integer, index=True)
+    first_snapshot_hash = db.Column('first_snapshot_hash', Hash())
+    timestamp = db.Column('timestamp', db.Integer,
+                          primary_key=True, autoincrement=False, index=True)
     receive_block_height = db.Column('receive_block_height', db.Integer)
-    receive_block_hash = db.Column('receive_block_hash', db.String)
+    receive_block_hash = db.Column('receive_block_hash', Hash())
+
+    __mapper_args__ = {'primary_key': [hash]}
 
 
 class AccountBlockSchema(Schema):
@@ -274,6 +288,54 @@ class AccountSchemaSimple(AccountSchema):
         exclude = ('balances', 'vite_balance')
 
 
+class TokenHolderRank(db.Model):
+    '''
+    position of a holder (balance > 0) in the rich list of a token, 1 for the largest
+    balance, ties ordered by address. see ledger/holder_rank.py
+    '''
+    __tablename__ = 'token_holder_rank'
+    __table_args__ = (
+        db.PrimaryKeyConstraint('token_id', 'account_address'),
+        db.Index('ix_token_holder_rank_token_id_rank', 'token_id', 'rank'),
+        db.Index('ix_token_holder_rank_token_id_balance',
+                 'token_id', db.text('balance DESC'), 'account_address'),
+    )
+    token_id = db.Column('token_id', db.String(length=28))
+    account_address = db.Column('account_address', db.String(length=64))
+    balance = db.Column('balance', db.DECIMAL(128, 0))
+    rank = db.Column('rank', db.Integer)
+
+
+class TokenHolderRankSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+    token_id = fields.Str(data_key='tokenId')
+    account_address = fields.Str(data_key='accountAddress')
+    balance = fields.Integer(data_key='balance')
+    rank = fields.Integer(data_key='rank')
+
+
+class TokenHolderCount(db.Model):
+    '''
+    number of holders of a token, the token is ranked once it has a row here
+    '''
+    __tablename__ = 'token_holder_count'
+    token_id = db.Column('token_id', db.String(length=28), primary_key=True)
+    holder_count = db.Column('holder_count', db.Integer, default=0)
+    recomputed_at = db.Column('recomputed_at', db.DateTime)
+
+
+class TopHolder(db.Model):
+    '''
+    accounts with the largest VITE balances when the snapshot was taken
+    '''
+    __tablename__ = 'top_holder'
+    rank = db.Column('rank', db.Integer, primary_key=True)
+    address = db.Column('address', db.String(length=64))
+    vite_balance = db.Column('vite_balance', db.DECIMAL(64, 0))
+    snapshot_time = db.Column('snapshot_time', db.DateTime)
+
+
 class StatisticDaily(db.Model):
     date = db.Column('date', db.Date, primary_key=True)
     transaction_count = db.Column('transaction_count', db.Integer, default=0)
@@ -286,16 +348,122 @@ class StatisticDailySchema(Schema):
     transaction_count = fields.Integer(data_key='transactionCount')
 
 
+class StatisticBucket(db.Model):
+    __tablename__ = 'statistic_bucket'
+    __table_args__ = (
+        db.PrimaryKeyConstraint('granularity', 'bucket_start'),
+    )
+    # bucket width in seconds, 3600 for hourly and 86400 for daily buckets
+    granularity = db.Column('granularity', db.Integer)
+    # UTC timestamp of the beginning of the bucket
+    bucket_start = db.Column('bucket_start', db.Integer)
+    transaction_count = db.Column('transaction_count', db.Integer, default=0)
+    send_count = db.Column('send_count', db.Integer, default=0)
+    receive_count = db.Column('receive_count', db.Integer, default=0)
+    fee = db.Column('fee', db.DECIMAL(128, 0), default=0)
+
+    @property
+    def date(self):
+        return datetime.utcfromtimestamp(self.bucket_start).date()
+
+
+class StatisticBucketSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+    granularity = fields.Integer(data_key='granularity')
+    bucket_start = fields.Integer(data_key='bucketStart')
+    transaction_count = fields.Integer(data_key='transactionCount')
+    send_count = fields.Integer(data_key='sendCount')
+    receive_count = fields.Integer(data_key='receiveCount')
+    fee = fields.Integer(data_key='fee')
+
+
+class StatisticDailyBucketSchema(StatisticBucketSchema):
+    date = fields.Date(data_key='date')
+
+
+class StatisticTokenBucket(db.Model):
+    __tablename__ = 'statistic_token_bucket'
+    __table_args__ = (
+        db.PrimaryKeyConstraint('granularity', 'token_id', 'bucket_start'),
+        db.Index('ix_statistic_token_bucket_granularity_start',
+                 'granularity', 'bucket_start'),
+    )
+    granularity = db.Column('granularity', db.Integer)
+    token_id = db.Column('token_id', db.String(length=28))
+    bucket_start = db.Column('bucket_start', db.Integer)
+    # send blocks only, so that a transfer is not counted twice
+    transfer_count = db.Column('transfer_count', db.Integer, default=0)
+    volume = db.Column('volume', db.DECIMAL(128, 0), default=0)
+    # maintained for daily buckets only, see StatisticTokenAddress
+    unique_senders = db.Column('unique_senders', db.Integer, default=0)
+    unique_receivers = db.Column('unique_receivers', db.Integer, default=0)
+
+    @property
+    def date(self):
+        return datetime.utcfromtimestamp(self.bucket_start).date()
+
+
+class StatisticTokenBucketSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+    granularity = fields.Integer(data_key='granularity')
+    token_id = fields.Str(data_key='tokenId')
+    bucket_start = fields.Integer(data_key='bucketStart')
+    transfer_count = fields.Integer(data_key='transferCount')
+    volume = fields.Integer(data_key='volume')
+    unique_senders = fields.Integer(data_key='uniqueSenders')
+    unique_receivers = fields.Integer(data_key='uniqueReceivers')
+
+
+class StatisticTokenDailySchema(StatisticTokenBucketSchema):
+    date = fields.Date(data_key='date')
+
+
+class StatisticTokenAddress(db.Model):
+    '''
+    addresses which sent or received a token during a day, used to count
+    unique senders and receivers incrementally
+    '''
+    __tablename__ = 'statistic_token_address'
+    __table_args__ = (
+        db.PrimaryKeyConstraint(
+            'token_id', 'bucket_start', 'role', 'address'),
+    )
+    token_id = db.Column('token_id', db.String(length=28))
+    bucket_start = db.Column('bucket_start', db.Integer)
+    # 1: sender, 2: receiver
+    role = db.Column('role', db.SmallInteger)
+    address = db.Column('address', Address(length=64))
+
+
+class StatisticAddressSketch(db.Model):
+    '''
+    HyperLogLog sketch of the addresses active during a day, see statistic/hll.py
+    '''
+    __tablename__ = 'statistic_address_sketch'
+    # UTC timestamp of the beginning of the day
+    bucket_start = db.Column('bucket_start', db.Integer, primary_key=True)
+    registers = db.Column('registers', db.LargeBinary)
+
+
 class SnapshotBlock(db.Model):
-    producer = db.Column('producer', db.String(length=64), index=True)
-    hash = db.Column('hash', db.String(length=64), primary_key=True)
-    prev_hash = db.Column('prev_hash', db.String(length=64))
+    # range partitioned by month of timestamp like account_block
+    __table_args__ = {'postgresql_partition_by': 'RANGE (timestamp)'}
+
+    producer = db.Column('producer', Address(length=64), index=True)
+    hash = db.Column('hash', Hash(length=64), primary_key=True)
+    prev_hash = db.Column('prev_hash', Hash(length=64))
     height = db.Column('height', db.Integer, index=True)
-    public_key = db.Column('public_key', db.String)
-    signature = db.Column('signature', db.String)
+    public_key = db.Column('public_key', Base64(32))
+    signature = db.Column('signature', Base64(64))
     version = db.Column('version', db.Integer)
-    timestamp = db.Column('timestamp', db.Integer, index=True)
-    snapshot_data = relationship('SnapshotData')
+    timestamp = db.Column('timestamp', db.Integer,
+                          primary_key=True, autoincrement=False, index=True)
+    snapshot_data = relationship(
+        'SnapshotData', primaryjoin='SnapshotBlock.hash == foreign(SnapshotData.snapshot_block_hash)')
+
+    __mapper_args__ = {'primary_key': [hash]}
 
 
 class SnapshotData(db.Model):
@@ -305,11 +473,13 @@ class SnapshotData(db.Model):
     )
     account_address = db.Column('account_address', db.String(
         length=64), ForeignKey('account.address'), index=True)
+    # no foreign key, snapshot_block is partitioned
     snapshot_block_hash = db.Column(
-        'snapshot_block_hash', ForeignKey('snapshot_block.hash'), index=True)
+        'snapshot_block_hash', Hash(length=64), index=True)
     height = db.Column('height', db.Integer)
-    hash = db.Column('hash', db.String(length=64))
-    snapshot_block = relationship('SnapshotBlock', viewonly=True)
+    hash = db.Column('hash', Hash(length=64))
+    snapshot_block = relationship(
+        'SnapshotBlock', primaryjoin='SnapshotBlock.hash == foreign(SnapshotData.snapshot_block_hash)', viewonly=True)
 
 
 class SnapshotDataSchema(Schema):
@@ -340,3 +510,47 @@ class SnapshotBlockSchema(Schema):
 class ConfigStatus(db.Model):
     key = db.Column('key', db.String(length=64), primary_key=True)
     value = db.Column('value', db.String(length=255))
+
+
+class SlowQuery(db.Model):
+    '''
+    statements slower than SLOW_QUERY_THRESHOLD aggregated by normalized SQL,
+    see slow_query.py
+    '''
+    __tablename__ = 'slow_query'
+    fingerprint = db.Column('fingerprint', db.String(length=32), primary_key=True)
+    normalized_sql = db.Column('normalized_sql', db.Text)
+    # endpoint or thread of the last occurrence
+    endpoint = db.Column('endpoint', db.String(length=128))
+    calls = db.Column('calls', db.Integer, default=0)
+    total_seconds = db.Column('total_seconds', db.Float, default=0)
+    max_seconds = db.Column('max_seconds', db.Float, default=0)
+    first_seen = db.Column('first_seen', db.DateTime)
+    last_seen = db.Column('last_seen', db.DateTime)
+    # last statement explained, with its parameters and plan
+    sample_statement = db.Column('sample_statement', db.Text)
+    sample_parameters = db.Column('sample_parameters', db.Text)
+    sample_plan = db.Column('sample_plan', db.Text)
+    plan_captured_at = db.Column('plan_captured_at', db.DateTime)
+
+    @property
+    def mean_seconds(self):
+        return self.total_seconds / self.calls if self.calls else 0
+
+
+class SlowQuerySchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+    fingerprint = fields.Str(data_key='fingerprint')
+    normalized_sql = fields.Str(data_key='normalizedSql')
+    endpoint = fields.Str(data_key='endpoint')
+    calls = fields.Integer(data_key='calls')
+    total_seconds = fields.Float(data_key='totalSeconds')
+    mean_seconds = fields.Float(data_key='meanSeconds')
+    max_seconds = fields.Float(data_key='maxSeconds')
+    first_seen = fields.DateTime(data_key='firstSeen')
+    last_seen = fields.DateTime(data_key='lastSeen')
+    sample_statement = fields.Str(data_key='sampleStatement')
+    sample_parameters = fields.Str(data_key='sampleParameters')
+    sample_plan = fields.Str(data_key='samplePlan')
+    plan_captured_at = fields.DateTime(data_key='planCapturedAt')
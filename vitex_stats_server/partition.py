@@ -0,0 +1,255 @@
+'''
+Monthly range partitions of account_block and snapshot_block by timestamp.
+
+Each table has a partition per UTC month, e.g. account_block_y2021m03, and a
+default partition for the rows out of the months created. Partitions are created
+a few months ahead by the daemons and `flask manage create-partitions`, queries
+filtered by timestamp only scan the months they cover, and retention drops the
+partitions of the months gone instead of deleting their rows, see db_manage.py.
+
+A database created before partitioning is migrated by `flask manage partition-tables`.
+'''
+import logging
+import re
+import time
+from datetime import datetime, timezone
+
+from flask import current_app as app
+from sqlalchemy import column, table as core_table, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from .models import AccountBlock, SnapshotBlock, db
+
+PARTITIONED_TABLES = (AccountBlock.__tablename__, SnapshotBlock.__tablename__)
+# months of partitions created after the current one
+PARTITION_MONTHS_AHEAD = 3
+# seconds between two checks of the sync daemon
+PARTITION_CHECK_INTERVAL = 3600
+
+BOUND_PATTERN = re.compile(r"FOR VALUES FROM \('?(-?\d+)'?\) TO \('?(-?\d+)'?\)")
+
+
+def month_start(timestamp):
+    moment = datetime.fromtimestamp(timestamp, timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def get_partition_name(table_name, month):
+    return f'{table_name}_y{month.year}m{month.month:02d}'
+
+
+def get_default_partition_name(table_name):
+    return f'{table_name}_default'
+
+
+def get_unpartitioned_name(table_name):
+    return f'{table_name}_unpartitioned'
+
+
+def table_exists(table_name):
+    return db.session.execute(text('SELECT to_regclass(:name) IS NOT NULL'), {'name': table_name}).scalar()
+
+
+def is_partitioned(table_name):
+    return db.session.execute(text(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:name)"), {'name': table_name}).scalar() or False
+
+
+def get_partitions(table_name):
+    '''
+    [(partition name, lower timestamp, upper timestamp)] ordered by bounds, the default partition excluded
+    '''
+    rows = db.session.execute(text(
+        'SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits '
+        'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+        'WHERE pg_inherits.inhparent = to_regclass(:name)'), {'name': table_name})
+    partitions = []
+    for name, bound in rows:
+        match = BOUND_PATTERN.match(bound)
+        if match:
+            partitions.append((name, int(match[1]), int(match[2])))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def create_partition(table_name, month):
+    '''
+    create the partition of month, the rows of month in the default partition are
+    moved to it. the caller commits
+    '''
+    name = get_partition_name(table_name, month)
+    lower, upper = int(month.timestamp()), int(add_months(month, 1).timestamp())
+    db.session.execute(text(
+        f'CREATE TABLE {name} (LIKE {table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    db.session.execute(text(
+        f'WITH moved AS (DELETE FROM {get_default_partition_name(table_name)} '
+        f'WHERE "timestamp" >= :lower AND "timestamp" < :upper RETURNING *) '
+        f'INSERT INTO {name} SELECT * FROM moved'), {'lower': lower, 'upper': upper})
+    # indexes of the partitioned table are created on the partition when attached
+    db.session.execute(text(
+        f'ALTER TABLE {table_name} ATTACH PARTITION {name} FOR VALUES FROM ({lower}) TO ({upper})'))
+    return name
+
+
+def create_table_partitions(table_name, start_timestamp=None, months_ahead=PARTITION_MONTHS_AHEAD):
+    '''
+    create the default partition and the missing monthly partitions of table_name, from the
+    month of start_timestamp or of the first partition, to months_ahead after the current one.
+    each partition is committed on its own, a transaction creating them all would hold a lock
+    per partition and index. return the names of the partitions created
+    '''
+    db.session.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {get_default_partition_name(table_name)} PARTITION OF {table_name} DEFAULT'))
+    db.session.commit()
+    partitions = get_partitions(table_name)
+    existing = {lower for _, lower, _ in partitions}
+    first_timestamps = [time.time()]
+    if start_timestamp is not None:
+        first_timestamps.append(start_timestamp)
+    if partitions:
+        first_timestamps.append(partitions[0][1])
+
+    created = []
+    month = month_start(min(first_timestamps))
+    last_month = add_months(month_start(time.time()), months_ahead)
+    while month <= last_month:
+        if int(month.timestamp()) not in existing:
+            created.append(create_partition(table_name, month))
+            db.session.commit()
+        month = add_months(month, 1)
+    return created
+
+
+def ensure_partitions(start_timestamp=None, months_ahead=None):
+    '''
+    create the missing partitions of the partitioned tables, see create_table_partitions().
+    tables not migrated yet are skipped. return the names of the partitions created
+    '''
+    if months_ahead is None:
+        months_ahead = app.config.get(
+            'PARTITION_MONTHS_AHEAD', PARTITION_MONTHS_AHEAD)
+    created = []
+    try:
+        for table_name in PARTITIONED_TABLES:
+            if is_partitioned(table_name):
+                created += create_table_partitions(
+                    table_name, start_timestamp, months_ahead)
+    except SQLAlchemyError as err:
+        db.session.rollback()
+        logging.error(f'fail to create partitions: SQLAlchemyError {err}')
+        return []
+    if created:
+        logging.info(f'created partitions {", ".join(created)}')
+    return created
+
+
+def replace_with_partitioned_table(table_name):
+    '''
+    rename table_name and its indexes out of the way and create the partitioned table
+    with the indexes of the model and the ones created by hand. the caller commits
+    '''
+    index_definitions = db.session.execute(text(
+        'SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :name'),
+        {'name': table_name}).all()
+    # hash alone is no longer unique, foreign keys referencing it are dropped
+    for referencing_table, constraint in db.session.execute(text(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint WHERE contype = 'f' AND confrelid = to_regclass(:name)"),
+            {'name': table_name}).all():
+        db.session.execute(text(
+            f'ALTER TABLE {referencing_table} DROP CONSTRAINT {constraint}'))
+    for index_name, _ in index_definitions:
+        db.session.execute(text(
+            f'ALTER INDEX {index_name} RENAME TO {get_unpartitioned_name(index_name)}'))
+    db.session.execute(text(
+        f'ALTER TABLE {table_name} RENAME TO {get_unpartitioned_name(table_name)}'))
+
+    table = db.metadata.tables[table_name]
+    table.create(bind=db.session.connection())
+    model_indexes = {index.name for index in table.indexes}
+    # e.g. flask manage create-index-account-block-export
+    for index_name, definition in index_definitions:
+        if index_name not in model_indexes and index_name != f'{table_name}_pkey' and 'UNIQUE' not in definition:
+            db.session.execute(text(definition))
+
+
+def partition_table(table_name, months_ahead=PARTITION_MONTHS_AHEAD, drop_old=False):
+    '''
+    migrate table_name to monthly partitions: the table is replaced by a partitioned one
+    and its rows are copied month by month, each month in its own transaction. an
+    interrupted migration resumes where it stopped. stop the daemons meanwhile, rows
+    not copied yet are missing from the new table.
+    return the number of rows copied
+    '''
+    old_name = get_unpartitioned_name(table_name)
+    if not is_partitioned(table_name):
+        replace_with_partitioned_table(table_name)
+        db.session.commit()
+        logging.info(f'{table_name} renamed to {old_name}, partitioned table created')
+    if not table_exists(old_name):
+        logging.info(f'{table_name} is already partitioned')
+        return 0
+
+    # 0 stands for an unknown timestamp, those rows go to the default partition
+    first_timestamp = db.session.execute(text(
+        f'SELECT min("timestamp") FROM {old_name} WHERE "timestamp" > 0')).scalar()
+    create_table_partitions(table_name, first_timestamp, months_ahead)
+
+    table = db.metadata.tables[table_name]
+    columns = ', '.join(f'"{column.name}"' for column in table.columns)
+    # the timestamp is part of the primary key now, missing ones go to the default partition
+    values = columns.replace('"timestamp"', 'coalesce("timestamp", 0)')
+    copy = (f'INSERT INTO {table_name} ({columns}) SELECT {values} FROM {old_name} '
+            '{condition} ON CONFLICT DO NOTHING')
+
+    partitions = get_partitions(table_name)
+    copied = 0
+    for name, lower, upper in partitions:
+        count = db.session.execute(text(copy.format(
+            condition='WHERE "timestamp" >= :lower AND "timestamp" < :upper')),
+            {'lower': lower, 'upper': upper}).rowcount
+        db.session.commit()
+        copied += count
+        logging.info(f'copied {count} rows into {name}')
+    count = db.session.execute(text(copy.format(
+        condition='WHERE "timestamp" IS NULL OR "timestamp" < :lower OR "timestamp" >= :upper')),
+        {'lower': partitions[0][1], 'upper': partitions[-1][2]}).rowcount
+    db.session.commit()
+    copied += count
+    logging.info(
+        f'copied {count} rows into {get_default_partition_name(table_name)}')
+
+    if drop_old:
+        db.session.execute(text(f'DROP TABLE {old_name}'))
+        db.session.commit()
+        logging.info(f'dropped {old_name}')
+    return copied
+
+
+def get_partitions_before(table_name, timestamp):
+    '''
+    names of the partitions of table_name whose rows are all older than timestamp
+    '''
+    if not is_partitioned(table_name):
+        return []
+    return [name for name, _, upper in get_partitions(table_name) if upper <= timestamp]
+
+
+def get_partition_table(table_name, name):
+    '''
+    Core table of a partition of table_name, with the column types of the model
+    '''
+    return core_table(name, *(column(c.name, c.type) for c in db.metadata.tables[table_name].columns))
+
+
+def drop_partition(table_name, name):
+    '''
+    detach and drop a partition of table_name in its own transaction
+    '''
+    db.session.execute(
+        text(f'ALTER TABLE {table_name} DETACH PARTITION {name}'))
+    db.session.execute(text(f'DROP TABLE {name}'))
+    db.session.commit()
@@ -0,0 +1,65 @@
+'''
+Projections of the account block lists: the columns selected, the record class
+and the serializer of a subset of the fields of AccountBlockSchema.
+
+List endpoints dump the summary projection, without the heavy columns list views
+never show. The query parameter fields=hash,timestamp,amount,... selects the
+fields dumped instead, any of them, heavy ones included.
+'''
+from functools import lru_cache
+
+from flask import jsonify, request
+
+from .models import AccountBlock, AccountBlockSchema
+from .records import make_schema_record_class
+from .serializers import compile_schema
+
+ACCOUNT_BLOCK_HEAVY_FIELDS = ('data', 'signature', 'public_key', 'nonce', 'vm_log_hash')
+# sparse fieldsets compiled per process
+PROJECTION_CACHE_SIZE = 64
+
+
+class AccountBlockProjection:
+
+    def __init__(self, schema, name):
+        self.record_class = make_schema_record_class(name, schema)
+        self.columns = [AccountBlock.__mapper__.columns[key]
+                        for key in self.record_class.columns]
+        self.with_token = 'token' in self.record_class.nested
+        self.serializer = compile_schema(schema)
+
+
+ACCOUNT_BLOCK_SUMMARY = AccountBlockProjection(AccountBlockSchema(
+    exclude=ACCOUNT_BLOCK_HEAVY_FIELDS), 'AccountBlockSummaryRecord')
+
+
+def get_field_names(schema):
+    '''
+    {data key: field name} of the dump fields of schema, in declaration order
+    '''
+    return {schema.dump_fields[field_name].data_key or field_name: field_name
+            for field_name in schema.declared_fields if field_name in schema.dump_fields}
+
+
+ACCOUNT_BLOCK_FIELD_NAMES = get_field_names(AccountBlockSchema())
+
+
+@lru_cache(maxsize=PROJECTION_CACHE_SIZE)
+def get_sparse_projection(field_names):
+    return AccountBlockProjection(AccountBlockSchema(only=field_names), 'AccountBlockSparseRecord')
+
+
+def get_account_block_projection():
+    '''
+    projection of the fields query parameter, the summary without it
+    return (projection, None), or (None, error response) if a field is unknown
+    '''
+    fields = request.args.get('fields')
+    if fields is None:
+        return ACCOUNT_BLOCK_SUMMARY, None
+    data_keys = [key.strip() for key in fields.split(',') if key.strip()]
+    unknown = [key for key in data_keys if key not in ACCOUNT_BLOCK_FIELD_NAMES]
+    if not data_keys or unknown:
+        return None, (jsonify({'err': f'fields must be among {", ".join(ACCOUNT_BLOCK_FIELD_NAMES)}, '
+                                      f'got {fields}', 'result': {}}), 400)
+    return get_sparse_projection(tuple(sorted({ACCOUNT_BLOCK_FIELD_NAMES[key] for key in data_keys}))), None
@@ -0,0 +1,59 @@
+'''
+Lightweight read-only records for list queries in row mode.
+
+A record class has one __slots__ attribute per field dumped by a schema, so that
+records of a Core select() feed the serializers without building ORM objects.
+Nested fields come last and are filled by the caller.
+'''
+from marshmallow import fields
+
+from .models import AccountBlockSchema, AccountSchema, BalanceSchema, TokenSchema
+
+
+def make_record_class(name, field_names):
+    '''
+    class with __slots__ field_names and an __init__ taking them in order
+    '''
+    arguments = ', '.join(field_names)
+    source = [f'def __init__(self, {arguments}):']
+    source += [f'    self.{field_name} = {field_name}' for field_name in field_names]
+    namespace = {}
+    exec(compile('\n'.join(source), f'<record {name}>', 'exec'), namespace)
+
+    def __repr__(self):
+        values = ', '.join(f'{field_name}={getattr(self, field_name)!r}'
+                           for field_name in field_names)
+        return f'{name}({values})'
+
+    return type(name, (), {
+        '__slots__': tuple(field_names),
+        '__init__': namespace['__init__'],
+        '__repr__': __repr__,
+    })
+
+
+def make_schema_record_class(name, schema, key_columns=()):
+    '''
+    record class of the attributes dumped by schema, the columns first,
+    then the nested fields. key_columns are added if the schema does not dump them
+    '''
+    columns = list(key_columns)
+    nested = []
+    for field_name, field in schema.dump_fields.items():
+        attribute = field.attribute or field_name
+        if isinstance(field, fields.Nested):
+            nested.append(attribute)
+        elif attribute not in columns:
+            columns.append(attribute)
+    record_class = make_record_class(name, columns + nested)
+    record_class.columns = tuple(columns)
+    record_class.nested = tuple(nested)
+    return record_class
+
+
+TokenRecord = make_schema_record_class(
+    'TokenRecord', TokenSchema(), key_columns=('token_id', ))
+AccountBlockRecord = make_schema_record_class(
+    'AccountBlockRecord', AccountBlockSchema())
+BalanceRecord = make_schema_record_class('BalanceRecord', BalanceSchema())
+AccountRecord = make_schema_record_class('AccountRecord', AccountSchema())
@@ -0,0 +1,79 @@
+'''
+JSON-RPC calls to gvite
+'''
+import time
+
+from flask import current_app as app
+import requests
+
+from .metrics import record_rpc
+
+RPC_HEADERS = {'content-type': 'application/json'}
+
+
+def rpc_post(request_body, headers=RPC_HEADERS):
+    '''
+    POST a JSON-RPC request or batch to gvite, return the response of requests.
+    the call is timed for the metrics of the current request
+    '''
+    method = request_body['method'] if isinstance(
+        request_body, dict) else 'batch'
+    start = time.perf_counter()
+    try:
+        return requests.post(app.config['URL_RPC'], json=request_body, headers=headers)
+    finally:
+        record_rpc(method, time.perf_counter() - start)
+
+
+def gvite_batch_call(calls):
+    '''
+    calls: list of (method, params)
+    send all calls in one JSON-RPC batch request,
+    return the results in the order of calls, None for a failed call
+    '''
+    if len(calls) == 0:
+        return []
+
+    request_body = [{
+        "jsonrpc": "2.0",
+        "id": idx,
+        "method": method,
+        "params": params
+    } for idx, (method, params) in enumerate(calls)]
+
+    try:
+        response = rpc_post(request_body)
+    except requests.RequestException as err:
+        app.logger.error(f'RPC batch call failed: {err}')
+        return [None] * len(calls)
+
+    if not response.ok:
+        app.logger.error(
+            f'RPC batch call failed, code: {response.status_code}, msg: {response.text}')
+        return [None] * len(calls)
+
+    try:
+        body = response.json()
+    except ValueError as err:
+        app.logger.error(f'RPC batch call failed, invalid JSON: {err}')
+        return [None] * len(calls)
+    # an error of the whole batch comes as a single response object
+    if not isinstance(body, list):
+        app.logger.error(f'RPC batch call failed, msg: {body}')
+        return [None] * len(calls)
+
+    results = [None] * len(calls)
+    # responses of a batch may come in any order
+    for item in body:
+        if not isinstance(item, dict):
+            continue
+        idx = item.get('id')
+        if not isinstance(idx, int) or not 0 <= idx < len(calls):
+            continue
+        if item.get('error') is not None:
+            method = calls[idx][0]
+            app.logger.error(
+                f'RPC call failed: {method}, error: {item["error"]}')
+            continue
+        results[idx] = item.get('result')
+    return results
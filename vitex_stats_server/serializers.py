@@ -0,0 +1,144 @@
+'''
+Precompiled dump functions for the marshmallow schemas of hot responses.
+
+compile_schema() reads the dump fields of a schema once and generates a flat
+function building the output dict directly, with the conversions of the common
+fields inlined. The output is the same as schema.dump(): fields without a fast
+path are serialized by the marshmallow field itself, and objects missing an
+attribute are dumped by the schema.
+'''
+from datetime import date
+
+from marshmallow import fields, missing
+from marshmallow.decorators import POST_DUMP, PRE_DUMP
+
+from .metrics import record_serialization, start_serialization
+from .models import AccountBlockSchema, AccountSchema, AccountSchemaSimple, BalanceSchema, CompleteAccountBlockSchema, SBPSchema, SnapshotBlockSchema, TokenHolderRankSchema, TokenSchema
+
+ISO_FORMATS = (None, 'iso', 'iso8601')
+
+
+def get_value_expression(field, value, field_ref, nested_ref):
+    '''
+    return the expression serializing value for field, None if the field has no fast path
+    '''
+    field_class = field.__class__
+    if field_class is fields.String:
+        return f'{value} if {value} is None or {value}.__class__ is str else str({value})'
+    if field_class is fields.Integer and not field.as_string:
+        return f'{value} if {value} is None or {value}.__class__ is int else int({value})'
+    if field_class is fields.Boolean:
+        return (f'{value} if {value} is None or {value}.__class__ is bool '
+                f'else {field_ref}._serialize({value}, None, None)')
+    if field_class is fields.DateTime and field.format in ISO_FORMATS:
+        return f'None if {value} is None else {value}.isoformat()'
+    if field_class is fields.Date and field.format in ISO_FORMATS:
+        return f'None if {value} is None else date_isoformat({value})'
+    if field_class is fields.Nested and isinstance(field.nested, type):
+        if field.schema.many or field.many:
+            return f'None if {value} is None else [{nested_ref}(item) for item in {value}]'
+        return f'None if {value} is None else {nested_ref}({value})'
+    return None
+
+
+def compile_dump(schema, name):
+    '''
+    generate the function dumping a single object with schema
+    '''
+    namespace = {
+        'missing': missing,
+        'date_isoformat': date.isoformat,
+        'schema_dump': schema.dump,
+    }
+    values = []
+    statements = []
+    items = []
+    for idx, (field_name, field) in enumerate(schema.dump_fields.items()):
+        key = field.data_key if field.data_key is not None else field_name
+        attribute = field.attribute or field_name
+        value = f'v{idx}'
+        field_ref = f'field_{idx}'
+        nested_ref = f'dump_nested_{idx}'
+        namespace[field_ref] = field
+
+        expression = None
+        if attribute.isidentifier() and field._CHECK_ATTRIBUTE:
+            if isinstance(field, fields.Nested) and isinstance(field.nested, type):
+                namespace[nested_ref] = compile_dump(
+                    field.schema, f'{name}_{field_name}')
+            expression = get_value_expression(
+                field, value, field_ref, nested_ref)
+
+        if expression is None:
+            # let marshmallow serialize the field, a missing value drops the key
+            values.append(
+                f'{value} = {field_ref}.serialize({field_name!r}, obj, schema_get_attribute)')
+            statements.append(
+                f'    if {value} is missing:\n        del result[{key!r}]')
+            namespace['schema_get_attribute'] = schema.get_attribute
+            items.append(f'{key!r}: {value}')
+        else:
+            values.append(f'{value} = obj.{attribute}')
+            items.append(f'{key!r}: {expression}')
+
+    source = [f'def dump_{name}(obj):', '    try:']
+    source += [f'        {line}' for line in values]
+    # an object without one of the attributes is left to marshmallow,
+    # which drops the missing fields
+    source += ['    except AttributeError:', '        return schema_dump(obj, many=False)']
+    source.append('    result = {' + ', '.join(items) + '}')
+    source += statements
+    source.append('    return result')
+
+    exec(compile('\n'.join(source), f'<serializer {name}>', 'exec'), namespace)
+    return namespace[f'dump_{name}']
+
+
+class CompiledSchema:
+    '''
+    dump(obj, many) of a schema, with the same output as schema.dump()
+    '''
+
+    def __init__(self, schema, name=None):
+        self.schema = schema
+        self.many = schema.many
+        # output keys in declaration order, dump_fields is not ordered
+        self.data_keys = [schema.dump_fields[field_name].data_key or field_name
+                          for field_name in schema.declared_fields
+                          if field_name in schema.dump_fields]
+        if schema._has_processors(PRE_DUMP) or schema._has_processors(POST_DUMP):
+            # hooks are not compiled
+            self.dump_one = lambda obj: schema.dump(obj, many=False)
+        else:
+            self.dump_one = compile_dump(
+                schema, name or schema.__class__.__name__)
+
+    def dump(self, obj, many=None):
+        many = self.many if many is None else many
+        mark = start_serialization()
+        if many:
+            dump_one = self.dump_one
+            result = [dump_one(item) for item in obj]
+        else:
+            result = self.dump_one(obj)
+        record_serialization(mark)
+        return result
+
+
+def compile_schema(schema):
+    return CompiledSchema(schema)
+
+
+serializer_token = compile_schema(TokenSchema())
+serializer_account_block = compile_schema(AccountBlockSchema())
+# rows of the account_block table, without the token relationship
+serializer_account_block_row = compile_schema(
+    AccountBlockSchema(exclude=('token',)))
+serializer_account_block_complete = compile_schema(
+    CompleteAccountBlockSchema())
+serializer_account = compile_schema(AccountSchema())
+serializer_account_simple = compile_schema(AccountSchemaSimple())
+serializer_balance = compile_schema(BalanceSchema())
+serializer_snapshot_block = compile_schema(SnapshotBlockSchema())
+serializer_sbp = compile_schema(SBPSchema())
+serializer_token_holder_rank = compile_schema(TokenHolderRankSchema())
@@ -0,0 +1,220 @@
+'''
+Capture of the SQL statements slower than SLOW_QUERY_THRESHOLD seconds.
+
+The engine events queue the slow statements, a background thread of the
+process aggregates them in the slow_query table by the fingerprint of their
+normalized SQL. The plan of a SELECT is sampled with EXPLAIN (ANALYZE, BUFFERS)
+and its actual parameters, at most once per fingerprint every
+SLOW_QUERY_EXPLAIN_INTERVAL seconds, in a read only transaction with a
+statement timeout. A SELECT which locks or has side effects, e.g. takes an
+advisory lock or is FOR UPDATE, is explained without running it, with EXPLAIN
+alone. See cli slow-queries and /admin/slow_queries.
+'''
+from datetime import datetime, timedelta
+import hashlib
+import json
+import queue
+import re
+import threading
+import time
+
+from flask import current_app as app
+from flask import has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.functions import func
+
+from .models import SlowQuery, db
+
+SLOW_QUERY_THRESHOLD = 0.5  # seconds
+SLOW_QUERY_EXPLAIN_INTERVAL = 3600  # seconds
+SLOW_QUERY_EXPLAIN_TIMEOUT = 10  # seconds
+SLOW_QUERY_QUEUE_SIZE = 1000
+# statements and parameters stored are cut beyond this length
+SLOW_QUERY_MAX_TEXT = 20000
+
+PLACEHOLDER = re.compile(r'%\(\w+\)s|%s|\$\d+')
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+VALUE_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+WHITESPACE = re.compile(r'\s+')
+# locking clauses and functions with side effects, which EXPLAIN ANALYZE would run
+NOT_ANALYZABLE = re.compile(
+    r'\bFOR\s+(?:NO\s+KEY\s+)?UPDATE\b|\bFOR\s+(?:KEY\s+)?SHARE\b'
+    r'|\b(?:pg_(?:try_)?advisory\w*|pg_sleep\w*|pg_notify|nextval|setval|set_config|dblink\w*|lo_\w+)\s*\(',
+    re.IGNORECASE)
+
+
+def normalize_sql(statement):
+    '''
+    statement with its values replaced by ?, lists of values by (...) and
+    whitespaces collapsed, so that its executions share a fingerprint
+    '''
+    normalized = PLACEHOLDER.sub('?', statement)
+    normalized = STRING_LITERAL.sub('?', normalized)
+    normalized = NUMBER_LITERAL.sub('?', normalized)
+    normalized = VALUE_LIST.sub('(...)', normalized)
+    return WHITESPACE.sub(' ', normalized).strip()
+
+
+def get_fingerprint(normalized_sql):
+    return hashlib.md5(normalized_sql.encode()).hexdigest()
+
+
+def is_explainable(statement):
+    # EXPLAIN ANALYZE runs the statement, never explain a write
+    return statement.lstrip().upper().startswith('SELECT')
+
+
+def is_analyzable(statement):
+    # string literals may hold any text
+    return NOT_ANALYZABLE.search(STRING_LITERAL.sub("''", statement)) is None
+
+
+def explain(statement, parameters, timeout=SLOW_QUERY_EXPLAIN_TIMEOUT, analyze=True):
+    '''
+    EXPLAIN (ANALYZE, BUFFERS) plan of a SELECT statement, as text,
+    the estimated plan of EXPLAIN alone if not analyze
+    '''
+    with db.engine.connect() as conn:
+        transaction = conn.begin()
+        try:
+            conn.exec_driver_sql('SET TRANSACTION READ ONLY')
+            conn.exec_driver_sql(
+                f'SET LOCAL statement_timeout = {int(timeout * 1000)}')
+            options = '(ANALYZE, BUFFERS) ' if analyze else ''
+            rows = conn.exec_driver_sql(
+                f'EXPLAIN {options}{statement}', parameters)
+            return '\n'.join(row[0] for row in rows)
+        finally:
+            transaction.rollback()
+
+
+def record_slow_query(statement, parameters, seconds, endpoint, explain_interval=SLOW_QUERY_EXPLAIN_INTERVAL):
+    '''
+    add a slow execution to its fingerprint, sample its plan if the last one is too old
+    '''
+    normalized_sql = normalize_sql(statement)
+    fingerprint = get_fingerprint(normalized_sql)
+    now = datetime.now()
+    table = SlowQuery.__table__
+
+    stmt = insert(SlowQuery).values(
+        fingerprint=fingerprint, normalized_sql=normalized_sql[:SLOW_QUERY_MAX_TEXT], endpoint=endpoint,
+        calls=1, total_seconds=seconds, max_seconds=seconds, first_seen=now, last_seen=now)
+    stmt = stmt.on_conflict_do_update(index_elements=[table.c.fingerprint], set_={
+        'endpoint': stmt.excluded.endpoint,
+        'calls': table.c.calls + 1,
+        'total_seconds': table.c.total_seconds + stmt.excluded.total_seconds,
+        'max_seconds': func.greatest(table.c.max_seconds, stmt.excluded.max_seconds),
+        'last_seen': stmt.excluded.last_seen,
+    }).returning(table.c.plan_captured_at)
+    try:
+        plan_captured_at = db.session.execute(stmt).scalar()
+        db.session.commit()
+    except SQLAlchemyError as err:
+        app.logger.error(
+            f'fail to record slow query {fingerprint}: SQLAlchemyError {err}')
+        db.session.rollback()
+        return
+
+    if parameters is None or isinstance(parameters, list) or not is_explainable(statement):
+        return
+    if plan_captured_at is not None and now - plan_captured_at < timedelta(seconds=explain_interval):
+        return
+
+    try:
+        plan = explain(statement, parameters,
+                       analyze=is_analyzable(statement))
+    except SQLAlchemyError as err:
+        plan = f'EXPLAIN failed: {err}'
+
+    try:
+        db.session.query(SlowQuery).filter(SlowQuery.fingerprint == fingerprint).update({
+            SlowQuery.sample_statement: statement[:SLOW_QUERY_MAX_TEXT],
+            SlowQuery.sample_parameters: json.dumps(parameters, default=str)[:SLOW_QUERY_MAX_TEXT],
+            SlowQuery.sample_plan: plan,
+            SlowQuery.plan_captured_at: now,
+        }, synchronize_session=False)
+        db.session.commit()
+    except SQLAlchemyError as err:
+        app.logger.error(
+            f'fail to save the plan of slow query {fingerprint}: SQLAlchemyError {err}')
+        db.session.rollback()
+
+
+class SlowQueryRecorder:
+
+    def __init__(self, queue_size=SLOW_QUERY_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.lock = threading.Lock()
+        # None disables the capture
+        self.threshold = None
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.slow_query_start = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.threshold is None or context is None:
+            return
+        seconds = time.perf_counter() - context.slow_query_start
+        if seconds < self.threshold:
+            return
+        # the statements of the recorder itself, EXPLAIN ANALYZE included, are not recorded
+        if threading.current_thread() is self.thread or not has_app_context():
+            return
+        if has_request_context():
+            endpoint = request.endpoint or 'unmatched'
+        else:
+            endpoint = threading.current_thread().name
+        self.start(app._get_current_object())
+        try:
+            self.queue.put_nowait(
+                (statement, None if executemany else parameters, seconds, endpoint))
+        except queue.Full:
+            app.logger.warning('slow query queue full, drop a slow query')
+
+    def start(self, flask_app):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(
+                target=self.run, args=(flask_app, ), name='slow-query-recorder', daemon=True)
+            self.thread.start()
+
+    def run(self, flask_app):
+        explain_interval = flask_app.config.get(
+            'SLOW_QUERY_EXPLAIN_INTERVAL', SLOW_QUERY_EXPLAIN_INTERVAL)
+        while True:
+            statement, parameters, seconds, endpoint = self.queue.get()
+            with flask_app.app_context():
+                try:
+                    record_slow_query(statement, parameters,
+                                      seconds, endpoint, explain_interval)
+                except Exception as err:
+                    flask_app.logger.error(
+                        f'fail to record a slow query: General Error {err}')
+            self.queue.task_done()
+
+
+slow_query_recorder = SlowQueryRecorder()
+
+
+def init_slow_query(flask_app):
+    '''
+    capture the statements slower than SLOW_QUERY_THRESHOLD, None disables the capture
+    '''
+    slow_query_recorder.threshold = flask_app.config.get(
+        'SLOW_QUERY_THRESHOLD', SLOW_QUERY_THRESHOLD)
+    if not event.contains(Engine, 'before_cursor_execute', slow_query_recorder.before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute',
+                     slow_query_recorder.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute',
+                     slow_query_recorder.after_cursor_execute)
+
@@ -1,42 +1,114 @@
 from datetime import date, timedelta
 
-from sqlalchemy.sql.functions import func
 from sqlalchemy.orm.exc import NoResultFound
-from ..models import SBPActivity, db, StatisticDaily, StatisticDailySchema, AccountBlock
+from ..models import SBPActivity, StatisticAddressSketch, StatisticBucket, StatisticBucketSchema, StatisticDailyBucketSchema, StatisticTokenBucket, StatisticTokenDailySchema, Token, db
+from .hll import estimate_count, merge_all
+from .rollup import GRANULARITY_DAY, GRANULARITY_HOUR, date_range, date_to_timestamp
 
 from flask import current_app as app
 
-statistic_daily_schema = StatisticDailySchema()
+statistic_daily_schema = StatisticDailyBucketSchema()
+statistic_bucket_schema = StatisticBucketSchema()
+statistic_token_daily_schema = StatisticTokenDailySchema()
 
 
-def get_statistic_daily_by_date(src_date: date, refresh=False):
-    statistic_daily = db.session.query(StatisticDaily).get(src_date)
-    if statistic_daily and not refresh:
-        return statistic_daily
+def get_statistic_buckets(granularity, timestamp_start, timestamp_end):
+    '''
+    return the buckets of [timestamp_start, timestamp_end) read from the rollups
+    in one query, buckets without any block are filled with zeros
+    '''
+    buckets = db.session.query(StatisticBucket).filter(
+        StatisticBucket.granularity == granularity).filter(
+        StatisticBucket.bucket_start >= timestamp_start).filter(
+        StatisticBucket.bucket_start < timestamp_end).all()
+    buckets = {bucket.bucket_start: bucket for bucket in buckets}
 
-    timestamp_start = src_date.strftime("%s")
-    timestamp_end = (src_date + timedelta(days=1)).strftime("%s")
+    result = []
+    for bucket_start in range(timestamp_start, timestamp_end, granularity):
+        bucket = buckets.get(bucket_start)
+        if bucket is None:
+            bucket = StatisticBucket(granularity=granularity, bucket_start=bucket_start,
+                                     transaction_count=0, send_count=0, receive_count=0, fee=0)
+        result.append(bucket)
 
-    count = db.session.query(func.count(AccountBlock.hash)).filter(AccountBlock.timestamp >
-                                                                   timestamp_start).filter(AccountBlock.timestamp < timestamp_end).scalar()
-    statistic_daily = StatisticDaily(date=src_date, transaction_count=count)
-    save_statistic_daily(statistic_daily, override=refresh)
+    return result
 
-    return statistic_daily
 
+def get_statistic_daily_range(start_date: date, end_date: date):
+    '''
+    return the daily buckets of every day in [start_date, end_date]
+    '''
+    return get_statistic_buckets(GRANULARITY_DAY, date_to_timestamp(start_date),
+                                 date_to_timestamp(end_date) + GRANULARITY_DAY)
 
-def save_statistic_daily(statistic_daily: StatisticDaily, override=False):
-    existing_record = db.session.query(
-        StatisticDaily).get(statistic_daily.date)
 
-    if existing_record and not override:
-        return existing_record
-    elif existing_record and override:
-        db.session.merge(statistic_daily)
-    else:
-        db.session.add(statistic_daily)
+def get_statistic_hourly_range(start_date: date, end_date: date):
+    '''
+    return the hourly buckets of every day in [start_date, end_date]
+    '''
+    return get_statistic_buckets(GRANULARITY_HOUR, date_to_timestamp(start_date),
+                                 date_to_timestamp(end_date) + GRANULARITY_DAY)
 
-    db.session.commit()
+
+def get_statistic_daily_by_date(src_date: date):
+    return get_statistic_daily_range(src_date, src_date)[0]
+
+
+def db_get_token(token_id):
+    return db.session.get(Token, token_id)
+
+
+def get_statistic_token_daily_range(token_id, start_date: date, end_date: date):
+    '''
+    return the daily buckets of a token for every day in [start_date, end_date]
+    '''
+    timestamp_start = date_to_timestamp(start_date)
+    timestamp_end = date_to_timestamp(end_date) + GRANULARITY_DAY
+
+    buckets = db.session.query(StatisticTokenBucket).filter(
+        StatisticTokenBucket.granularity == GRANULARITY_DAY).filter(
+        StatisticTokenBucket.token_id == token_id).filter(
+        StatisticTokenBucket.bucket_start >= timestamp_start).filter(
+        StatisticTokenBucket.bucket_start < timestamp_end).all()
+    buckets = {bucket.bucket_start: bucket for bucket in buckets}
+
+    result = []
+    for bucket_start in range(timestamp_start, timestamp_end, GRANULARITY_DAY):
+        bucket = buckets.get(bucket_start)
+        if bucket is None:
+            bucket = StatisticTokenBucket(granularity=GRANULARITY_DAY, token_id=token_id, bucket_start=bucket_start,
+                                          transfer_count=0, volume=0, unique_senders=0, unique_receivers=0)
+        result.append(bucket)
+
+    return result
+
+
+def get_active_address_counts(start_date: date, end_date: date, windows=(7, 30)):
+    '''
+    return estimated active addresses of every day in [start_date, end_date]:
+    [(date, daily count, {window: count of the window ending this day})]
+    the sketches of the range and the longest window before it are read in one query
+    '''
+    first_date = start_date - timedelta(days=max(windows) - 1)
+    sketches = db.session.query(StatisticAddressSketch).filter(
+        StatisticAddressSketch.bucket_start >= date_to_timestamp(first_date)).filter(
+        StatisticAddressSketch.bucket_start <= date_to_timestamp(end_date)).all()
+    sketches = {sketch.bucket_start: sketch.registers for sketch in sketches}
+
+    days = [sketches.get(date_to_timestamp(current_date))
+            for current_date in date_range(first_date, end_date)]
+
+    result = []
+    for current_date in date_range(start_date, end_date):
+        day_idx = (current_date - first_date).days
+        daily_count = estimate_count(merge_all(days[day_idx:day_idx + 1]))
+        window_counts = {}
+        for window in windows:
+            window_counts[window] = estimate_count(
+                merge_all(days[day_idx - window + 1:day_idx + 1]))
+        result.append((current_date, daily_count, window_counts))
+
+    return result
 
 
 def update_sbp_activity(producer_address, last_timestamp):
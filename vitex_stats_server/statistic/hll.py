@@ -0,0 +1,101 @@
+'''
+HyperLogLog sketch for approximate distinct counts.
+
+A sketch is REGISTER_COUNT one-byte registers, stored as is in a bytea column.
+Two sketches are merged by taking the maximum of every register, so the sketch
+of a time window is the merge of the sketches of its days.
+ref: Flajolet et al., HyperLogLog: the analysis of a near-optimal cardinality estimation algorithm
+'''
+import hashlib
+import math
+
+PRECISION = 12
+REGISTER_COUNT = 1 << PRECISION
+HASH_BITS = 64
+# relative standard error of an estimate, about 1.6%
+STANDARD_ERROR = 1.04 / math.sqrt(REGISTER_COUNT)
+
+ALPHA = 0.7213 / (1 + 1.079 / REGISTER_COUNT)
+MAX_RANK = HASH_BITS - PRECISION + 1
+
+# registers never exceed MAX_RANK < 0x80, so the high bit of every byte is free
+# and registers can be compared 8 bits lane by lane on a single big integer
+LANE_HIGH_BITS = int.from_bytes(b'\x80' * REGISTER_COUNT, 'big')
+LANE_LOW_BITS = LANE_HIGH_BITS >> 7
+
+
+def get_register(value: str):
+    '''
+    return (register index, rank) of a value
+    '''
+    digest = hashlib.blake2b(value.encode(), digest_size=8).digest()
+    hashed = int.from_bytes(digest, 'big')
+    index = hashed >> (HASH_BITS - PRECISION)
+    remaining = hashed & ((1 << (HASH_BITS - PRECISION)) - 1)
+    rank = HASH_BITS - PRECISION - remaining.bit_length() + 1
+    return index, rank
+
+
+def merge_registers(left: int, right: int):
+    '''
+    register-wise maximum of two sketches packed as integers
+    '''
+    # high bit of a lane is set when left >= right in this lane
+    left_greater = (((left | LANE_HIGH_BITS) - right) & LANE_HIGH_BITS) >> 7
+    mask = left_greater * 0xff
+    return right ^ ((left ^ right) & mask)
+
+
+class HyperLogLog:
+
+    def __init__(self, registers=None):
+        if registers is None:
+            registers = bytes(REGISTER_COUNT)
+        if len(registers) != REGISTER_COUNT:
+            raise ValueError(
+                f'a sketch has {REGISTER_COUNT} registers, got {len(registers)}')
+        self.registers = bytearray(registers)
+
+    def add(self, value: str):
+        index, rank = get_register(value)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        merged = merge_registers(int.from_bytes(self.registers, 'big'),
+                                 int.from_bytes(other.registers, 'big'))
+        self.registers = bytearray(merged.to_bytes(REGISTER_COUNT, 'big'))
+        return self
+
+    def count(self):
+        return estimate_count(bytes(self.registers))
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+
+def estimate_count(registers: bytes):
+    harmonic_sum = sum(registers.count(rank) * 2.0 ** -rank
+                       for rank in range(MAX_RANK + 1))
+    estimate = ALPHA * REGISTER_COUNT * REGISTER_COUNT / harmonic_sum
+
+    # small range correction
+    zero_registers = registers.count(0)
+    if estimate <= 2.5 * REGISTER_COUNT and zero_registers > 0:
+        estimate = REGISTER_COUNT * \
+            math.log(REGISTER_COUNT / zero_registers)
+
+    return int(round(estimate))
+
+
+def merge_all(sketches):
+    '''
+    merge sketches given as bytes, None stands for an empty sketch
+    return the merged registers as bytes
+    '''
+    merged = 0
+    for registers in sketches:
+        if registers is None:
+            continue
+        merged = merge_registers(merged, int.from_bytes(registers, 'big'))
+    return merged.to_bytes(REGISTER_COUNT, 'big')
@@ -0,0 +1,325 @@
+'''
+Time-bucketed statistics maintained at ingest time.
+
+Every account block saved for the first time is added to its hourly and daily
+buckets and to the active address sketch of its day, see record_account_blocks().
+rebuild_rollups() recomputes them from the account_block table, for backfilling
+or repairing a date range.
+'''
+import calendar
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from flask import current_app as app
+from sqlalchemy import delete, distinct, literal, select, union, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.functions import func
+
+from ..models import AccountBlock, StatisticAddressSketch, StatisticBucket, StatisticTokenAddress, StatisticTokenBucket, db
+from .hll import HyperLogLog, get_register
+
+GRANULARITY_HOUR = 3600
+GRANULARITY_DAY = 86400
+GRANULARITIES = (GRANULARITY_HOUR, GRANULARITY_DAY)
+
+# ref: https://docs.vite.org/vite-docs/api/rpc/common_models_v2.html#accountblock
+SEND_BLOCK_TYPES = (1, 2, 3, 6)
+RECEIVE_BLOCK_TYPES = (4, 5, 7)
+
+ROLE_SENDER = 1
+ROLE_RECEIVER = 2
+
+
+def date_to_timestamp(src_date: date):
+    # day buckets are aligned on UTC midnight
+    return calendar.timegm(src_date.timetuple())
+
+
+def date_range(start_date: date, end_date: date):
+    current_date = start_date
+    while current_date <= end_date:
+        yield current_date
+        current_date += timedelta(days=1)
+
+
+def get_bucket_start(timestamp, granularity):
+    return timestamp - timestamp % granularity
+
+
+def to_int(src):
+    if src is None:
+        return 0
+    return int(src)
+
+
+def record_account_blocks(account_blocks):
+    '''
+    add newly saved account blocks to their buckets
+    the upserts run in the current transaction, the caller commits them together
+    with the account blocks so that a block is never counted twice
+    '''
+    buckets = {}
+    token_buckets = {}
+    token_addresses = set()
+    sketch_updates = {}
+    for account_block in account_blocks:
+        if not account_block.timestamp:
+            continue
+        day_registers = sketch_updates.setdefault(
+            get_bucket_start(account_block.timestamp, GRANULARITY_DAY), {})
+        for address in (account_block.address, account_block.from_address, account_block.to_address):
+            if not address:
+                continue
+            index, rank = get_register(address)
+            if rank > day_registers.get(index, 0):
+                day_registers[index] = rank
+        is_send = account_block.block_type in SEND_BLOCK_TYPES
+        is_receive = account_block.block_type in RECEIVE_BLOCK_TYPES
+        for granularity in GRANULARITIES:
+            bucket_start = get_bucket_start(
+                account_block.timestamp, granularity)
+            bucket = buckets.setdefault((granularity, bucket_start), {
+                'granularity': granularity,
+                'bucket_start': bucket_start,
+                'transaction_count': 0,
+                'send_count': 0,
+                'receive_count': 0,
+                'fee': 0,
+            })
+            bucket['transaction_count'] += 1
+            bucket['send_count'] += int(is_send)
+            bucket['receive_count'] += int(is_receive)
+            bucket['fee'] += to_int(account_block.fee)
+
+            if not is_send or not account_block.token_id:
+                continue
+            token_bucket = token_buckets.setdefault((granularity, account_block.token_id, bucket_start), {
+                'granularity': granularity,
+                'token_id': account_block.token_id,
+                'bucket_start': bucket_start,
+                'transfer_count': 0,
+                'volume': 0,
+                'unique_senders': 0,
+                'unique_receivers': 0,
+            })
+            token_bucket['transfer_count'] += 1
+            token_bucket['volume'] += to_int(account_block.amount)
+
+            if granularity != GRANULARITY_DAY:
+                continue
+            if account_block.address is not None:
+                token_addresses.add(
+                    (account_block.token_id, bucket_start, ROLE_SENDER, account_block.address))
+            if account_block.to_address is not None:
+                token_addresses.add(
+                    (account_block.token_id, bucket_start, ROLE_RECEIVER, account_block.to_address))
+
+    if len(token_addresses) > 0:
+        # only addresses seen for the first time in the day count as unique
+        new_token_addresses = db.session.execute(insert(StatisticTokenAddress).values([{
+            'token_id': token_id,
+            'bucket_start': bucket_start,
+            'role': role,
+            'address': address,
+        } for token_id, bucket_start, role, address in token_addresses]).on_conflict_do_nothing().returning(
+            StatisticTokenAddress.token_id, StatisticTokenAddress.bucket_start, StatisticTokenAddress.role))
+        for token_id, bucket_start, role in new_token_addresses:
+            token_bucket = token_buckets[(
+                GRANULARITY_DAY, token_id, bucket_start)]
+            if role == ROLE_SENDER:
+                token_bucket['unique_senders'] += 1
+            else:
+                token_bucket['unique_receivers'] += 1
+
+    if len(buckets) > 0:
+        stmt = insert(StatisticBucket).values(list(buckets.values()))
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['granularity', 'bucket_start'],
+            set_={
+                'transaction_count': StatisticBucket.transaction_count + stmt.excluded.transaction_count,
+                'send_count': StatisticBucket.send_count + stmt.excluded.send_count,
+                'receive_count': StatisticBucket.receive_count + stmt.excluded.receive_count,
+                'fee': StatisticBucket.fee + stmt.excluded.fee,
+            }))
+
+    if len(token_buckets) > 0:
+        stmt = insert(StatisticTokenBucket).values(
+            list(token_buckets.values()))
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['granularity', 'token_id', 'bucket_start'],
+            set_={
+                'transfer_count': StatisticTokenBucket.transfer_count + stmt.excluded.transfer_count,
+                'volume': StatisticTokenBucket.volume + stmt.excluded.volume,
+                'unique_senders': StatisticTokenBucket.unique_senders + stmt.excluded.unique_senders,
+                'unique_receivers': StatisticTokenBucket.unique_receivers + stmt.excluded.unique_receivers,
+            }))
+
+    # days are locked in order, concurrent updates cannot deadlock
+    for bucket_start, day_registers in sorted(sketch_updates.items()):
+        update_address_sketch(bucket_start, list(day_registers.items()))
+
+
+def update_address_sketch(bucket_start, registers):
+    '''
+    raise registers of the sketch of a day, registers is a list of (index, rank)
+    the row of the day is locked while its registers are merged, so concurrent
+    updates of the same day never overwrite each other
+    '''
+    sketch = HyperLogLog()
+    for index, rank in registers:
+        sketch.registers[index] = max(sketch.registers[index], rank)
+
+    stmt = insert(StatisticAddressSketch).values(
+        bucket_start=bucket_start, registers=sketch.to_bytes())
+    if db.session.execute(stmt.on_conflict_do_nothing(
+            index_elements=['bucket_start']).returning(StatisticAddressSketch.bucket_start)).first():
+        return
+
+    stored_registers = db.session.execute(select(StatisticAddressSketch.registers).where(
+        StatisticAddressSketch.bucket_start == bucket_start).with_for_update()).scalar()
+    sketch.merge(HyperLogLog(stored_registers))
+    db.session.execute(update(StatisticAddressSketch).where(
+        StatisticAddressSketch.bucket_start == bucket_start).values(registers=sketch.to_bytes()))
+
+
+def rebuild_address_sketch(timestamp_start, timestamp_end):
+    '''
+    replace the sketch of the day starting at timestamp_start
+    '''
+    in_interval = (AccountBlock.timestamp >= timestamp_start) & (
+        AccountBlock.timestamp < timestamp_end)
+    addresses = union(
+        select(AccountBlock.address).where(in_interval),
+        select(AccountBlock.from_address).where(in_interval),
+        select(AccountBlock.to_address).where(in_interval),
+    )
+
+    sketch = HyperLogLog()
+    for address, in db.session.execute(addresses):
+        if address:
+            sketch.add(address)
+
+    stmt = insert(StatisticAddressSketch).values(
+        bucket_start=timestamp_start, registers=sketch.to_bytes())
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['bucket_start'],
+        set_={'registers': stmt.excluded.registers}))
+
+
+def rebuild_rollups_of_interval(timestamp_start, timestamp_end):
+    '''
+    recompute every bucket in [timestamp_start, timestamp_end) from account_block
+    the interval must be aligned on the largest granularity
+    '''
+    for granularity in GRANULARITIES:
+        bucket_start = (AccountBlock.timestamp -
+                        AccountBlock.timestamp % granularity).label('bucket_start')
+        in_interval = (AccountBlock.timestamp >= timestamp_start) & (
+            AccountBlock.timestamp < timestamp_end)
+
+        db.session.execute(delete(StatisticBucket).where(
+            StatisticBucket.granularity == granularity).where(
+            StatisticBucket.bucket_start >= timestamp_start).where(
+            StatisticBucket.bucket_start < timestamp_end))
+        db.session.execute(delete(StatisticTokenBucket).where(
+            StatisticTokenBucket.granularity == granularity).where(
+            StatisticTokenBucket.bucket_start >= timestamp_start).where(
+            StatisticTokenBucket.bucket_start < timestamp_end))
+
+        bucket_select = select(
+            literal(granularity),
+            bucket_start,
+            func.count(),
+            func.count().filter(
+                AccountBlock.block_type.in_(SEND_BLOCK_TYPES)),
+            func.count().filter(
+                AccountBlock.block_type.in_(RECEIVE_BLOCK_TYPES)),
+            func.coalesce(func.sum(AccountBlock.fee), 0),
+        ).where(in_interval).group_by(bucket_start)
+        stmt = insert(StatisticBucket).from_select(
+            ['granularity', 'bucket_start', 'transaction_count', 'send_count', 'receive_count', 'fee'], bucket_select)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['granularity', 'bucket_start'],
+            set_={
+                'transaction_count': stmt.excluded.transaction_count,
+                'send_count': stmt.excluded.send_count,
+                'receive_count': stmt.excluded.receive_count,
+                'fee': stmt.excluded.fee,
+            }))
+
+        is_transfer = in_interval & AccountBlock.block_type.in_(
+            SEND_BLOCK_TYPES) & AccountBlock.token_id.isnot(None)
+        if granularity == GRANULARITY_DAY:
+            unique_senders = func.count(distinct(AccountBlock.address))
+            unique_receivers = func.count(distinct(AccountBlock.to_address))
+        else:
+            unique_senders = literal(0)
+            unique_receivers = literal(0)
+        token_bucket_select = select(
+            literal(granularity),
+            AccountBlock.token_id,
+            bucket_start,
+            func.count(),
+            func.coalesce(func.sum(AccountBlock.amount), 0),
+            unique_senders,
+            unique_receivers,
+        ).where(is_transfer).group_by(AccountBlock.token_id, bucket_start)
+        stmt = insert(StatisticTokenBucket).from_select(
+            ['granularity', 'token_id', 'bucket_start', 'transfer_count', 'volume', 'unique_senders', 'unique_receivers'], token_bucket_select)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['granularity', 'token_id', 'bucket_start'],
+            set_={
+                'transfer_count': stmt.excluded.transfer_count,
+                'volume': stmt.excluded.volume,
+                'unique_senders': stmt.excluded.unique_senders,
+                'unique_receivers': stmt.excluded.unique_receivers,
+            }))
+
+        if granularity != GRANULARITY_DAY:
+            continue
+        db.session.execute(delete(StatisticTokenAddress).where(
+            StatisticTokenAddress.bucket_start >= timestamp_start).where(
+            StatisticTokenAddress.bucket_start < timestamp_end))
+        token_address_select = union(
+            select(AccountBlock.token_id, bucket_start, literal(ROLE_SENDER), AccountBlock.address).where(
+                is_transfer).where(AccountBlock.address.isnot(None)),
+            select(AccountBlock.token_id, bucket_start, literal(ROLE_RECEIVER), AccountBlock.to_address).where(
+                is_transfer).where(AccountBlock.to_address.isnot(None)),
+        )
+        db.session.execute(insert(StatisticTokenAddress).from_select(
+            ['token_id', 'bucket_start', 'role', 'address'], token_address_select).on_conflict_do_nothing())
+
+    for day_start in range(timestamp_start, timestamp_end, GRANULARITY_DAY):
+        rebuild_address_sketch(day_start, day_start + GRANULARITY_DAY)
+
+
+def rebuild_rollups_of_date(flask_app, target_date: date):
+    with flask_app.app_context():
+        timestamp_start = date_to_timestamp(target_date)
+        try:
+            rebuild_rollups_of_interval(
+                timestamp_start, timestamp_start + GRANULARITY_DAY)
+            db.session.commit()
+        except SQLAlchemyError as err:
+            db.session.rollback()
+            app.logger.error(
+                f'fail to rebuild rollups of {target_date}: SQLAlchemyError {err}')
+            return False
+        finally:
+            db.session.remove()
+        app.logger.info(f'rebuilt rollups of {target_date}')
+    return True
+
+
+def rebuild_rollups(start_date: date, end_date: date, workers=4):
+    '''
+    rebuild the buckets of every day in [start_date, end_date], one day per task
+    return the number of days rebuilt successfully
+    '''
+    # each worker thread pushes its own app context, hence its own DB session
+    flask_app = app._get_current_object()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda target_date: rebuild_rollups_of_date(
+            flask_app, target_date), date_range(start_date, end_date))
+        return sum(1 for result in results if result)
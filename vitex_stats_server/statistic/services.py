@@ -1,35 +1,107 @@
 from flask import request, jsonify, Blueprint
 from flask import current_app as app
-from datetime import datetime, timedelta
+from datetime import datetime
 
-from .data_accessor import get_statistic_daily_by_date, statistic_daily_schema
+from .hll import STANDARD_ERROR
+
+from .data_accessor import db_get_token, get_active_address_counts, get_statistic_daily_range, get_statistic_hourly_range, get_statistic_token_daily_range, statistic_bucket_schema, statistic_daily_schema, statistic_token_daily_schema
 
 bp_statistic = Blueprint('statistic', __name__, url_prefix='/statistic')
 
+MAX_ACTIVE_ADDRESS_DAYS = 366
+
 
 @bp_statistic.route('/get_daily_statistics/<start_date_str>/<end_date_str>', methods=('GET', 'POST'))
 def get_account_block_by_hash(start_date_str, end_date_str):
     if request.method == 'POST':
         pass
 
-    start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-    end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+    start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+    end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
 
     if start_date > end_date:
         return jsonify({"error": f'start_date {start_date} > end_date {end_date}'})
 
-    statistics_arr = []
-    current_date = start_date
-    while current_date <= end_date:
-        daily_statistic = get_statistic_daily_by_date(
-            current_date)
-        if daily_statistic is None:
-            continue
-        statistics_arr.append(daily_statistic)
-        current_date += timedelta(days=1)
+    statistics_arr = get_statistic_daily_range(start_date, end_date)
 
     result = {
         'err': 'ok',
         'result': statistic_daily_schema.dump(statistics_arr, many=True)
     }
     return jsonify(result)
+
+
+@bp_statistic.route('/get_hourly_statistics/<start_date_str>/<end_date_str>', methods=('GET', 'POST'))
+def get_hourly_statistics(start_date_str, end_date_str):
+    if request.method == 'POST':
+        pass
+
+    start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+    end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+
+    if start_date > end_date:
+        return jsonify({"error": f'start_date {start_date} > end_date {end_date}'})
+
+    statistics_arr = get_statistic_hourly_range(start_date, end_date)
+
+    result = {
+        'err': 'ok',
+        'result': statistic_bucket_schema.dump(statistics_arr, many=True)
+    }
+    return jsonify(result)
+
+
+@bp_statistic.route('/token_daily/<token_id>/<start_date_str>/<end_date_str>', methods=('GET', 'POST'))
+def get_token_daily_statistics(token_id, start_date_str, end_date_str):
+    if request.method == 'POST':
+        pass
+
+    start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+    end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+
+    if start_date > end_date:
+        return jsonify({"error": f'start_date {start_date} > end_date {end_date}'})
+
+    token = db_get_token(token_id)
+    if token is None:
+        return jsonify({'err': f'cannot find token {token_id}', 'result': []}), 404
+
+    statistics_arr = get_statistic_token_daily_range(
+        token_id, start_date, end_date)
+
+    result = {
+        'err': 'ok',
+        'tokenId': token_id,
+        'decimals': token.decimals,
+        'result': statistic_token_daily_schema.dump(statistics_arr, many=True)
+    }
+    return jsonify(result)
+
+
+@bp_statistic.route('/active_addresses/<start_date_str>/<end_date_str>', methods=('GET', 'POST'))
+def get_active_addresses(start_date_str, end_date_str):
+    if request.method == 'POST':
+        pass
+
+    start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+    end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+
+    if start_date > end_date:
+        return jsonify({"error": f'start_date {start_date} > end_date {end_date}'})
+    if (end_date - start_date).days >= MAX_ACTIVE_ADDRESS_DAYS:
+        return jsonify({"error": f'range must be shorter than {MAX_ACTIVE_ADDRESS_DAYS} days'})
+
+    active_address_counts = get_active_address_counts(start_date, end_date)
+
+    result = {
+        'err': 'ok',
+        # estimates are within 2 * relativeError of the exact count 95% of the time
+        'relativeError': STANDARD_ERROR,
+        'result': [{
+            'date': current_date.isoformat(),
+            'activeAddresses': daily_count,
+            'activeAddresses7d': window_counts[7],
+            'activeAddresses30d': window_counts[30],
+        } for current_date, daily_count, window_counts in active_address_counts]
+    }
+    return jsonify(result)
@@ -0,0 +1,79 @@
+'''
+Migration of the hash, address and signature columns between text and bytea, see column_types.py.
+
+`flask manage convert-storage binary` rewrites each table once with every column
+converted, its indexes are rebuilt meanwhile and the table is locked: stop the
+daemons and the server, convert, then set BINARY_STORAGE = True and restart.
+`flask manage convert-storage text` converts back. Columns already converted are
+skipped, an interrupted migration completes when run again.
+'''
+import logging
+
+from sqlalchemy import text
+
+from .column_types import BinaryString
+from .models import db
+from .partition import get_unpartitioned_name, table_exists
+
+
+def get_binary_columns():
+    '''
+    {table name: [(column name, type)]} of the columns stored as bytea in binary storage
+    '''
+    tables = {}
+    for table in db.metadata.sorted_tables:
+        columns = [(column.name, column.type) for column in table.columns
+                   if isinstance(column.type, BinaryString)]
+        if columns:
+            tables[table.name] = columns
+    return tables
+
+
+def get_column_types(table_name):
+    return dict(db.session.execute(text(
+        'SELECT column_name, data_type FROM information_schema.columns '
+        'WHERE table_schema = current_schema() AND table_name = :name'), {'name': table_name}).all())
+
+
+def convert_table(table_name, columns, binary):
+    '''
+    convert the columns of table_name not converted yet in one ALTER TABLE,
+    return the names of the columns converted
+    '''
+    column_types = get_column_types(table_name)
+    alterations = []
+    converted = []
+    for name, column_type in columns:
+        is_binary = column_types.get(name) == 'bytea'
+        if name not in column_types or is_binary == binary:
+            continue
+        column = f'"{name}"'
+        if binary:
+            alterations.append(
+                f'ALTER COLUMN {column} TYPE bytea USING {column_type.to_binary_sql(column)}')
+        else:
+            length = f'({column_type.impl.length})' if column_type.impl.length else ''
+            alterations.append(
+                f'ALTER COLUMN {column} TYPE varchar{length} USING {column_type.to_text_sql(column)}')
+        converted.append(name)
+    if alterations:
+        db.session.execute(
+            text(f'ALTER TABLE {table_name} {", ".join(alterations)}'))
+        db.session.commit()
+        logging.info(f'converted {table_name} columns {", ".join(converted)}')
+    return converted
+
+
+def convert_storage(binary):
+    '''
+    convert the columns of get_binary_columns() to bytea if binary, else to text,
+    each table in its own transaction. tables waiting for partition-tables are
+    converted too. return the number of columns converted
+    '''
+    count = 0
+    for table_name, columns in get_binary_columns().items():
+        for name in (table_name, get_unpartitioned_name(table_name)):
+            if table_exists(name):
+                count += len(convert_table(name, columns, binary))
+    return count
+
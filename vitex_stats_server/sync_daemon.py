@@ -3,7 +3,6 @@ import logging
 from datetime import datetime
 
 import daemon
-import requests
 
 from flask import current_app as app
 from sqlalchemy.exc import SQLAlchemyError, NoResultFound
@@ -12,6 +11,8 @@ from vitex_stats_server.statistic.data_accessor import update_sbp_activity
 
 from .ledger.data_accessor import gvite_get_account, gvite_get_account_block_by_hash, gvite_get_snapshot_block, save_account_block_from_dict, save_account_from_dict, save_snapshot_block_dict
 from vitex_stats_server.models import Account,  db
+from vitex_stats_server.partition import PARTITION_CHECK_INTERVAL, ensure_partitions
+from vitex_stats_server.rpc import rpc_post
 
 ERR_REQUIRE_NEW_FILTER = -32002
 ERR_NO_RESULT = -1
@@ -44,7 +45,13 @@ def sync_loop():
         return
     logging.info(f'snapshot block filter id: {snapshot_block_filter}')
 
+    partition_check_time = 0
     while True:
+        # the partitions of the coming months are created ahead
+        if time.monotonic() - partition_check_time > PARTITION_CHECK_INTERVAL:
+            ensure_partitions()
+            partition_check_time = time.monotonic()
+
         err, account_block_changes = get_account_block_changes(
             account_block_filter)
         if err == ERR_REQUIRE_NEW_FILTER:
@@ -123,7 +130,8 @@ def sync_loop():
                 producer_addresses_to_update.append(
                     snapshot_block['producer'])
         for producer_address in producer_addresses_to_update:
-            touch_sbp_activity(producer_address, timestamp_now)
+            # read on each request, see get_active_sbp_json_da()
+            update_sbp_activity(producer_address, timestamp_now)
 
 
 def register_account_block_filter():
@@ -135,8 +143,7 @@ def register_account_block_filter():
         "params": []
     }
 
-    response = requests.post(
-        app.config['URL_RPC'],  json=request_body, headers=headers)
+    response = rpc_post(request_body, headers)
 
     result = response.json().get('result', {})
 
@@ -156,8 +163,7 @@ def get_account_block_changes(filter_id):
         "params": [filter_id, ]
     }
 
-    response = requests.post(
-        app.config['URL_RPC'],  json=request_body, headers=headers)
+    response = rpc_post(request_body, headers)
     response = response.json()
 
     err = response.get('error', None)
@@ -239,8 +245,7 @@ def register_snapshot_block_filter():
         "params": []
     }
 
-    response = requests.post(
-        app.config['URL_RPC'],  json=request_body, headers=headers)
+    response = rpc_post(request_body, headers)
 
     result = response.json().get('result', None)
 
@@ -260,8 +265,7 @@ def get_snapshot_block_changes(filter_id):
         "params": [filter_id, ]
     }
 
-    response = requests.post(
-        app.config['URL_RPC'],  json=request_body, headers=headers)
+    response = rpc_post(request_body, headers)
     response = response.json()
 
     err = response.get('error', None)
@@ -287,7 +291,3 @@ def get_snapshot_block_changes(filter_id):
         snapshot_block_changes = []
 
     return None, snapshot_block_changes
-
-
-def touch_sbp_activity(producer_address, timestamp):
-    update_sbp_activity(producer_address, timestamp)
@@ -2,12 +2,17 @@ from datetime import date, datetime
 import logging
 from sqlalchemy.orm.session import make_transient
 from vitex_stats_server.ledger.data_accessor import gvite_get_account, gvite_get_account_block_by_hash, gvite_get_snapshot_block, gvite_get_chunks, save_account_block_from_dict, save_account_from_dict, save_snapshot_block_dict
+from vitex_stats_server.ledger.holder_rank import db_get_top_holders, snapshot_top_holders
 from vitex_stats_server.models import Account, SBPSchema, db, Token, TokenSchema
-from vitex_stats_server.contract.data_accessor import db_delete_sbp, db_get_all_sbp, get_sbp_reward_gvite, get_token_info_list_da, get_token_info_list_gvite, gvite_get_account_quota, save_sbp_reward
+from vitex_stats_server.contract.data_accessor import create_token_empty, db_delete_sbp, db_get_all_sbp, get_sbp_reward_gvite, get_token_info_list_gvite, gvite_get_account_quota, save_sbp_reward
 from vitex_stats_server.contract.data_accessor import db_save_sbp,  get_sbp_gvite, get_sbp_list_gvite
 from sqlalchemy.exc import SQLAlchemyError, NoResultFound
 
 from vitex_stats_server.statistic.data_accessor import get_statistic_daily_by_date
+from vitex_stats_server.cache import bump_version
+from vitex_stats_server.contract.sbp_directory import SBP_DIRECTORY_VERSION_KEY
+from vitex_stats_server.contract.token_catalog import TOKEN_CATALOG_VERSION_KEY
+from vitex_stats_server.statistic.rollup import rebuild_rollups
 
 
 def download_snapshot_block_by_height(height, recursive=False):
@@ -67,41 +72,10 @@ def download_tokens():
 
         pageIdx += 1
 
+    bump_version(TOKEN_CATALOG_VERSION_KEY)
     logging.info('downloaded all tokens')
 
 
-def create_token_empty(token_id):
-    token = Token(token_id=token_id,
-                  token_name=f'unknown',
-                  token_symbol=f'UNKOWN',
-                  total_supply=0,
-                  decimals=18,
-                  owner='',
-                  is_reissuable=False,
-                  max_supply=0,
-                  is_owner_burn_only=False,
-                  index=0)
-
-    q = db.session.query(Token).filter_by(token_id=token.token_id)
-    try:
-        existing_token = q.one()
-    except NoResultFound:
-        db.session.add(token)
-    else:
-        logging.info(f'token {token.token_id} already exists, updating')
-        db.session.merge(token)
-    finally:
-        try:
-            db.session.commit()
-        except SQLAlchemyError as err:
-            logging.error(f'Fail to commit token {token.token_id}')
-            logging.error(f'SQLAlchemyError {err}')
-
-        except Exception as err:
-            logging.error(f'Fail to commit token {token.token_id}')
-            logging.error(f'General Error {err}')
-
-
 def copy_token(src_token_id, dest_token_id):
     src_token = db.session.query(Token).get(src_token_id)
     if src_token is None:
@@ -128,6 +102,8 @@ def copy_token(src_token_id, dest_token_id):
         logging.error(f'Fail to commit token {src_token.token_id}')
         logging.error(f'General Error {err}')
 
+    bump_version(TOKEN_CATALOG_VERSION_KEY)
+
 
 def rank_sbp(sbp_list):
     sbp_list.sort(key=lambda x: int(x['votes']), reverse=True)
@@ -152,6 +128,7 @@ def refresh_sbp_list():
     for sbp in all_sbps:
         if sbp.name not in sbp_names:
             db_delete_sbp(sbp.name)
+    bump_version(SBP_DIRECTORY_VERSION_KEY)
 
     logging.info('done refreshing SBP list')
 
@@ -243,12 +220,16 @@ def update_sbp_reward(timestamp: int):
 
 
 def update_daily_statistics(target_date: date):
-    return get_statistic_daily_by_date(target_date, refresh=True)
+    rebuild_rollups(target_date, target_date, workers=1)
+    return get_statistic_daily_by_date(target_date)
 
 
 def refresh_top_holders(top_n: int = 100):
-    top_holders = db.session.query(Account).order_by(
-        Account.vite_balance.desc()).limit(top_n).all()
+    # the ranking comes from the snapshot taken by recompute-holder-ranks
+    top_holders = db_get_top_holders(top_n)
+    if len(top_holders) == 0:
+        snapshot_top_holders()
+        top_holders = db_get_top_holders(top_n)
     for i, holder in enumerate(top_holders):
         account_dict = gvite_get_account(holder.address)
         if account_dict is None: